@@ -1,61 +1,210 @@
+import base64
+import hashlib
+import hmac
 import json
 import os
-from pan123 import Pan123
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bandwidth
+import http_session
+from pan123 import Pan123, DEFAULT_UPLOAD_JOURNAL, DEFAULT_MD5_CACHE
+from listing_cache import ListingCache
+from md5_cache import file_md5
+from path_index import PathIndex
+from tree_walker import walk_tree, WalkLimitReached
+from upload_jobs import UploadJobs
 
-# 全局实例
+# 全局实例；所有操作都显式传入目录/文件ID，不修改实例的当前目录，可被多个线程同时使用
 _pan_instance = None
+_pan_lock = threading.Lock()
+
+# 路径索引的有效期（秒）
+PATH_INDEX_TTL = 300
+
+# 路径 -> 文件信息 索引，避免每次都从根目录逐级列目录
+_path_index = PathIndex(ttl=PATH_INDEX_TTL)
+
+# 目录列表缓存：超过软过期时间后先返回旧列表并在后台刷新，超过硬过期时间才重新获取
+LISTING_SOFT_TTL = 30
+LISTING_HARD_TTL = 600
+
+# 文件夹ID -> 目录列表 缓存，由上传/创建/删除操作精确失效
+_listing_cache = ListingCache(soft_ttl=LISTING_SOFT_TTL, hard_ttl=LISTING_HARD_TTL)
+
+# 根目录没有对应的文件条目，用一个虚拟条目表示
+_ROOT_ITEM = {"FileId": 0, "FileName": "", "Type": 1}
+
+# 遍历目录树时同时列出的文件夹数
+WALK_MAX_WORKERS = 4
+
+# 上传文件夹时同时创建文件夹/上传文件的线程数
+UPLOAD_FOLDER_WORKERS = 4
+
+# 批量上传小文件时同时进行的文件数
+UPLOAD_MANY_WORKERS = 16
+
+# 分页cursor的签名密钥：cursor中的文件夹ID和路径会被写入路径索引，必须是本服务生成的；
+# 默认每次启动随机生成，多个进程共用cursor时在settings.json的cursor-secret中设置相同的密钥
+_cursor_key = os.urandom(32)
+
+# 后台上传任务：同时上传的文件数（settings.json 的 upload-job-workers）；
+# 合并分块后由轮询线程确认完成，不占用上传线程
+UPLOAD_JOB_WORKERS = 8
+_upload_jobs = UploadJobs(max_workers=UPLOAD_JOB_WORKERS)
 
 def _get_pan_instance():
     """获取Pan123实例，如果未初始化则初始化"""
     global _pan_instance
     if _pan_instance is None:
-        # 读取settings.json配置文件
-        settings_path = "settings.json"
-        if os.path.exists(settings_path):
-            with open(settings_path, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-        else:
-            settings = {}
-        
-        # 创建Pan123实例
-        _pan_instance = Pan123()
+        with _pan_lock:
+            if _pan_instance is None:
+                # 读取settings.json配置文件
+                settings_path = "settings.json"
+                if os.path.exists(settings_path):
+                    with open(settings_path, 'r', encoding='utf-8') as f:
+                        settings = json.load(f)
+                else:
+                    settings = {}
+                
+                # 创建Pan123实例
+                _configure_http(settings)
+                _pan_instance = Pan123(**_pan_options(settings))
     return _pan_instance
 
-def _find_folder_by_name(name, parent_id=0):
-    """根据文件夹名称查找文件夹ID"""
-    pan = _get_pan_instance()
-    pan.parent_file_id = parent_id
-    pan.get_dir()
+def _configure_http(settings):
+    """
+    按settings.json中的http-pool设置各类主机的连接池大小，按bandwidth设置上传/下载限速，
+    按upload-job-workers设置同时进行的后台上传任务数，按cursor-secret设置分页cursor的签名密钥
+    """
+    global _cursor_key
+    if settings.get("http-pool"):
+        http_session.configure(pool_sizes=settings["http-pool"])
+    if settings.get("bandwidth"):
+        bandwidth.configure(
+            rate=settings["bandwidth"].get("rate"),
+            user_rate=settings["bandwidth"].get("user-rate"),
+        )
+    _upload_jobs.set_max_workers(settings.get("upload-job-workers", UPLOAD_JOB_WORKERS))
+    if settings.get("cursor-secret"):
+        _cursor_key = settings["cursor-secret"].encode("utf-8")
+
+def _pan_options(settings):
+    """从settings.json读取Pan123的可选参数"""
+    return {
+        "page_size": settings.get("list-page-size", 100),
+        "list_max_workers": settings.get("list-max-workers", 4),
+        "upload_journal": settings.get("upload-journal", DEFAULT_UPLOAD_JOURNAL),
+        "md5_cache": settings.get("md5-cache", DEFAULT_MD5_CACHE),
+    }
+
+def _load_dir(folder_id, folder_path):
+    """从123pan获取目录内容，并把子项写入路径索引"""
+    code, items = _get_pan_instance().list_dir(folder_id)
+    if code != 0:
+        raise Exception(f"获取目录失败: {code}")
+    _path_index.put_children(folder_path, items)
+    return items
+
+def _list_dir(folder_id, folder_path, refresh=False):
+    """
+    列出目录内容，优先使用目录列表缓存
     
-    for item in pan.list:
-        if item["Type"] == 1 and item["FileName"] == name:
-            return item["FileId"]
-    return None
+    参数:
+        folder_id: 文件夹ID
+        folder_path: 文件夹路径，用于写入路径索引
+        refresh: 为True时忽略缓存，重新获取
+    """
+    if refresh:
+        _listing_cache.invalidate(folder_id)
+    return _listing_cache.get(folder_id, lambda: _load_dir(folder_id, folder_path))
 
-def _get_file_by_path(path):
-    """根据路径获取文件或文件夹信息"""
-    if not path.startswith("/"):
-        path = "/" + path
+def _invalidate_parent(path):
+    """使路径所在目录的列表缓存失效"""
+    parent_path = _path_index.normalize(path).rsplit("/", 1)[0] or "/"
+    parent = _ROOT_ITEM if parent_path == "/" else _path_index.get(parent_path)
+    if parent is None:
+        # 不知道父目录ID时只能全部失效
+        _listing_cache.clear()
+    else:
+        _listing_cache.invalidate(parent["FileId"])
+
+def _resolve_path(path, full=False):
+    """
+    根据路径获取文件或文件夹条目，优先使用路径索引
     
+    参数:
+        path: 文件或文件夹路径
+        full: 为True时保证返回完整的列表条目（获取下载链接、删除时需要），
+              由创建/上传写入的不完整条目会通过重新列出父目录补全
+    
+    返回:
+        条目字典，找不到时返回None
+    """
+    path = _path_index.normalize(path)
+    if path == "/":
+        return _ROOT_ITEM
+    
+    item = _path_index.get(path)
+    if item is not None:
+        if full and "S3KeyFlag" not in item:
+            parent_path = path.rsplit("/", 1)[0] or "/"
+            parent = _resolve_path(parent_path)
+            if parent is None:
+                return None
+            _list_dir(parent["FileId"], parent_path, refresh=True)
+            return _path_index.get(path)
+        return item
+    
+    # 从最近的已索引祖先目录开始逐级查找
     parts = path.strip("/").split("/")
+    current_path = "/"
     current_id = 0
+    start = 0
+    for i in range(len(parts) - 1, 0, -1):
+        ancestor_path = "/" + "/".join(parts[:i])
+        ancestor = _path_index.get(ancestor_path)
+        if ancestor is not None:
+            current_path = ancestor_path
+            current_id = ancestor["FileId"]
+            start = i
+            break
     
-    for part in parts:
-        found = False
-        pan = _get_pan_instance()
-        pan.parent_file_id = current_id
-        pan.get_dir()
-        
-        for item in pan.list:
-            if item["FileName"] == part:
-                current_id = item["FileId"]
-                found = True
+    item = None
+    for part in parts[start:]:
+        item = None
+        for child in _list_dir(current_id, current_path):
+            if child["FileName"] == part:
+                item = child
                 break
-        
-        if not found:
+        if item is None:
             return None
+        current_path = PathIndex.join(current_path, part)
+        current_id = item["FileId"]
     
-    return current_id
+    return item
+
+def _find_folder_by_name(name, parent_id=0):
+    """根据文件夹名称查找文件夹ID"""
+    if parent_id == 0:
+        item = _resolve_path("/" + name)
+        if item is not None and item["Type"] == 1:
+            return item["FileId"]
+        return None
+    
+    code, items = _get_pan_instance().list_dir(parent_id)
+    
+    for item in items:
+        if item["Type"] == 1 and item["FileName"] == name:
+            return item["FileId"]
+    return None
+
+def _get_file_by_path(path):
+    """根据路径获取文件或文件夹信息"""
+    item = _resolve_path(path)
+    if item is None:
+        return None
+    return item["FileId"]
 
 def login(username=None, password=None):
     """
@@ -92,12 +241,78 @@ def login(username=None, password=None):
         
         # 创建新的Pan123实例并登录
         global _pan_instance
-        _pan_instance = Pan123(readfile=False, user_name=use_username, pass_word=use_password)
+        _configure_http(settings)
+        _pan_instance = Pan123(readfile=False, user_name=use_username, pass_word=use_password, **_pan_options(settings))
+        _path_index.clear()
+        _listing_cache.clear()
         
         return {"status": "success"}
     except Exception as e:
         return {"error": str(e)}
 
+def _format_item(item):
+    """把接口返回的条目转换为对外的文件夹/文件格式"""
+    if item["Type"] == 1:  # 文件夹
+        return {
+            "id": str(item["FileId"]),
+            "name": item["FileName"]
+        }
+    
+    # 文件
+    size = item["Size"]
+    if size > 1024 * 1024 * 1024:
+        size_str = f"{size / (1024 * 1024 * 1024):.1f}GB"
+    elif size > 1024 * 1024:
+        size_str = f"{size / (1024 * 1024):.1f}MB"
+    elif size > 1024:
+        size_str = f"{size / 1024:.1f}KB"
+    else:
+        size_str = f"{size}B"
+    
+    return {
+        "id": str(item["FileId"]),
+        "name": item["FileName"],
+        "size": size_str
+    }
+
+def _format_items(items):
+    folders = []
+    files = []
+    
+    for item in items:
+        if item["Type"] == 1:
+            folders.append(_format_item(item))
+        else:
+            files.append(_format_item(item))
+    
+    return {
+        "folder": folders,
+        "file": files
+    }
+
+def _get_home_folder():
+    """
+    获取主目录（settings.json中的default-path，未设置时为根目录）
+    
+    返回:
+        (文件夹ID, 文件夹路径)，default-path不合法时返回(None, None)
+    """
+    # 检查settings.json中的default-path
+    settings_path = "settings.json"
+    default_path = None
+    if os.path.exists(settings_path):
+        with open(settings_path, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+            default_path = settings.get("default-path")
+    
+    if default_path:
+        # 查找默认路径对应的文件夹ID
+        folder_id = _find_folder_by_name(default_path)
+        if folder_id is None:
+            return None, None
+        return folder_id, "/" + default_path
+    return 0, "/"
+
 def list():
     """
     列出当前目录下的文件和文件夹
@@ -110,57 +325,11 @@ def list():
         或 {"error": "主目录不合法"}
     """
     try:
-        pan = _get_pan_instance()
-        
-        # 检查settings.json中的default-path
-        settings_path = "settings.json"
-        default_path = None
-        if os.path.exists(settings_path):
-            with open(settings_path, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                default_path = settings.get("default-path")
-        
-        if default_path:
-            # 查找默认路径对应的文件夹ID
-            folder_id = _find_folder_by_name(default_path)
-            if folder_id is None:
-                return {"error": "主目录不合法"}
-            pan.parent_file_id = folder_id
-        else:
-            pan.parent_file_id = 0
-        
-        pan.get_dir()
-        
-        folders = []
-        files = []
-        
-        for item in pan.list:
-            if item["Type"] == 1:  # 文件夹
-                folders.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"]
-                })
-            else:  # 文件
-                size = item["Size"]
-                if size > 1024 * 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024 * 1024):.1f}GB"
-                elif size > 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024):.1f}MB"
-                elif size > 1024:
-                    size_str = f"{size / 1024:.1f}KB"
-                else:
-                    size_str = f"{size}B"
-                
-                files.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"],
-                    "size": size_str
-                })
+        folder_id, folder_path = _get_home_folder()
+        if folder_id is None:
+            return {"error": "主目录不合法"}
         
-        return {
-            "folder": folders,
-            "file": files
-        }
+        return _format_items(_list_dir(folder_id, folder_path))
     except Exception as e:
         return {"error": str(e)}
 
@@ -183,40 +352,265 @@ def list_folder(path):
         if folder_id is None:
             return {"error": "没有找到对应文件夹或文件"}
         
+        return _format_items(_list_dir(folder_id, path))
+    except Exception as e:
+        return {"error": str(e)}
+
+def _cursor_signature(payload):
+    digest = hmac.new(_cursor_key, payload.encode("ascii"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+def _encode_cursor(state):
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    payload = base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+    return payload + "." + _cursor_signature(payload)
+
+def _decode_cursor(cursor):
+    """校验签名并解出cursor；被篡改或不是本服务生成的cursor返回None"""
+    try:
+        payload, signature = cursor.split(".")
+        if not hmac.compare_digest(signature, _cursor_signature(payload)):
+            return None
+        raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        state = json.loads(raw.decode("utf-8"))
+        for key in ("id", "page", "size", "up", "skip"):
+            int(state[key])
+        return state
+    except Exception:
+        return None
+
+def list_page(path="/", page=1, page_size=20, keyword="", file_type="", cursor=None):
+    """
+    分页列出目录，只向123pan请求所需的那一页，而不是列出整个目录
+    
+    参数:
+        path: 文件夹路径，"/"为主目录
+        page: 页码，从1开始
+        page_size: 每页条目数
+        keyword: 按名称过滤（可选，不区分大小写）
+        file_type: 按扩展名过滤文件（可选），文件夹不受影响
+        cursor: 上一次返回的next_cursor（可选），传入时忽略其他参数，直接从上次停下的位置继续
+    
+    返回:
+        {
+            "folder": [{"id": "1", "name": "第三季"}, ...],
+            "file": [{"id": "4", "name": "1.mp4", "size": "3.5GB"}, ...],
+            "total": 1234,
+            "page": 1,
+            "page_size": 20,
+            "next_cursor": "..."
+        }
+        没有过滤条件时total为目录条目总数；有过滤条件时只有扫描到目录末尾才知道total，否则为None
+        没有下一页时next_cursor为None
+        或 {"error": "错误信息"}
+    """
+    try:
+        if cursor:
+            state = _decode_cursor(cursor)
+            if state is None:
+                return {"error": "cursor不合法"}
+            folder_id = int(state["id"])
+            page = int(state["page"])
+            page_size = int(state["size"])
+            keyword = state.get("kw", "")
+            file_type = state.get("ft", "")
+            folder_path = state.get("path")
+        else:
+            if page < 1 or page_size < 1:
+                return {"error": "page和page_size必须为正整数"}
+            if path == "/":
+                folder_id, folder_path = _get_home_folder()
+                if folder_id is None:
+                    return {"error": "主目录不合法"}
+            else:
+                folder_id = _get_file_by_path(path)
+                if folder_id is None:
+                    return {"error": "没有找到对应文件夹或文件"}
+                folder_path = path
+        
         pan = _get_pan_instance()
-        pan.parent_file_id = folder_id
-        pan.get_dir()
+        keyword = keyword.lower()
+        file_type = file_type.lower()
         
-        folders = []
-        files = []
+        def remember(items):
+            if folder_path:
+                for item in items:
+                    _path_index.put(PathIndex.join(folder_path, item["FileName"]), item)
         
-        for item in pan.list:
-            if item["Type"] == 1:  # 文件夹
-                folders.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"]
-                })
-            else:  # 文件
-                size = item["Size"]
-                if size > 1024 * 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024 * 1024):.1f}GB"
-                elif size > 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024):.1f}MB"
-                elif size > 1024:
-                    size_str = f"{size / 1024:.1f}KB"
-                else:
-                    size_str = f"{size}B"
-                
-                files.append({
-                    "id": str(item["FileId"]),
-                    "name": item["FileName"],
-                    "size": size_str
-                })
+        def next_state(up, skip):
+            return {
+                "id": folder_id, "page": page + 1, "size": page_size,
+                "kw": keyword, "ft": file_type, "path": folder_path,
+                "up": up, "skip": skip,
+            }
         
-        return {
-            "folder": folders,
-            "file": files
+        if not keyword and not file_type:
+            # 无过滤条件：请求的页直接对应接口的 Page/limit
+            code, items, total = pan.get_dir_page(folder_id, page, page_size)
+            if code != 0:
+                return {"error": f"获取目录失败: {code}"}
+            remember(items)
+            result = _format_items(items)
+            result.update({
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "next_cursor": _encode_cursor(next_state(page + 1, 0)) if page * page_size < total else None
+            })
+            return result
+        
+        def matches(item):
+            name = item["FileName"].lower()
+            if keyword and keyword not in name:
+                return False
+            if file_type and item["Type"] != 1 and not name.endswith("." + file_type):
+                return False
+            return True
+        
+        # 有过滤条件：逐页扫描目录，凑够一页匹配项就停止，并记下停止的位置供cursor继续
+        if cursor:
+            start_page, skip, to_skip = int(state["up"]), int(state["skip"]), 0
+        else:
+            start_page, skip, to_skip = 1, 0, (page - 1) * page_size
+        matched = []
+        seen = 0
+        next_cursor = None
+        up = start_page
+        for items in pan.iter_dir(folder_id, pages=True, start_page=start_page):
+            remember(items)
+            for idx in range(skip, len(items)):
+                if not matches(items[idx]):
+                    continue
+                seen += 1
+                if to_skip:
+                    to_skip -= 1
+                    continue
+                matched.append(items[idx])
+                if len(matched) >= page_size:
+                    next_cursor = _encode_cursor(next_state(up, idx + 1))
+                    break
+            if next_cursor:
+                break
+            skip = 0
+            up += 1
+        
+        result = _format_items(matched)
+        result.update({
+            "total": seen if next_cursor is None and not cursor else None,
+            "page": page,
+            "page_size": page_size,
+            "next_cursor": next_cursor
+        })
+        return result
+    except Exception as e:
+        return {"error": str(e)}
+
+def search(keyword, path="/", limit=None):
+    """
+    在目录中按名称搜索（不区分大小写），逐页获取目录，找够limit个结果后不再请求后续页
+    
+    参数:
+        keyword: 搜索关键词
+        path: 搜索的目录路径，"/"为主目录
+        limit: 最多返回的结果数量（可选），不指定时搜索整个目录
+    
+    返回:
+        {
+            "folder": [{"id": "1", "name": "第三季"}, ...],
+            "file": [{"id": "4", "name": "1.mp4", "size": "3.5GB"}, ...],
+            "complete": True
         }
+        complete为False表示找够limit个结果后提前停止，目录中可能还有更多匹配项
+        或 {"error": "没有找到对应文件夹或文件"}
+    """
+    try:
+        if path == "/":
+            folder_id, folder_path = _get_home_folder()
+            if folder_id is None:
+                return {"error": "主目录不合法"}
+        else:
+            folder_id = _get_file_by_path(path)
+            if folder_id is None:
+                return {"error": "没有找到对应文件夹或文件"}
+            folder_path = path
+        
+        keyword = keyword.lower()
+        matched = []
+        complete = True
+        pan = _get_pan_instance()
+        for item in pan.iter_dir(folder_id):
+            _path_index.put(PathIndex.join(folder_path, item["FileName"]), item)
+            if keyword in item["FileName"].lower():
+                matched.append(item)
+                if limit is not None and len(matched) >= limit:
+                    complete = False
+                    break
+        
+        result = _format_items(matched)
+        result["complete"] = complete
+        return result
+    except Exception as e:
+        return {"error": str(e)}
+
+def walk_ids(folder_id, folder_path="/", max_depth=None, max_entries=None):
+    """
+    广度优先遍历文件夹ID下的整个目录树，列目录经过目录列表缓存和路径索引
+    
+    参数:
+        folder_id: 起始文件夹ID
+        folder_path: 起始文件夹路径，用于拼接返回的路径
+        max_depth: 最大深度（直接子项为第1层），None为不限
+        max_entries: 最多返回的条目数，None为不限，超过时抛出WalkLimitReached
+    
+    返回:
+        生成器，依次产生 (路径, 条目, 深度)，出错时抛出异常
+    """
+    return walk_tree(
+        _list_dir, folder_id, folder_path,
+        max_workers=WALK_MAX_WORKERS, max_depth=max_depth, max_entries=max_entries
+    )
+
+def walk(path="/", max_depth=None, max_entries=None):
+    """
+    广度优先遍历路径下的整个目录树，"/"为主目录，参数和返回值同walk_ids
+    """
+    if path == "/":
+        folder_id, folder_path = _get_home_folder()
+        if folder_id is None:
+            raise Exception("主目录不合法")
+    else:
+        item = _resolve_path(path)
+        if item is None or item["Type"] != 1:
+            raise Exception("没有找到对应文件夹")
+        folder_id, folder_path = item["FileId"], path
+    return walk_ids(folder_id, folder_path, max_depth=max_depth, max_entries=max_entries)
+
+def tree_stats(path="/", max_depth=None, max_entries=None):
+    """
+    统计目录树中的文件数、文件夹数和总大小
+    
+    参数:
+        path: 目录路径，"/"为主目录
+        max_depth: 最大深度，None为不限
+        max_entries: 最多统计的条目数，None为不限
+    
+    返回:
+        {"total_files": 10, "total_folders": 3, "total_size": 1024, "complete": True}
+        complete为False表示达到max_entries后提前停止
+        或 {"error": "错误信息"}
+    """
+    try:
+        result = {"total_files": 0, "total_folders": 0, "total_size": 0, "complete": True}
+        try:
+            for _, item, _ in walk(path, max_depth=max_depth, max_entries=max_entries):
+                if item["Type"] == 1:
+                    result["total_folders"] += 1
+                else:
+                    result["total_files"] += 1
+                    result["total_size"] += item.get("Size", 0)
+        except WalkLimitReached:
+            result["complete"] = False
+        return result
     except Exception as e:
         return {"error": str(e)}
 
@@ -228,28 +622,17 @@ def parsing(path):
         path: 文件路径，如"/学习资料/小猪佩奇全集/1.mp4"
     
     返回:
-        {"url": "https://url.com/学习资料/小猪佩奇全集/1.mp4"}
+        {"url": "https://url.com/学习资料/小猪佩奇全集/1.mp4", "name": "1.mp4", "size": 1024}
         或 {"error": "没有找到对应文件夹或文件"}
     """
     try:
-        file_id = _get_file_by_path(path)
-        if file_id is None:
+        file_info = _resolve_path(path, full=True)
+        if file_info is None or file_info["Type"] == 1:
             return {"error": "没有找到对应文件夹或文件"}
         
         pan = _get_pan_instance()
-        
-        # 找到对应的文件索引
-        file_index = None
-        for i, item in enumerate(pan.list):
-            if item["FileId"] == file_id and item["Type"] != 1:
-                file_index = i
-                break
-        
-        if file_index is None:
-            return {"error": "没有找到对应文件夹或文件"}
-        
-        download_url = pan.link(file_index, showlink=False)
-        return {"url": download_url}
+        download_url = pan.link_file(file_info, showlink=False)
+        return {"url": download_url, "name": file_info["FileName"], "size": file_info.get("Size", 0)}
     except Exception as e:
         return {"error": str(e)}
 
@@ -265,42 +648,12 @@ def share(path):
         或 {"error": "错误信息"}
     """
     try:
-        file_id = _get_file_by_path(path)
-        if file_id is None:
+        file_info = _resolve_path(path)
+        if file_info is None or file_info["FileId"] == 0:
             return {"error": "没有找到对应文件夹或文件"}
         
         pan = _get_pan_instance()
-        
-        # 找到对应的文件
-        file_info = None
-        for item in pan.list:
-            if item["FileId"] == file_id:
-                file_info = item
-                break
-        
-        if not file_info:
-            return {"error": "没有找到对应文件夹或文件"}
-        
-        data = {
-            "driveId": 0,
-            "expiration": "2099-12-12T08:00:00+08:00",
-            "fileIdList": str(file_id),
-            "shareName": file_info["FileName"],
-            "sharePwd": "",
-            "event": "shareCreate"
-        }
-        
-        import requests
-        import json
-        
-        share_res = requests.post(
-            "https://www.123pan.com/a/api/share/create",
-            headers=pan.header_logined,
-            data=json.dumps(data),
-            timeout=10
-        )
-        
-        share_res_json = share_res.json()
+        share_res_json = pan.create_share(str(file_info["FileId"]), file_info["FileName"])
         if share_res_json["code"] != 0:
             return {"error": share_res_json["message"]}
         
@@ -315,7 +668,7 @@ def share(path):
     except Exception as e:
         return {"error": str(e)}
 
-def upload(local_path, remote_path="/", file_name=None):
+def upload(local_path, remote_path="/", file_name=None, upload_workers=None, etag=None, user=None):
     """
     上传文件
     
@@ -323,9 +676,12 @@ def upload(local_path, remote_path="/", file_name=None):
         local_path: 本地文件路径
         remote_path: 远程路径，默认为根目录
         file_name: 指定文件名（可选），如果不指定则从路径提取
+        upload_workers: 同时上传的分块数（可选），不指定时使用Pan123的默认值
+        etag: 文件的MD5（可选），已知时传入可省去一次完整读取
+        user: 发起上传的用户（可选），按该用户的限速上传
     
     返回:
-        {"status": "success"}
+        {"status": "success", "file_id": "123"}
         或 {"error": "错误信息"}
     """
     try:
@@ -337,10 +693,364 @@ def upload(local_path, remote_path="/", file_name=None):
             folder_id = 0
         
         pan = _get_pan_instance()
-        pan.parent_file_id = folder_id
-        pan.up_load(local_path, file_name)
+        up_file_id = pan.up_load(
+            local_path, file_name, parent_file_id=folder_id, upload_workers=upload_workers, etag=etag, user=user
+        )
         
-        return {"status": "success"}
+        if file_name is None:
+            file_name = local_path.replace("\\", "/").split("/")[-1]
+        _after_upload(folder_id, remote_path, file_name, up_file_id, os.path.getsize(local_path))
+        if not up_file_id:
+            return {"error": "上传失败"}
+        
+        return {"status": "success", "file_id": str(up_file_id)}
+    except Exception as e:
+        return {"error": str(e)}
+
+def upload_async(local_path, remote_path="/", file_name=None, upload_workers=None, etag=None, on_done=None,
+                 user=None):
+    """
+    在后台上传文件，立即返回任务ID，用 upload_job 查询结果
+    
+    分块上传完并合并后，确认123pan完成由后台轮询进行（退避重试），不占用上传线程
+    
+    参数:
+        local_path: 本地文件路径，任务结束前不能删除
+        remote_path: 远程路径，默认为根目录
+        file_name: 指定文件名（可选），如果不指定则从路径提取
+        upload_workers: 同时上传的分块数（可选）
+        etag: 文件的MD5（可选）
+        on_done: 任务结束（成功或失败）时调用 on_done(结果)，可用于删除临时文件
+        user: 发起上传的用户（可选），按该用户的限速上传
+    
+    返回:
+        {"status": "uploading", "job_id": "任务ID"}
+    """
+    if file_name is None:
+        file_name = local_path.replace("\\", "/").split("/")[-1]
+    job_id = _upload_jobs.submit(
+        _upload_job, local_path, remote_path, file_name, upload_workers, etag, on_done, user
+    )
+    return {"status": "uploading", "job_id": job_id}
+
+def _upload_job(job_id, local_path, remote_path, file_name, upload_workers, etag, on_done, user):
+    """后台上传任务；返回结果表示任务结束，返回None表示已交给轮询确认完成"""
+    def finish(result):
+        if on_done is not None:
+            on_done(result)
+        return result
+    
+    deferred = []
+    try:
+        if remote_path != "/":
+            folder_id = _get_file_by_path(remote_path)
+            if folder_id is None:
+                return finish({"error": "远程路径不存在"})
+        else:
+            folder_id = 0
+        
+        pan = _get_pan_instance()
+        size = os.path.getsize(local_path)
+        up_file_id = pan.up_load(
+            local_path, file_name, parent_file_id=folder_id, upload_workers=upload_workers,
+            etag=etag, duplicate=0, defer_complete=deferred.append, user=user
+        )
+    except Exception as e:
+        return finish({"error": str(e)})
+    
+    if not deferred:
+        _after_upload(folder_id, remote_path, file_name, up_file_id, size)
+        if not up_file_id:
+            return finish({"error": "上传失败"})
+        return finish({"status": "success", "file_id": str(up_file_id)})
+    
+    def check():
+        done, _ = pan.check_upload_complete(up_file_id)
+        return done, {"status": "success", "file_id": str(up_file_id)}
+    
+    def completed(result):
+        _after_upload(folder_id, remote_path, file_name, None if "error" in result else up_file_id, size)
+        finish(result)
+    
+    _upload_jobs.poll(job_id, check, completed)
+    return None
+
+def upload_job(job_id):
+    """
+    查询后台上传任务
+    
+    返回:
+        {"job_id": "任务ID", "status": "uploading/completing/success/failed",
+         "result": 结束后为 {"status": "success", "file_id": "123"} 或 {"error": "错误信息"},
+         "attempts": 已确认完成的次数}
+        或 {"error": "上传任务不存在"}
+    """
+    job = _upload_jobs.get(job_id)
+    if job is None:
+        return {"error": "上传任务不存在"}
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "result": job["result"],
+        "attempts": job["attempts"],
+    }
+
+def _after_upload(folder_id, remote_path, file_name, up_file_id, size):
+    """上传后使目录缓存失效，并更新路径索引：成功时写入新条目，否则去掉可能过期的同名条目"""
+    _listing_cache.invalidate(folder_id)
+    file_path = PathIndex.join(remote_path, file_name)
+    if up_file_id:
+        _path_index.put(file_path, {
+            "FileId": up_file_id,
+            "FileName": file_name,
+            "Type": 0,
+            "Size": size,
+        })
+    else:
+        _path_index.remove(file_path)
+
+def upload_stream(stream, remote_path, file_name, size, etag, upload_workers=None, user=None):
+    """
+    从流中边接收边上传文件，不写本地临时文件
+    
+    参数:
+        stream: 可读的文件流（如请求体）
+        remote_path: 远程路径，"/"为根目录
+        file_name: 文件名
+        size: 文件大小（字节）
+        etag: 文件的MD5，123pan在上传前需要；接收完成后会校验
+        upload_workers: 同时上传的分块数（可选）
+        user: 发起上传的用户（可选），按该用户的限速上传
+    
+    返回:
+        {"status": "success", "file_id": "123"}
+        或 {"error": "错误信息"}
+    """
+    try:
+        if remote_path != "/":
+            folder_id = _get_file_by_path(remote_path)
+            if folder_id is None:
+                return {"error": "远程路径不存在"}
+        else:
+            folder_id = 0
+        
+        pan = _get_pan_instance()
+        up_file_id = pan.up_load_stream(
+            stream, file_name, size, etag, parent_file_id=folder_id, upload_workers=upload_workers, user=user
+        )
+        _after_upload(folder_id, remote_path, file_name, up_file_id, size)
+        if not up_file_id:
+            return {"error": "上传失败"}
+        return {"status": "success", "file_id": str(up_file_id)}
+    except Exception as e:
+        return {"error": str(e)}
+
+def upload_files(local_paths, remote_path="/", max_workers=None, overwrite=False):
+    """
+    批量上传多个本地文件到同一目录，多个文件的接口请求同时进行，适合大量小文件
+    
+    参数:
+        local_paths: 本地文件路径列表
+        remote_path: 远程目录，默认为根目录
+        max_workers: 同时上传的文件数，默认UPLOAD_MANY_WORKERS
+        overwrite: 遇到同名文件时是否覆盖，默认放弃该文件
+    
+    返回:
+        {
+            "status": "success",
+            "uploaded": 100, "failed": 0,
+            "files_per_sec": 12.5,
+            "files": [{"path": "C:/a.txt", "status": "uploaded", "file_id": "123"}, ...]
+        }
+        有文件失败时status为"partial"
+        或 {"error": "错误信息"}
+    """
+    try:
+        if remote_path != "/":
+            folder_id = _get_file_by_path(remote_path)
+            if folder_id is None:
+                return {"error": "远程路径不存在"}
+        else:
+            folder_id = 0
+        
+        pan = _get_pan_instance()
+        file_ids, files_per_sec = pan.up_load_many(
+            [(local_path, None) for local_path in local_paths], parent_file_id=folder_id,
+            workers=max_workers or UPLOAD_MANY_WORKERS, duplicate=1 if overwrite else 0
+        )
+        results = []
+        for local_path, up_file_id in zip(local_paths, file_ids):
+            file_name = local_path.replace("\\", "/").split("/")[-1]
+            _after_upload(folder_id, remote_path, file_name, up_file_id, os.path.getsize(local_path))
+            if up_file_id:
+                results.append({"path": local_path, "status": "uploaded", "file_id": str(up_file_id)})
+            else:
+                results.append({"path": local_path, "status": "failed", "error": "上传失败"})
+        uploaded = sum(1 for r in results if r["status"] == "uploaded")
+        return {
+            "status": "success" if uploaded == len(results) else "partial",
+            "uploaded": uploaded,
+            "failed": len(results) - uploaded,
+            "files_per_sec": files_per_sec,
+            "files": results
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+def _ensure_folders(executor, parent_id, parent_path, names):
+    """
+    确保父目录下存在这些子文件夹：已存在的直接使用，缺少的并发创建
+    
+    返回:
+        {文件夹名: 条目}
+    """
+    existing = {
+        item["FileName"]: item
+        for item in _list_dir(parent_id, parent_path)
+        if item["Type"] == 1
+    }
+    pan = _get_pan_instance()
+    
+    def create(name):
+        create_res_json = pan.create_dir(parent_id, name)
+        if create_res_json["code"] != 0:
+            raise Exception(f"创建文件夹{name}失败: {create_res_json.get('message')}")
+        info = create_res_json["data"].get("Info") or {
+            "FileId": create_res_json["data"]["FileId"], "FileName": name, "Type": 1
+        }
+        _path_index.put(PathIndex.join(parent_path, name), info)
+        return info
+    
+    missing = [name for name in names if name not in existing]
+    if missing:
+        for name, info in zip(missing, executor.map(create, missing)):
+            existing[name] = info
+        _listing_cache.invalidate(parent_id)
+    return {name: existing[name] for name in names}
+
+def upload_folder(local_dir, remote_path="/", overwrite=False, upload_workers=None, max_workers=None):
+    """
+    上传整个本地文件夹，在远程目录下按原结构创建同名文件夹（已存在的直接使用）
+    
+    文件夹逐层并发创建，文件由线程池并发上传。远程已有同名且MD5相同的文件直接跳过，
+    重新运行时只上传上次失败或有变化的文件（本地MD5有缓存，不会重新计算）。
+    
+    参数:
+        local_dir: 本地文件夹路径
+        remote_path: 远程父目录，默认为根目录
+        overwrite: 远程已有同名但内容不同的文件时是否覆盖，默认不覆盖并记为失败
+        upload_workers: 每个文件同时上传的分块数（可选）
+        max_workers: 同时上传的文件数，默认UPLOAD_FOLDER_WORKERS
+    
+    返回:
+        {
+            "status": "success",
+            "folder_id": "123",
+            "uploaded": 10, "skipped": 2, "failed": 0,
+            "files_per_sec": 8.3,
+            "files": [{"path": "sub/a.txt", "status": "uploaded", "file_id": "456"}, ...]
+        }
+        有文件失败时status为"partial"，失败的条目带"error"
+        或 {"error": "错误信息"}
+    """
+    try:
+        local_root = os.path.abspath(local_dir)
+        if not os.path.isdir(local_root):
+            return {"error": "本地文件夹不存在"}
+        if remote_path != "/":
+            parent = _resolve_path(remote_path)
+            if parent is None or parent["Type"] != 1:
+                return {"error": "远程路径不存在"}
+            parent_id = parent["FileId"]
+        else:
+            parent_id = 0
+        root_name = os.path.basename(local_root)
+        root_path = PathIndex.join(remote_path, root_name)
+        
+        # 收集本地目录结构：相对路径 -> 子文件夹名/文件名
+        subdirs = {}
+        files = []
+        for current, dirnames, filenames in os.walk(local_root):
+            dirnames.sort()
+            rel = os.path.relpath(current, local_root).replace(os.sep, "/")
+            rel = "" if rel == "." else rel
+            subdirs[rel] = dirnames[:]
+            files.extend((rel, name) for name in sorted(filenames))
+        
+        pan = _get_pan_instance()
+        workers = max_workers or UPLOAD_FOLDER_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 1.逐层创建文件夹，同一层的文件夹并发创建
+            folders = {"": _ensure_folders(executor, parent_id, remote_path, [root_name])[root_name]}
+            level = [""]
+            while level:
+                next_level = []
+                for rel in level:
+                    names = subdirs.get(rel) or []
+                    if not names:
+                        continue
+                    created = _ensure_folders(
+                        executor, folders[rel]["FileId"], PathIndex.join(root_path, rel), names
+                    )
+                    for name, info in created.items():
+                        child = f"{rel}/{name}" if rel else name
+                        folders[child] = info
+                        next_level.append(child)
+                level = next_level
+            
+            # 2.列出每个文件夹已有的文件，用于跳过已上传的文件
+            def remote_files(rel):
+                items = _list_dir(folders[rel]["FileId"], PathIndex.join(root_path, rel))
+                return {item["FileName"]: item for item in items if item["Type"] != 1}
+            
+            rels = sorted({rel for rel, _ in files})
+            existing = dict(zip(rels, executor.map(remote_files, rels)))
+            
+            # 3.并发上传文件
+            def upload_one(rel, name):
+                rel_path = f"{rel}/{name}" if rel else name
+                local_path = os.path.join(local_root, *rel_path.split("/"))
+                folder = folders[rel]
+                try:
+                    remote = existing[rel].get(name)
+                    if remote is not None:
+                        if pan.md5_cache is not None:
+                            local_md5 = pan.md5_cache.hash_file(local_path)
+                        else:
+                            local_md5 = file_md5(local_path)
+                        if remote.get("Etag") and remote.get("Etag") == local_md5:
+                            return {"path": rel_path, "status": "skipped", "file_id": str(remote["FileId"])}
+                        if not overwrite:
+                            return {"path": rel_path, "status": "failed", "error": "远程已有同名文件"}
+                    up_file_id = pan.up_load(
+                        local_path, name, parent_file_id=folder["FileId"],
+                        upload_workers=upload_workers, duplicate=1 if overwrite else 0
+                    )
+                    _after_upload(
+                        folder["FileId"], PathIndex.join(root_path, rel), name, up_file_id,
+                        os.path.getsize(local_path)
+                    )
+                    if not up_file_id:
+                        return {"path": rel_path, "status": "failed", "error": "上传失败"}
+                    return {"path": rel_path, "status": "uploaded", "file_id": str(up_file_id)}
+                except Exception as e:
+                    return {"path": rel_path, "status": "failed", "error": str(e)}
+            
+            start = time.time()
+            results = [f.result() for f in [executor.submit(upload_one, rel, name) for rel, name in files]]
+            elapsed = time.time() - start
+        if pan.md5_cache is not None:
+            pan.md5_cache.flush()
+        
+        counts = {status: sum(1 for r in results if r["status"] == status)
+                  for status in ("uploaded", "skipped", "failed")}
+        return {
+            "status": "partial" if counts["failed"] else "success",
+            "folder_id": str(folders[""]["FileId"]),
+            **counts,
+            "files_per_sec": round(len(results) / elapsed, 2) if elapsed > 0 else float(len(results)),
+            "files": results
+        }
     except Exception as e:
         return {"error": str(e)}
 
@@ -356,23 +1066,16 @@ def delete(path):
         或 {"error": "错误信息"}
     """
     try:
-        file_id = _get_file_by_path(path)
-        if file_id is None:
+        file_info = _resolve_path(path, full=True)
+        if file_info is None or file_info["FileId"] == 0:
             return {"error": "没有找到对应文件夹或文件"}
         
         pan = _get_pan_instance()
-        
-        # 找到对应的文件索引
-        file_index = None
-        for i, item in enumerate(pan.list):
-            if item["FileId"] == file_id:
-                file_index = i
-                break
-        
-        if file_index is None:
-            return {"error": "没有找到对应文件夹或文件"}
-        
-        pan.delete_file(file_index, by_num=True, operation=True)
+        pan.trash_file(file_info, operation=True)
+        _invalidate_parent(path)
+        if file_info["Type"] == 1:
+            _listing_cache.invalidate(file_info["FileId"])
+        _path_index.remove(path)
         return {"status": "success"}
     except Exception as e:
         return {"error": str(e)}
@@ -389,70 +1092,32 @@ def delete_folder(path):
         或 {"error": "错误信息"}
     """
     try:
-        folder_id = _get_file_by_path(path)
-        if folder_id is None:
+        folder_info = _resolve_path(path, full=True)
+        if folder_info is None or folder_info["FileId"] == 0:
             return {"error": "没有找到对应文件夹"}
         
-        pan = _get_pan_instance()
-        
         # 检查是否是文件夹
-        is_folder = False
-        for item in pan.list:
-            if item["FileId"] == folder_id and item["Type"] == 1:
-                is_folder = True
-                break
-        
-        if not is_folder:
+        if folder_info["Type"] != 1:
             return {"error": "指定路径不是文件夹"}
         
-        # 删除文件夹及其内容
-        import requests
-        import json
+        pan = _get_pan_instance()
         
         # 获取文件夹内容
-        pan.parent_file_id = folder_id
-        pan.get_dir()
+        items = _list_dir(folder_info["FileId"], path)
         
         deleted_count = 0
         
         # 删除文件夹内的所有文件和子文件夹
-        for item in pan.list:
-            data_delete = {
-                "driveId": 0,
-                "fileTrashInfoList": [item],
-                "operation": True,
-            }
-            
-            delete_res = requests.post(
-                "https://www.123pan.com/a/api/file/trash",
-                data=json.dumps(data_delete),
-                headers=pan.header_logined,
-                timeout=10
-            )
-            
-            if delete_res.json()["code"] == 0:
+        for item in items:
+            if pan.trash_file([item], operation=True)["code"] == 0:
                 deleted_count += 1
         
         # 最后删除文件夹本身
-        # 找到文件夹在父目录中的索引
-        parent_path = "/".join(path.strip("/").split("/")[:-1])
-        if parent_path:
-            parent_id = _get_file_by_path("/" + parent_path)
-        else:
-            parent_id = 0
-        
-        pan.parent_file_id = parent_id
-        pan.get_dir()
-        
-        folder_index = None
-        for i, item in enumerate(pan.list):
-            if item["FileId"] == folder_id and item["Type"] == 1:
-                folder_index = i
-                break
-        
-        if folder_index is not None:
-            pan.delete_file(folder_index, by_num=True, operation=True)
+        if pan.trash_file(folder_info, operation=True).get("code") == 0:
             deleted_count += 1
+        _invalidate_parent(path)
+        _listing_cache.invalidate(folder_info["FileId"])
+        _path_index.remove(path)
         
         return {"status": "success", "deleted_files": deleted_count}
     except Exception as e:
@@ -479,32 +1144,18 @@ def create_folder(path, folder_name):
                 return {"error": "父目录不存在"}
         
         pan = _get_pan_instance()
-        
-        import requests
-        import json
-        
-        data = {
-            "driveId": 0,
-            "etag": "",
-            "fileName": folder_name,
-            "parentFileId": parent_id,
-            "size": 0,
-            "type": 1,
-            "duplicate": 0
-        }
-        
-        create_res = requests.post(
-            "https://www.123pan.com/b/api/file/upload_request",
-            headers=pan.header_logined,
-            data=json.dumps(data),
-            timeout=10
-        )
-        
-        create_res_json = create_res.json()
+        create_res_json = pan.create_dir(parent_id, folder_name)
         if create_res_json["code"] != 0:
             return {"error": create_res_json["message"]}
         
-        return {"status": "success", "folder_id": str(create_res_json["data"]["FileId"])}
+        folder_id = create_res_json["data"]["FileId"]
+        _listing_cache.invalidate(parent_id)
+        _path_index.put(
+            PathIndex.join(path, folder_name),
+            create_res_json["data"].get("Info") or {"FileId": folder_id, "FileName": folder_name, "Type": 1}
+        )
+        
+        return {"status": "success", "folder_id": str(folder_id)}
     except Exception as e:
         return {"error": str(e)}
 
@@ -519,6 +1170,8 @@ def reload_session():
     try:
         global _pan_instance
         _pan_instance = None
+        _path_index.clear()
+        _listing_cache.clear()
         _get_pan_instance()
         return {"status": "success"}
     except Exception as e:
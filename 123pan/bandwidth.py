@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# 每次申请令牌的最大字节数；越小各用户轮换越频繁，交互请求等待越短
+QUANTUM = 64 * 1024
+
+
+class TokenBucket:
+    """单个令牌桶：按 rate 字节/秒补充，最多积累 burst 字节；令牌不足时先预支，调用方等待到还清为止"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(QUANTUM, rate / 10))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class BandwidthShaper:
+    """
+    上传/下载带宽整形
+
+    每个用户先经过自己的令牌桶（user_rate），再从全局令牌桶（rate）申请；
+    全局令牌按用户轮流分配，每次最多 QUANTUM 字节，一个用户开再多的传输也只占一份，
+    其他用户的传输和列目录等请求不会被挤满的带宽拖慢。rate/user_rate 为None或0时不限速。
+    """
+
+    def __init__(self, rate=None, user_rate=None, burst=None):
+        self.rate = rate or None
+        self.user_rate = user_rate or None
+        self._burst = float(burst or max(QUANTUM, (rate or 0) / 10))
+        self._tokens = self._burst
+        self._last = time.monotonic()
+        self._waiting = {}  # 用户 -> 等待中的申请 [字节数, 是否已分配]，按轮到的顺序排列
+        self._cond = threading.Condition()
+        self._user_buckets = {}
+        self._user_lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.rate is not None or self.user_rate is not None
+
+    def consume(self, nbytes, user=None):
+        """等待直到允许传输 nbytes 字节"""
+        while nbytes > 0:
+            piece = min(nbytes, QUANTUM)
+            if self.user_rate is not None:
+                self._user_bucket(user).consume(piece)
+            if self.rate is not None:
+                self._acquire(user, piece)
+            nbytes -= piece
+
+    def _user_bucket(self, user):
+        with self._user_lock:
+            bucket = self._user_buckets.get(user)
+            if bucket is None:
+                bucket = self._user_buckets[user] = TokenBucket(self.user_rate)
+            return bucket
+
+    def _acquire(self, user, nbytes):
+        ticket = [nbytes, False]
+        with self._cond:
+            self._waiting.setdefault(user, deque()).append(ticket)
+            while True:
+                self._dispatch()
+                if ticket[1]:
+                    return
+                self._cond.wait(self._next_wait())
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        granted = False
+        while self._waiting:
+            user, queue = next(iter(self._waiting.items()))
+            ticket = queue[0]
+            if self._tokens < ticket[0]:
+                break
+            self._tokens -= ticket[0]
+            ticket[1] = True
+            granted = True
+            queue.popleft()
+            # 分配过的用户排到最后，轮到下一个用户
+            del self._waiting[user]
+            if queue:
+                self._waiting[user] = queue
+        if granted:
+            self._cond.notify_all()
+
+    def _next_wait(self):
+        if not self._waiting:
+            return None
+        need = next(iter(self._waiting.values()))[0][0] - self._tokens
+        return max(need / self.rate, 0.001)
+
+
+class ShapedReader:
+    """按限速读出的请求体，包装 bytes/memoryview；重试时需要新建"""
+
+    def __init__(self, data, shaper, user=None):
+        self._view = data if isinstance(data, memoryview) else memoryview(data)
+        self._shaper = shaper
+        self._user = user
+        self._pos = 0
+        self._allowance = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def read(self, amt=-1):
+        if amt is None or amt < 0:
+            amt = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + amt]
+        self._pos += len(chunk)
+        # 按QUANTUM整块申请，减少加锁次数
+        while self._allowance < len(chunk):
+            self._shaper.consume(QUANTUM, self._user)
+            self._allowance += QUANTUM
+        self._allowance -= len(chunk)
+        return chunk
+
+
+_shaper = BandwidthShaper()
+
+
+def configure(rate=None, user_rate=None):
+    """
+    设置限速，单位为字节/秒，None或0为不限
+
+    参数:
+        rate: 所有传输合计的速度上限
+        user_rate: 每个用户的速度上限
+    """
+    global _shaper
+    _shaper = BandwidthShaper(rate, user_rate)
+
+
+def consume(nbytes, user=None):
+    """传输 nbytes 字节前调用，超出限速时等待"""
+    shaper = _shaper
+    if shaper.limited:
+        shaper.consume(nbytes, user)
+
+
+def shaped(data, user=None):
+    """返回按限速发送的请求体；不限速时直接返回 data"""
+    shaper = _shaper
+    if not shaper.limited:
+        return data
+    return ShapedReader(data, shaper, user)
+
+
+def iter_shaped(chunks, user=None):
+    """按限速逐块产出（如下载时的 iter_content）"""
+    for chunk in chunks:
+        consume(len(chunk), user)
+        yield chunk
+
+
+def shaped_async(data, user=None):
+    """
+    返回按限速发送的请求体，供aiohttp使用；不限速时直接返回 data
+    限速时按QUANTUM逐块产出，等待令牌在线程中进行，不阻塞事件循环；请求需另外带上Content-Length
+    """
+    shaper = _shaper
+    if not shaper.limited:
+        return data
+    return _aiter_shaped(memoryview(data), shaper, user)
+
+
+async def _aiter_shaped(view, shaper, user):
+    for pos in range(0, len(view), QUANTUM):
+        chunk = view[pos:pos + QUANTUM]
+        await asyncio.to_thread(shaper.consume, len(chunk), user)
+        yield bytes(chunk)
@@ -0,0 +1,67 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 三类主机分别使用各自的会话和连接池
+API = "api"  # www.123pan.com 接口
+STORAGE = "storage"  # 上传分块的存储节点（预签名URL）
+CDN = "cdn"  # 下载链接及其跳转后的CDN
+
+# 每个主机最多保持的keep-alive连接数
+POOL_SIZES = {API: 16, STORAGE: 32, CDN: 32}
+# 每类会话最多缓存连接池的主机数
+POOL_HOSTS = {API: 2, STORAGE: 16, CDN: 16}
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _build_session(kind):
+    session = requests.Session()
+    # 与直接调用requests.get/post一致：不在请求之间保存cookie，认证只靠请求头
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS[kind], pool_maxsize=POOL_SIZES[kind])
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(kind=API):
+    """获取某类主机共享的会话，连接在请求之间保持复用"""
+    session = _sessions.get(kind)
+    if session is None:
+        with _lock:
+            session = _sessions.get(kind)
+            if session is None:
+                session = _build_session(kind)
+                _sessions[kind] = session
+    return session
+
+
+def configure(pool_sizes=None, pool_hosts=None):
+    """
+    修改连接池大小，已创建的会话会关闭并在下次使用时按新配置重建
+
+    参数:
+        pool_sizes: {"api": 16, "storage": 32, "cdn": 32}，每个主机的最大连接数
+        pool_hosts: 同上格式，每类会话缓存连接池的主机数
+    """
+    with _lock:
+        for kind, size in (pool_sizes or {}).items():
+            if kind in POOL_SIZES:
+                POOL_SIZES[kind] = int(size)
+        for kind, hosts in (pool_hosts or {}).items():
+            if kind in POOL_HOSTS:
+                POOL_HOSTS[kind] = int(hosts)
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def close_all():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
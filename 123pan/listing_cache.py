@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ListingCache:
+    """
+    目录列表缓存（按文件夹ID）
+
+    - 未超过 soft_ttl：直接返回缓存
+    - 超过 soft_ttl 但未超过 hard_ttl：立即返回旧数据，同时在后台刷新
+    - 超过 hard_ttl 或没有缓存：同步获取
+    自己发起的修改操作通过 invalidate() 精确失效对应文件夹。
+    """
+
+    def __init__(self, soft_ttl=30, hard_ttl=600, max_size=200, refresh_workers=2):
+        self._soft_ttl = soft_ttl
+        self._hard_ttl = hard_ttl
+        self._max_size = max_size
+        self._entries = {}  # folder_id -> (items, timestamp)
+        self._versions = {}  # folder_id -> 失效次数，防止失效前发起的刷新写回旧数据
+        self._refreshing = {}  # folder_id -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers)
+
+    def get(self, folder_id, loader):
+        """
+        获取文件夹列表
+
+        参数:
+            folder_id: 文件夹ID
+            loader: 无参函数，返回文件夹的最新列表，出错时抛出异常
+        """
+        with self._lock:
+            entry = self._entries.get(folder_id)
+            version = self._versions.get(folder_id, 0)
+            if entry is not None:
+                items, timestamp = entry
+                age = time.time() - timestamp
+                if age < self._soft_ttl:
+                    return items
+                if age < self._hard_ttl:
+                    if folder_id not in self._refreshing:
+                        self._refreshing[folder_id] = self._executor.submit(
+                            self._refresh, folder_id, loader, version
+                        )
+                    return items
+        items = loader()
+        self._store(folder_id, items, version)
+        return items
+
+    def peek(self, folder_id):
+        """返回未超过 hard_ttl 的缓存，不触发获取或刷新"""
+        with self._lock:
+            entry = self._entries.get(folder_id)
+            if entry is None or time.time() - entry[1] >= self._hard_ttl:
+                return None
+            return entry[0]
+
+    def invalidate(self, folder_id):
+        with self._lock:
+            self._entries.pop(folder_id, None)
+            self._versions[folder_id] = self._versions.get(folder_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            for folder_id in set(self._entries) | set(self._versions):
+                self._versions[folder_id] = self._versions.get(folder_id, 0) + 1
+            self._entries.clear()
+
+    def _refresh(self, folder_id, loader, version):
+        try:
+            self._store(folder_id, loader(), version)
+        except Exception as e:
+            # 刷新失败时保留旧数据，等下一次请求再试
+            print(f"后台刷新目录{folder_id}失败: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.pop(folder_id, None)
+
+    def _store(self, folder_id, items, version):
+        with self._lock:
+            if self._versions.get(folder_id, 0) != version:
+                return
+            if folder_id not in self._entries and len(self._entries) >= self._max_size:
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+            self._entries[folder_id] = (items, time.time())
@@ -0,0 +1,144 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+
+
+def file_md5(file_path, block_size=64 * 1024):
+    """计算文件的MD5，读入同一个缓冲区，不为每块分配新的bytes"""
+    md5 = hashlib.md5()
+    buf = memoryview(bytearray(block_size))
+    with open(file_path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            md5.update(buf[:n])
+    return md5.hexdigest()
+
+
+# 进程退出时保存所有缓存中未写回的条目
+_instances = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for cache in _instances:
+        cache.flush()
+
+
+class Md5Cache:
+    """
+    本地文件MD5缓存
+
+    以文件路径为键，同时记录大小、修改时间和inode；三者都未变化时认为文件内容未变，
+    直接使用缓存的MD5，省去重新读取整个文件。结果保存在文件中，重启后仍然有效。
+    新条目只在内存中标记，距上次保存超过 flush_interval 秒时、调用 flush() 时
+    （如一批上传结束）和进程退出时才写回文件，写文件时不持有锁。
+    """
+
+    def __init__(self, path="md5_cache.json", max_size=10000, flush_interval=5):
+        self._path = path
+        self._max_size = max_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        _instances.add(self)
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取MD5缓存失败，忽略已有缓存: {e}")
+            return {}
+
+    def flush(self, wait=True):
+        """
+        有未保存的条目时写回文件
+
+        参数:
+            wait: 为False且其他线程正在保存时直接返回
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = dict(self._entries)
+                self._dirty = False
+                self._last_flush = time.monotonic()
+            tmp_path = self._path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self._path)
+            except OSError as e:
+                print(f"保存MD5缓存失败: {e}")
+                with self._lock:
+                    self._dirty = True
+        finally:
+            self._flush_lock.release()
+
+    @staticmethod
+    def _fingerprint(file_path):
+        st = os.stat(file_path)
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def get(self, file_path):
+        """文件未变化时返回缓存的MD5，否则返回None"""
+        key = os.path.abspath(file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            if entry["fingerprint"] != self._fingerprint(file_path):
+                return None
+        except OSError:
+            return None
+        return entry["md5"]
+
+    def put(self, file_path, md5, fingerprint=None):
+        """
+        保存文件的MD5
+
+        参数:
+            fingerprint: 开始计算MD5前取得的指纹；计算期间文件被修改时不保存
+        """
+        key = os.path.abspath(file_path)
+        try:
+            current = self._fingerprint(file_path)
+        except OSError:
+            return
+        if fingerprint is not None and fingerprint != current:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self._max_size:
+                # 按插入顺序淘汰最早的条目
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = {"fingerprint": current, "md5": md5}
+            self._dirty = True
+            due = time.monotonic() - self._last_flush >= self._flush_interval
+        if due:
+            self.flush(wait=False)
+
+    def hash_file(self, file_path, block_size=64 * 1024):
+        """返回文件的MD5，优先使用缓存，未命中时计算并保存"""
+        md5_value = self.get(file_path)
+        if md5_value is not None:
+            return md5_value
+        fingerprint = self._fingerprint(file_path)
+        md5_value = file_md5(file_path, block_size)
+        self.put(file_path, md5_value, fingerprint)
+        return md5_value
@@ -1,12 +1,115 @@
 import hashlib
 import json
+import math
+import mmap
 import os
+import queue
 import re
+import threading
 import time
 
 import uuid
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import bandwidth
+from http_session import get_session, API, STORAGE, CDN
+from md5_cache import Md5Cache, file_md5
+from presign import PresignedUrls
+from singleflight import SingleFlight
+from upload_journal import UploadJournal
+
+
+# 断点记录和MD5缓存文件的默认位置：放在本模块所在目录，不随启动时的工作目录变化
+DEFAULT_UPLOAD_JOURNAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_journal.json")
+DEFAULT_MD5_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "md5_cache.json")
+
+
+# 登录后调用接口使用的请求头（模拟安卓客户端）
+def make_header_logined(authorization):
+    return {
+        "user-agent": "123pan/v2.4.0(Android_7.1.2;Xiaomi)",
+        "authorization": authorization,
+        "accept-encoding": "gzip",
+        # "authorization": "",
+        "content-type": "application/json",
+        "osversion": "Android_7.1.2",
+        "loginuuid": str(uuid.uuid4().hex),
+        "platform": "android",
+        "devicetype": "M2101K9C",
+        "x-channel": "1004",
+        "devicename": "Xiaomi",
+        # "Content-Length": "65",
+        "host": "www.123pan.com",
+        "app-version": "61",
+        "x-app-version": "2.4.0"
+    }
+
+
+# 分块大小：最小5MB（S3要求除最后一块外不小于5MB），最大64MB，分块数不超过10000
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 64 * 1024 * 1024
+MAX_PART_COUNT = 10000
+# 流式上传的分块在内存中，上限更小
+STREAM_MAX_PART_SIZE = 16 * 1024 * 1024
+# 大文件尽量分成不超过这么多块，减少获取链接和请求的开销
+TARGET_PART_COUNT = 1000
+# 按实测速度，每块的上传时间尽量不超过这么多秒，慢速网络下失败重试的代价小
+TARGET_PART_SECONDS = 10
+# 合并分块后确认上传完成：第一次立即确认，未完成时等待间隔从1秒起翻倍，最多30秒，总共最多等待600秒
+COMPLETE_POLL_DELAY = 1
+COMPLETE_POLL_MAX_DELAY = 30
+COMPLETE_POLL_TIMEOUT = 600
+
+
+# 根据文件大小和实测的单块上传速度（字节/秒，未知时为None）选择分块大小，按1MB取整
+def choose_part_size(fsize, throughput=None, max_size=MAX_PART_SIZE):
+    size = math.ceil(fsize / TARGET_PART_COUNT)
+    if throughput:
+        size = min(size, int(throughput * TARGET_PART_SECONDS))
+    size = min(max(size, MIN_PART_SIZE), max_size)
+    # 分块数上限优先于大小上限
+    size = max(size, math.ceil(fsize / MAX_PART_COUNT))
+    mb = 1024 * 1024
+    return math.ceil(size / mb) * mb
+
+
+# 从流中读满 view，返回读到的字节数（流提前结束时小于 len(view)）；流没有 readinto 时退回 read
+def _readinto_exact(stream, view):
+    readinto = getattr(stream, "readinto", None)
+    pos = 0
+    while pos < len(view):
+        if readinto is not None:
+            n = readinto(view[pos:])
+        else:
+            chunk = stream.read(len(view) - pos)
+            n = len(chunk)
+            view[pos:pos + n] = chunk
+        if not n:
+            break
+        pos += n
+    return pos
+
+
+# 只读映射整个文件，分块直接使用映射上的切片，不复制成新的bytes；空文件或无法映射时返回None
+def _map_file(f, size):
+    if size == 0:
+        return None
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+# 每个上传线程复用的读缓冲区（无法映射文件时使用）
+_part_buffers = threading.local()
+
+
+def _thread_buffer(size):
+    buf = getattr(_part_buffers, "buf", None)
+    if buf is None or len(buf) < size:
+        buf = _part_buffers.buf = bytearray(size)
+    return memoryview(buf)[:size]
 
 
 class Pan123:
@@ -17,8 +120,27 @@ class Pan123:
             pass_word="",
             authorization="",
             input_pwd=True,
+            page_size=100,
+            list_max_workers=4,
+            upload_workers=3,
+            part_retries=3,
+            presign_window=32,
+            upload_journal=DEFAULT_UPLOAD_JOURNAL,
+            md5_cache=DEFAULT_MD5_CACHE,
     ):
         self.cookies = None
+        self.page_size = page_size  # 列目录时每页的条目数
+        self.list_max_workers = list_max_workers  # 列目录时并发获取分页的线程数
+        self.upload_workers = upload_workers  # 上传时同时上传的分块数
+        self.part_retries = part_retries  # 每个分块失败后的重试次数
+        self.presign_window = presign_window  # 每次批量获取上传链接的分块数
+        self.part_throughput = None  # 实测的单块上传速度（字节/秒，滑动平均），用于选择分块大小
+        self._throughput_lock = threading.Lock()
+        # 分块上传的断点记录文件，为None时不记录、不续传
+        self.upload_journal = UploadJournal(upload_journal) if upload_journal else None
+        # 本地文件MD5缓存，未修改的文件再次上传时不用重新计算；为None时不缓存
+        self.md5_cache = Md5Cache(md5_cache) if md5_cache else None
+        self._flight = SingleFlight()  # 合并相同的并发元数据请求（列目录、下载链接、用户信息）
         self.recycle_list = None
         self.list = []
         if readfile:
@@ -34,23 +156,7 @@ class Pan123:
             self.user_name = user_name
             self.password = pass_word
             self.authorization = authorization
-        self.header_logined = {
-            "user-agent": "123pan/v2.4.0(Android_7.1.2;Xiaomi)",
-            "authorization": self.authorization,
-            "accept-encoding": "gzip",
-            # "authorization": "",
-            "content-type": "application/json",
-            "osversion": "Android_7.1.2",
-            "loginuuid": str(uuid.uuid4().hex),
-            "platform": "android",
-            "devicetype": "M2101K9C",
-            "x-channel": "1004",
-            "devicename": "Xiaomi",
-            # "Content-Length": "65",
-            "host": "www.123pan.com",
-            "app-version": "61",
-            "x-app-version": "2.4.0"
-        }
+        self.header_logined = make_header_logined(self.authorization)
         self.parent_file_id = 0  # 路径，文件夹的id,0为根目录
         self.parent_file_list = [0]
         res_code_getdir = self.get_dir()
@@ -70,7 +176,7 @@ class Pan123:
         retry_count = 0
         while retry_count < max_retries:
             try:
-                login_res = requests.post(
+                login_res = get_session(API).post(
                     url,
                     headers=headers,
                     data=data,
@@ -132,54 +238,137 @@ class Pan123:
 
             f.write(json.dumps(save_list))
 
-    def get_dir(self):
-        res_code_getdir = 0
-        page = 1
-        lists = []
-        lenth_now = 0
-        total = -1
-        while lenth_now < total or total == -1:
-            base_url = "https://www.123pan.com/b/api/file/list/new"
-            # print(self.headerLogined)
-            # sign = getSign("/b/api/file/list/new")
-            # print(sign)
-            params = {
-                # sign[0]: sign[1],
-                "driveId": 0,
-                "limit": 100,
-                "next": 0,
-                "orderBy": "file_id",
-                "orderDirection": "desc",
-                "parentFileId": str(self.parent_file_id),
-                "trashed": False,
-                "SearchData": "",
-                "Page": str(page),
-                "OnlyLookAbnormalFile": 0,
-            }
+    def _get_dir_page(self, parent_file_id, page, limit):
+        base_url = "https://www.123pan.com/b/api/file/list/new"
+        # sign = getSign("/b/api/file/list/new")
+        params = {
+            # sign[0]: sign[1],
+            "driveId": 0,
+            "limit": limit,
+            "next": 0,
+            "orderBy": "file_id",
+            "orderDirection": "desc",
+            "parentFileId": str(parent_file_id),
+            "trashed": False,
+            "SearchData": "",
+            "Page": str(page),
+            "OnlyLookAbnormalFile": 0,
+        }
+        a = get_session(API).get(base_url, headers=self.header_logined, params=params, timeout=10)  # , verify=False)
+        return a.json()
+
+    # 获取整个目录，返回 (code, 条目列表)，不修改 self.list / self.parent_file_id
+    # 同一目录的并发请求只会向服务器请求一次，共享结果
+    def list_dir(self, parent_file_id):
+        return self._flight.do(
+            ("list_dir", str(parent_file_id)), lambda: self._fetch_dir(parent_file_id)
+        )
+
+    # 先取第一页拿到Total，其余页并发获取后按页码顺序拼接
+    def _fetch_dir(self, parent_file_id):
+        try:
+            text = self._get_dir_page(parent_file_id, 1, self.page_size)
+        except:
+            print("连接失败")
+            return -1, []
+        res_code_getdir = text["code"]
+        if res_code_getdir != 0:
+            print("code = 2 Error:" + str(res_code_getdir))
+            return res_code_getdir, []
+        lists = text["data"]["InfoList"]
+        total = text["data"]["Total"]
+        # 服务端可能会限制单页条目数，以第一页实际返回的数量为准计算页数
+        per_page = len(lists)
+        page = 2
+        if 0 < per_page < total:
+            page_count = math.ceil(total / per_page)
+            pages = range(2, page_count + 1)
+            workers = max(1, min(self.list_max_workers, len(pages)))
             try:
-                a = requests.get(base_url, headers=self.header_logined, params=params, timeout=10)  # , verify=False)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(
+                        lambda p: self._get_dir_page(parent_file_id, p, self.page_size), pages
+                    ))
             except:
                 print("连接失败")
-                return -1
-            # print(a.text)
-            # print(a.headers)
-            text = a.json()
-            res_code_getdir = text["code"]
-            if res_code_getdir != 0:
-                #print(a.text)
-                #print(a.headers)
-                print("code = 2 Error:" + str(res_code_getdir))
-                return res_code_getdir
-            lists_page = text["data"]["InfoList"]
-            lists += lists_page
+                return -1, []
+            for text in results:
+                res_code_getdir = text["code"]
+                if res_code_getdir != 0:
+                    print("code = 2 Error:" + str(res_code_getdir))
+                    return res_code_getdir, []
+                lists += text["data"]["InfoList"]
+            page = page_count + 1
+        # 列目录期间有新增文件时，继续顺序获取剩余的页
+        while per_page and len(lists) < total:
+            try:
+                text = self._get_dir_page(parent_file_id, page, self.page_size)
+            except:
+                print("连接失败")
+                return -1, []
+            if text["code"] != 0 or not text["data"]["InfoList"]:
+                break
+            lists += text["data"]["InfoList"]
             total = text["data"]["Total"]
-            lenth_now += len(lists_page)
             page += 1
-        file_num = 0
+        # 分页之间目录发生变化时可能出现重复条目
+        seen = set()
+        unique = []
         for i in lists:
+            if i["FileId"] not in seen:
+                seen.add(i["FileId"])
+                unique.append(i)
+        file_num = 0
+        for i in unique:
             i["FileNum"] = file_num
             file_num += 1
+        return 0, unique
+
+    # 获取目录的某一页（对应接口的Page/limit），返回 (code, 条目列表, Total)
+    def get_dir_page(self, parent_file_id, page=1, limit=None):
+        if limit is None:
+            limit = self.page_size
+        try:
+            text = self._get_dir_page(parent_file_id, page, limit)
+        except:
+            print("连接失败")
+            return -1, [], 0
+        res_code_getdir = text["code"]
+        if res_code_getdir != 0:
+            print("code = 2 Error:" + str(res_code_getdir))
+            return res_code_getdir, [], 0
+        return 0, text["data"]["InfoList"], text["data"]["Total"]
 
+    # 逐页获取目录，边获取边返回，调用方停止迭代时不再请求后续页
+    # pages=True 时每次返回一整页的条目列表，否则逐个返回条目
+    # start_page 可以从中间某一页开始获取
+    def iter_dir(self, parent_file_id=None, pages=False, start_page=1):
+        if parent_file_id is None:
+            parent_file_id = self.parent_file_id
+        page = start_page
+        lenth_now = (start_page - 1) * self.page_size
+        total = -1
+        while lenth_now < total or total == -1:
+            res_code_getdir, lists_page, total = self.get_dir_page(parent_file_id, page)
+            if res_code_getdir == -1:
+                raise Exception("连接失败")
+            if res_code_getdir != 0:
+                raise Exception("code = 2 Error:" + str(res_code_getdir))
+            if not lists_page:
+                return
+            for i in lists_page:
+                i["FileNum"] = lenth_now
+                lenth_now += 1
+            if pages:
+                yield lists_page
+            else:
+                yield from lists_page
+            page += 1
+
+    def get_dir(self):
+        res_code_getdir, lists = self.list_dir(self.parent_file_id)
+        if res_code_getdir != 0:
+            return res_code_getdir
         self.list = lists
         return res_code_getdir
 
@@ -194,7 +383,19 @@ class Pan123:
 
     # fileNumber 从0开始，0为第一个文件，传入时需要减一 ！！！
     def link(self, file_number, showlink=True):
-        file_detail = self.list[file_number]
+        return self.link_file(self.list[file_number], showlink)
+
+    # 直接传入文件信息（get_dir返回的条目）获取下载链接
+    # 同一文件的并发请求只会向服务器请求一次，共享结果
+    def link_file(self, file_detail, showlink=True):
+        redirect_url = self._flight.do(
+            ("link", str(file_detail["FileId"])), lambda: self._fetch_link(file_detail)
+        )
+        if showlink:
+            print()
+        return redirect_url
+
+    def _fetch_link(self, file_detail):
         type_detail = file_detail["Type"]
         if type_detail == 1:
             down_request_url = "https://www.123pan.com/a/api/file/batch_download_info"
@@ -215,7 +416,7 @@ class Pan123:
 
         # sign = getSign("/a/api/file/download_info")
 
-        link_res = requests.post(
+        link_res = get_session(API).post(
             down_request_url,
             headers=self.header_logined,
             # params={sign[0]: sign[1]},
@@ -229,14 +430,23 @@ class Pan123:
             # print(linkRes.json())
             return res_code_download
         down_load_url = link_res.json()["data"]["DownloadUrl"]
-        next_to_get = requests.get(down_load_url, timeout=10, allow_redirects=False).text
+        next_to_get = get_session(CDN).get(down_load_url, timeout=10, allow_redirects=False).text
         url_pattern = re.compile(r"href='(https?://[^']+)'")
         redirect_url = url_pattern.findall(next_to_get)[0]
-        if showlink:
-            print()
-
         return redirect_url
 
+    # 获取用户信息（空间容量等），返回接口的json；并发请求合并为一次
+    def user_info(self):
+        return self._flight.do(("user_info",), self._fetch_user_info)
+
+    def _fetch_user_info(self):
+        res = get_session(API).get(
+            "https://www.123pan.com/b/api/user/info",
+            headers=self.header_logined,
+            timeout=10
+        )
+        return res.json()
+
     def download(self, file_number,download_path="download/"):
         file_detail = self.list[file_number]
         if file_detail["Type"] == 1:
@@ -255,7 +465,7 @@ class Pan123:
         if not os.path.exists(download_path):
             print("文件夹不存在，创建文件夹")
             os.makedirs(download_path)
-        down = requests.get(down_load_url, stream=True, timeout=10)
+        down = get_session(CDN).get(down_load_url, stream=True, timeout=10)
 
         file_size = int(down.headers["Content-Length"])  # 文件大小
         content_size = int(file_size)  # 文件总大小
@@ -269,7 +479,7 @@ class Pan123:
         time_temp = time1
         data_count_temp = 0
         with open(download_path+file_name, "wb") as f:
-            for i in down.iter_content(1024):
+            for i in bandwidth.iter_shaped(down.iter_content(1024)):
                 f.write(i)
                 done_block = int((data_count / content_size) * 50)
                 data_count = data_count + len(i)
@@ -311,7 +521,7 @@ class Pan123:
                 + str(recycle_id)
                 + "&trashed=true&&Page=1"
         )
-        recycle_res = requests.get(url, headers=self.header_logined, timeout=10)
+        recycle_res = get_session(API).get(url, headers=self.header_logined, timeout=10)
         json_recycle = recycle_res.json()
         recycle_list = json_recycle["data"]["InfoList"]
         self.recycle_list = recycle_list
@@ -335,21 +545,25 @@ class Pan123:
             else:
                 print("文件不存在")
                 return
+        dele_json = self.trash_file(file_detail, operation)
+        print(dele_json)
+        message = dele_json["message"]
+        print(message)
+
+    # 直接传入文件信息删除（放入回收站）或恢复，返回接口的json
+    def trash_file(self, file_detail, operation=True):
         data_delete = {
             "driveId": 0,
             "fileTrashInfoList": file_detail,
             "operation": operation,
         }
-        delete_res = requests.post(
+        delete_res = get_session(API).post(
             "https://www.123pan.com/a/api/file/trash",
             data=json.dumps(data_delete),
             headers=self.header_logined,
             timeout=10
         )
-        dele_json = delete_res.json()
-        print(dele_json)
-        message = dele_json["message"]
-        print(message)
+        return delete_res.json()
 
     def share(self):
         file_id_list = ""
@@ -373,21 +587,7 @@ class Pan123:
         if str(add) == "0":
             share_pwd = input("提取码，不设留空：")
             file_id_list = file_id_list.strip(",")
-            data = {
-                "driveId": 0,
-                "expiration": "2099-12-12T08:00:00+08:00",
-                "fileIdList": file_id_list,
-                "shareName": "My Share",
-                "sharePwd": share_pwd,
-                "event": "shareCreate"
-            }
-            share_res = requests.post(
-                "https://www.123pan.com/a/api/share/create",
-                headers=self.header_logined,
-                data=json.dumps(data),
-                timeout=10
-            )
-            share_res_json = share_res.json()
+            share_res_json = self.create_share(file_id_list, "My Share", share_pwd)
             if share_res_json["code"] != 0:
                 print(share_res_json["message"])
                 print("分享失败")
@@ -400,7 +600,190 @@ class Pan123:
         else:
             print("退出分享")
 
-    def up_load(self, file_path, file_name=None):
+    # 创建分享，file_ids 为逗号分隔的文件ID字符串或ID列表，返回接口的json
+    def create_share(self, file_ids, share_name, share_pwd=""):
+        if not isinstance(file_ids, str):
+            file_ids = ",".join(str(i) for i in file_ids)
+        data = {
+            "driveId": 0,
+            "expiration": "2099-12-12T08:00:00+08:00",
+            "fileIdList": file_ids,
+            "shareName": share_name,
+            "sharePwd": share_pwd,
+            "event": "shareCreate"
+        }
+        share_res = get_session(API).post(
+            "https://www.123pan.com/a/api/share/create",
+            headers=self.header_logined,
+            data=json.dumps(data),
+            timeout=10
+        )
+        return share_res.json()
+
+    # 在指定目录下创建文件夹，返回接口的json，不修改 self.list
+    def create_dir(self, parent_file_id, dirname, duplicate=0):
+        data = {
+            "driveId": 0,
+            "etag": "",
+            "fileName": dirname,
+            "parentFileId": parent_file_id,
+            "size": 0,
+            "type": 1,
+            "duplicate": duplicate
+        }
+        create_res = get_session(API).post(
+            "https://www.123pan.com/b/api/file/upload_request",
+            headers=self.header_logined,
+            data=json.dumps(data),
+            timeout=10
+        )
+        return create_res.json()
+
+    # 批量获取分块 [start, end) 的上传链接，返回 {"分块号": 链接}
+    def _presign_parts(self, session_data, start, end):
+        get_link_data = {
+            "bucket": session_data["bucket"],
+            "key": session_data["key"],
+            "partNumberEnd": end,
+            "partNumberStart": start,
+            "uploadId": session_data["uploadId"],
+            "StorageNode": session_data["storageNode"],
+        }
+        get_link_res = get_session(API).post(
+            "https://www.123pan.com/b/api/file/s3_repare_upload_parts_batch",
+            headers=self.header_logined,
+            data=json.dumps(get_link_data),
+            timeout=10
+        )
+        get_link_res_json = get_link_res.json()
+        if get_link_res_json["code"] != 0:
+            raise Exception("获取上传链接失败:" + str(get_link_res_json["code"]))
+        return get_link_res_json["data"]["presignedUrls"]
+
+    # 记录一块的上传速度，按滑动平均更新 self.part_throughput
+    def _record_throughput(self, size, elapsed):
+        if elapsed <= 0 or size < MIN_PART_SIZE // 5:
+            return  # 太小的块测不准
+        with self._throughput_lock:
+            speed = size / elapsed
+            if self.part_throughput is None:
+                self.part_throughput = speed
+            else:
+                self.part_throughput = self.part_throughput * 0.7 + speed * 0.3
+
+    # 上传本地文件的一个分块，返回上传的字节数
+    # mapped 为整个文件的只读映射时直接发送映射上的切片，上传后把这段交还给系统，
+    # 常驻内存不随文件大小增长；为None时读入本线程复用的缓冲区
+    def _upload_part(self, file_path, mapped, urls, part_number, offset, size, user=None):
+        if mapped is None:
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                data = _thread_buffer(size)
+                n = f.readinto(data)
+            return self._put_part(urls, part_number, data[:n], user)
+        with memoryview(mapped)[offset:offset + size] as data:
+            uploaded = self._put_part(urls, part_number, data, user)
+        if hasattr(mmap, "MADV_DONTNEED") and offset % mmap.PAGESIZE == 0:
+            mapped.madvise(mmap.MADV_DONTNEED, offset, size)
+        return uploaded
+
+    # 上传一个分块的内容，失败时重新获取链接并重试 self.part_retries 次，返回上传的字节数
+    # 发送速度受 bandwidth 的全局和用户 user 的限速约束
+    def _put_part(self, urls, part_number, data, user=None):
+        error = None
+        for attempt in range(self.part_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt, 10))
+            try:
+                upload_url = urls.get(part_number)
+                start = time.time()
+                res = get_session(STORAGE).put(upload_url, data=bandwidth.shaped(data, user), timeout=10)
+                if res.status_code == 200:
+                    self._record_throughput(len(data), time.time() - start)
+                    return len(data)
+                error = "HTTP " + str(res.status_code)
+            except Exception as e:
+                error = e
+            # 链接可能已过期，重试时重新获取
+            urls.invalidate(part_number)
+        raise Exception(f"分块{part_number}上传失败: {error}")
+
+    # 查询上传会话中服务端已有的分块，返回 (code, {分块号: 字节数})
+    # 返回中没有分块列表时第二项为None
+    def _list_upload_parts(self, session_data):
+        list_res = get_session(API).post(
+            "https://www.123pan.com/b/api/file/s3_list_upload_parts",
+            headers=self.header_logined,
+            data=json.dumps(session_data),
+            timeout=10
+        )
+        list_res_json = list_res.json()
+        if list_res_json["code"] != 0:
+            return list_res_json["code"], None
+        parts = (list_res_json.get("data") or {}).get("Parts")
+        if parts is None:
+            return 0, None
+        return 0, {int(i["PartNumber"]): int(i.get("Size", 0)) for i in parts}
+
+    # 同时上传所有分块，返回 {分块号: 字节数}，有分块重试后仍失败时返回None
+    # done 为已上传的分块 {分块号: 字节数}，跳过不传；每完成一块调用 on_part(分块号, 字节数)
+    def _upload_parts(self, file_path, fsize, session_data, block_size, workers, done=None, on_part=None,
+                      user=None):
+        part_count = math.ceil(fsize / block_size)
+        done = done or {}
+        urls = PresignedUrls(
+            lambda start, end: self._presign_parts(session_data, start, end),
+            part_count, window=self.presign_window
+        )
+        uploaded = dict(done)
+        put_size = sum(done.values())
+        # 所有分块共用一个只读映射，线程池退出（没有分块还在使用）后关闭
+        with open(file_path, "rb") as local_file:
+            mapped = _map_file(local_file, fsize)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = {
+                    executor.submit(
+                        self._upload_part, file_path, mapped, urls, n,
+                        (n - 1) * block_size, min(block_size, fsize - (n - 1) * block_size), user
+                    ): n
+                    for n in range(1, part_count + 1)
+                    if n not in done
+                }
+                for future in as_completed(futures):
+                    part_number = futures[future]
+                    try:
+                        uploaded[part_number] = future.result()
+                    except Exception as e:
+                        print()
+                        print(e)
+                        for f in futures:
+                            f.cancel()
+                        return None
+                    if on_part is not None:
+                        on_part(part_number, uploaded[part_number])
+                    put_size += uploaded[part_number]
+                    print("\r已上传：" + str(round(put_size / fsize * 100, 2)) + "%", end="")
+        finally:
+            if mapped is not None:
+                mapped.close()
+        print()
+        # 分块完成顺序不定，合并前确认1..part_count每一块都已上传
+        if any(n not in uploaded for n in range(1, part_count + 1)):
+            return None
+        return dict(sorted(uploaded.items()))
+
+    # parent_file_id 为上传到的目录，不指定时使用当前目录 self.parent_file_id
+    # upload_workers 为同时上传的分块数，不指定时使用 self.upload_workers
+    # etag 为文件的MD5，调用方已经算好（如接收上传时边写边算）时传入，不再重新读取文件计算
+    # duplicate 为遇到同名文件时的处理：None 时询问，0 放弃，1 覆盖，2 保留两者
+    # defer_complete 不为None时，合并分块后不等待123pan完成，调用 defer_complete(FileId) 后直接返回FileId，
+    # 由调用方用 check_upload_complete 确认（如交给后台轮询）；秒传的文件不会调用
+    # user 为发起上传的用户，按该用户的限速上传（见 bandwidth）
+    def up_load(self, file_path, file_name=None, parent_file_id=None, upload_workers=None, etag=None,
+                duplicate=None, defer_complete=None, user=None):
+        if parent_file_id is None:
+            parent_file_id = self.parent_file_id
         file_path = file_path.replace('"', "")
         file_path = file_path.replace("\\", "/")
         if file_name is None:
@@ -413,197 +796,328 @@ class Pan123:
             print("暂不支持文件夹上传")
             return
         fsize = os.path.getsize(file_path)
-        with open(file_path, "rb") as f:
-            md5 = hashlib.md5()
-            while True:
-                data = f.read(64 * 1024)
-                if not data:
-                    break
-                md5.update(data)
-            readable_hash = md5.hexdigest()
-
-        list_up_request = {
-            "driveId": 0,
-            "etag": readable_hash,
-            "fileName": file_name,
-            "parentFileId": self.parent_file_id,
-            "size": fsize,
-            "type": 0,
-            "duplicate": 0,
-        }
+        if etag:
+            readable_hash = etag
+        elif self.md5_cache is not None:
+            readable_hash = self.md5_cache.hash_file(file_path)
+        else:
+            readable_hash = file_md5(file_path)
 
-        # sign = getSign("/b/api/file/upload_request")
-        up_res = requests.post(
-            "https://www.123pan.com/b/api/file/upload_request",
-            headers=self.header_logined,
-            # params={sign[0]: sign[1]},
-            data=list_up_request,
-            timeout=10
-        )
-        up_res_json = up_res.json()
-        res_code_up = up_res_json["code"]
-        if res_code_up == 5060:
-            sure_upload = input("检测到1个同名文件,输入1覆盖，2保留两者，0取消：")
-            if sure_upload == "1":
-                list_up_request["duplicate"] = 1
-
-            elif sure_upload == "2":
-                list_up_request["duplicate"] = 2
+        block_size = choose_part_size(fsize, self.part_throughput)
+        # 单个分块的小文件：不查询已上传分块、不写断点记录，省去这些请求
+        single_part = fsize <= block_size
+        journal = None if single_part else self.upload_journal
+        journal_key = UploadJournal.make_key(readable_hash, fsize, parent_file_id, file_name)
+        resumed = journal.get(journal_key) if journal else None
+        done = {}
+        if resumed is not None:
+            # 有未完成的上传记录，和服务端已有的分块核对后继续
+            start_data = resumed["session"]
+            up_file_id = resumed["FileId"]
+            block_size = resumed["block_size"]
+            res_code_up, server_parts = self._list_upload_parts(start_data)
+            if res_code_up != 0:
+                print("上传会话已失效，重新上传")
+                journal.remove(journal_key)
+                resumed = None
             else:
-                print("取消上传")
-                return
+                done = resumed["parts"]
+                if server_parts is not None:
+                    done = {n: size for n, size in done.items() if n in server_parts}
+                    journal.set_parts(journal_key, done)
+                print("继续上次的上传，已上传分块数:", len(done))
+
+        if resumed is None:
+            list_up_request = {
+                "driveId": 0,
+                "etag": readable_hash,
+                "fileName": file_name,
+                "parentFileId": parent_file_id,
+                "size": fsize,
+                "type": 0,
+                "duplicate": duplicate or 0,
+            }
+
             # sign = getSign("/b/api/file/upload_request")
-            up_res = requests.post(
+            up_res = get_session(API).post(
                 "https://www.123pan.com/b/api/file/upload_request",
                 headers=self.header_logined,
                 # params={sign[0]: sign[1]},
-                data=json.dumps(list_up_request),
+                data=list_up_request,
                 timeout=10
             )
             up_res_json = up_res.json()
-        res_code_up = up_res_json["code"]
-        if res_code_up == 0:
-            # print(upResJson)
-            # print("上传请求成功")
-            reuse = up_res_json["data"]["Reuse"]
-            if reuse:
-                print("上传成功，文件已MD5复用")
+            res_code_up = up_res_json["code"]
+            if res_code_up == 5060:
+                if duplicate is not None:
+                    print("检测到同名文件，取消上传")
+                    return
+                sure_upload = input("检测到1个同名文件,输入1覆盖，2保留两者，0取消：")
+                if sure_upload == "1":
+                    list_up_request["duplicate"] = 1
+
+                elif sure_upload == "2":
+                    list_up_request["duplicate"] = 2
+                else:
+                    print("取消上传")
+                    return
+                # sign = getSign("/b/api/file/upload_request")
+                up_res = get_session(API).post(
+                    "https://www.123pan.com/b/api/file/upload_request",
+                    headers=self.header_logined,
+                    # params={sign[0]: sign[1]},
+                    data=json.dumps(list_up_request),
+                    timeout=10
+                )
+                up_res_json = up_res.json()
+            res_code_up = up_res_json["code"]
+            if res_code_up == 0:
+                # print(upResJson)
+                # print("上传请求成功")
+                reuse = up_res_json["data"]["Reuse"]
+                if reuse:
+                    print("上传成功，文件已MD5复用")
+                    return up_res_json["data"].get("FileId")
+            else:
+                print(up_res_json)
+                print("上传请求失败")
                 return
-        else:
-            print(up_res_json)
-            print("上传请求失败")
+
+            start_data = {
+                "bucket": up_res_json["data"]["Bucket"],
+                "key": up_res_json["data"]["Key"],
+                "uploadId": up_res_json["data"]["UploadId"],
+                "storageNode": up_res_json["data"]["StorageNode"],
+            }
+            up_file_id = up_res_json["data"]["FileId"]  # 上传文件的fileId,完成上传后需要用到
+            print("上传文件的fileId:", up_file_id)
+
+            # 获取已将上传的分块
+            if not single_part:
+                res_code_up, _ = self._list_upload_parts(start_data)
+                if res_code_up != 0:
+                    print(start_data)
+                    print("获取传输列表失败")
+                    return
+            if journal:
+                journal.start(journal_key, start_data, up_file_id, block_size)
+
+        # 分块，多个分块同时上传，上传链接按窗口批量获取；每完成一块写入记录
+        uploaded = self._upload_parts(
+            file_path, fsize, start_data, block_size, upload_workers or self.upload_workers,
+            done=done,
+            on_part=(lambda n, size: journal.add_part(journal_key, n, size)) if journal else None,
+            user=user
+        )
+        if uploaded is None:
+            print("上传失败")
             return
 
-        bucket = up_res_json["data"]["Bucket"]
-        storage_node = up_res_json["data"]["StorageNode"]
-        upload_key = up_res_json["data"]["Key"]
-        upload_id = up_res_json["data"]["UploadId"]
-        up_file_id = up_res_json["data"]["FileId"]  # 上传文件的fileId,完成上传后需要用到
-        print("上传文件的fileId:", up_file_id)
+        if defer_complete is not None:
+            self._merge_parts(start_data, list_parts=not single_part)
+            # 分块已合并，重试时无法续传，不再保留上传记录
+            if journal:
+                journal.remove(journal_key)
+            defer_complete(up_file_id)
+            return up_file_id
 
-        # 获取已将上传的分块
-        start_data = {
-            "bucket": bucket,
-            "key": upload_key,
-            "uploadId": upload_id,
-            "storageNode": storage_node,
-        }
-        start_res = requests.post(
-            "https://www.123pan.com/b/api/file/s3_list_upload_parts",
-            headers=self.header_logined,
-            data=json.dumps(start_data),
-            timeout=10
+        res_code_up, close_res_json = self._complete_upload(
+            start_data, up_file_id, list_parts=not single_part
         )
-        start_res_json = start_res.json()
-        res_code_up = start_res_json["code"]
         if res_code_up == 0:
-            # print(startResJson)
-            pass
+            if journal:
+                journal.remove(journal_key)
+            print("上传成功")
+            return up_file_id
         else:
-            print(start_data)
-            print(start_res_json)
-
-            print("获取传输列表失败")
+            # 保留上传记录，重试时所有分块都已上传，直接合并
+            print("上传失败")
+            print(close_res_json)
             return
 
-        # 分块，每一块取一次链接，依次上传
-        block_size = 5242880
-        with open(file_path, "rb") as f:
-            part_number_start = 1
-            put_size = 0
-            while True:
-                data = f.read(block_size)
-
-                precent = round(put_size / fsize, 2)
-                print("\r已上传：" + str(precent * 100) + "%", end="")
-                put_size = put_size + len(data)
-
-                if not data:
-                    break
-                get_link_data = {
-                    "bucket": bucket,
-                    "key": upload_key,
-                    "partNumberEnd": part_number_start + 1,
-                    "partNumberStart": part_number_start,
-                    "uploadId": upload_id,
-                    "StorageNode": storage_node,
-                }
-
-                get_link_url = (
-                    "https://www.123pan.com/b/api/file/s3_repare_upload_parts_batch"
-                )
-                get_link_res = requests.post(
-                    get_link_url,
-                    headers=self.header_logined,
-                    data=json.dumps(get_link_data),
-                    timeout=10
+    # 批量上传多个文件（适合大量小文件）：多个文件的请求同时进行，
+    # 一个文件等待接口返回时其他文件的请求照常发出，每个文件只用一个上传线程
+    # files 为 [(本地路径, 文件名或None), ...]，返回 (结果列表, 每秒文件数)
+    # 结果与 files 顺序一致，成功为FileId，失败为None
+    def up_load_many(self, files, parent_file_id=None, workers=16, duplicate=0):
+        if parent_file_id is None:
+            parent_file_id = self.parent_file_id
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(
+                    self.up_load, file_path, file_name, parent_file_id,
+                    upload_workers=1, duplicate=duplicate
                 )
-                get_link_res_json = get_link_res.json()
-                res_code_up = get_link_res_json["code"]
-                if res_code_up == 0:
-                    # print("获取链接成功")
-                    pass
-                else:
-                    # print(getLinkResJson)
-                    return
-                # print(getLinkResJson)
-                upload_url = get_link_res_json["data"]["presignedUrls"][
-                    str(part_number_start)
-                ]
-                # print("上传链接",uploadUrl)
-                requests.put(upload_url, data=data, timeout=10)
-                # print("put")
+                for file_path, file_name in files
+            ]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(e)
+                    results.append(None)
+        elapsed = time.time() - start
+        if self.md5_cache is not None:
+            self.md5_cache.flush()
+        files_per_sec = round(len(files) / elapsed, 2) if elapsed > 0 else float(len(files))
+        print(f"上传完成：{sum(1 for r in results if r)}/{len(files)}个文件，{files_per_sec}个/秒")
+        return results, files_per_sec
 
-                part_number_start = part_number_start + 1
-
-        print()
-        # 完成标志
+    # 合并已上传的分块
+    # list_parts 为False时跳过合并前的分块查询（只有一个分块时不需要）
+    def _merge_parts(self, session_data, list_parts=True):
         # 1.获取已上传的块
-        uploaded_list_url = "https://www.123pan.com/b/api/file/s3_list_upload_parts"
-        uploaded_comp_data = {
-            "bucket": bucket,
-            "key": upload_key,
-            "uploadId": upload_id,
-            "storageNode": storage_node,
-        }
-        # print(uploadedCompData)
-        requests.post(
-            uploaded_list_url,
+        if list_parts:
+            self._list_upload_parts(session_data)
+        # 2.合并分块
+        get_session(API).post(
+            "https://www.123pan.com/b/api/file/s3_complete_multipart_upload",
             headers=self.header_logined,
-            data=json.dumps(uploaded_comp_data),
+            data=json.dumps(session_data),
             timeout=10
         )
-        compmultipart_up_url = (
-            "https://www.123pan.com/b/api/file/s3_complete_multipart_upload"
-        )
-        requests.post(
-            compmultipart_up_url,
+
+    # 报告完成上传，关闭upload session；返回 (是否已完成, upload_complete的json)
+    # 大文件合并较慢，123pan处理完之前返回错误码或 completed 为 false，稍后再次确认即可
+    def check_upload_complete(self, up_file_id):
+        close_up_session_res = get_session(API).post(
+            "https://www.123pan.com/b/api/file/upload_complete",
             headers=self.header_logined,
-            data=json.dumps(uploaded_comp_data),
+            data=json.dumps({"fileId": up_file_id}),
             timeout=10
         )
+        close_res_json = close_up_session_res.json()
+        done = close_res_json.get("code") == 0 and (close_res_json.get("data") or {}).get("completed", True)
+        return bool(done), close_res_json
+
+    # 合并分块并确认上传完成，返回 (code, upload_complete的json)
+    # 未完成时按退避间隔重试，直到完成或超过 COMPLETE_POLL_TIMEOUT
+    def _complete_upload(self, session_data, up_file_id, list_parts=True):
+        self._merge_parts(session_data, list_parts)
+        deadline = time.time() + COMPLETE_POLL_TIMEOUT
+        delay = COMPLETE_POLL_DELAY
+        while True:
+            try:
+                done, close_res_json = self.check_upload_complete(up_file_id)
+                if done:
+                    return 0, close_res_json
+            except (requests.RequestException, ValueError) as e:
+                close_res_json = {"code": -1, "message": str(e)}
+            if time.time() + delay > deadline:
+                code = close_res_json.get("code")
+                return (code if code else -1), close_res_json
+            time.sleep(delay)
+            delay = min(delay * 2, COMPLETE_POLL_MAX_DELAY)
 
-        # 3.报告完成上传，关闭upload session
-        if fsize > 64 * 1024 * 1024:
-            time.sleep(3)
-        close_up_session_url = "https://www.123pan.com/b/api/file/upload_complete"
-        close_up_session_data = {"fileId": up_file_id}
-        # print(closeUpSessionData)
-        close_up_session_res = requests.post(
-            close_up_session_url,
+    # 从流中边读边上传，不写本地文件，成功返回FileId
+    # 123pan需要在上传前知道文件的 size 和 etag（MD5），由调用方提供，读完后校验
+    # 同时在内存中的分块最多 window 个（默认为上传线程数的2倍），每块5MB~16MB
+    # duplicate: 0 遇到同名文件时放弃，1 覆盖，2 保留两者
+    def up_load_stream(self, stream, file_name, size, etag, parent_file_id=None,
+                       upload_workers=None, window=None, duplicate=0, user=None):
+        if parent_file_id is None:
+            parent_file_id = self.parent_file_id
+        up_res = get_session(API).post(
+            "https://www.123pan.com/b/api/file/upload_request",
             headers=self.header_logined,
-            data=json.dumps(close_up_session_data),
+            data=json.dumps({
+                "driveId": 0,
+                "etag": etag,
+                "fileName": file_name,
+                "parentFileId": parent_file_id,
+                "size": size,
+                "type": 0,
+                "duplicate": duplicate,
+            }),
             timeout=10
         )
-        close_res_json = close_up_session_res.json()
-        # print(closeResJson)
-        res_code_up = close_res_json["code"]
-        if res_code_up == 0:
-            print("上传成功")
-        else:
+        up_res_json = up_res.json()
+        if up_res_json["code"] == 5060:
+            print("检测到同名文件，取消上传")
+            return
+        if up_res_json["code"] != 0:
+            print(up_res_json)
+            print("上传请求失败")
+            return
+        if up_res_json["data"]["Reuse"]:
+            print("上传成功，文件已MD5复用")
+            return up_res_json["data"].get("FileId")
+
+        start_data = {
+            "bucket": up_res_json["data"]["Bucket"],
+            "key": up_res_json["data"]["Key"],
+            "uploadId": up_res_json["data"]["UploadId"],
+            "storageNode": up_res_json["data"]["StorageNode"],
+        }
+        up_file_id = up_res_json["data"]["FileId"]
+        # 内存中的分块数固定，分块不宜太大
+        block_size = choose_part_size(size, self.part_throughput, max_size=STREAM_MAX_PART_SIZE)
+        part_count = math.ceil(size / block_size)
+        urls = PresignedUrls(
+            lambda start, end: self._presign_parts(start_data, start, end),
+            part_count, window=self.presign_window
+        )
+        workers = max(1, upload_workers or self.upload_workers)
+        # 分块读入固定数量的缓冲区，上传完后交还重复使用；缓冲区在第一次使用时才分配
+        buffers = queue.Queue()
+        for _ in range(min(max(workers, window or workers * 2), part_count)):
+            buffers.put(None)
+        failed = threading.Event()
+
+        def part_done(future, buf):
+            buffers.put(buf)
+            if future.cancelled() or future.exception() is not None:
+                failed.set()
+
+        md5 = hashlib.md5()
+        received = 0
+        futures = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for part_number in range(1, part_count + 1):
+                # 在途分块达到上限时等待，直到有分块上传完成
+                buf = buffers.get()
+                if failed.is_set():
+                    break
+                if buf is None:
+                    buf = bytearray(min(block_size, size))
+                expected = min(block_size, size - received)
+                data = memoryview(buf)[:expected]
+                n = _readinto_exact(stream, data)
+                md5.update(data[:n])
+                received += n
+                if n < expected:
+                    break
+                future = executor.submit(self._put_part, urls, part_number, data, user)
+                future.add_done_callback(lambda f, buf=buf: part_done(f, buf))
+                futures.append(future)
+                print("\r已接收：" + str(round(received / size * 100, 2)) + "%", end="")
+            if failed.is_set():
+                for future in futures:
+                    future.cancel()
+        print()
+
+        for future in futures:
+            if not future.cancelled() and future.exception() is not None:
+                print(future.exception())
+        if failed.is_set() or len(futures) != part_count:
             print("上传失败")
-            print(close_res_json)
             return
+        if received != size:
+            print(f"上传内容不完整: 收到{received}字节，应为{size}字节")
+            return
+        if md5.hexdigest() != etag.lower():
+            print("上传内容的MD5与提供的不一致")
+            return
+
+        res_code_up, close_res_json = self._complete_upload(start_data, up_file_id)
+        if res_code_up == 0:
+            print("上传成功")
+            return up_file_id
+        print("上传失败")
+        print(close_res_json)
+        return
 
     # dirId 就是 fileNumber，从0开始，0为第一个文件，传入时需要减一 ！！！（好像文件夹都排在前面）
     def cd(self, dir_num):
@@ -694,7 +1208,7 @@ class Pan123:
             "operateType": 1,
         }
         # sign = getSign("/a/api/file/upload_request")
-        res_mk = requests.post(
+        res_mk = get_session(API).post(
             url,
             headers=self.header_logined,
             data=json.dumps(data_mk),
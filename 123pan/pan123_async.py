@@ -0,0 +1,347 @@
+import asyncio
+import json
+import math
+import os
+import re
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖，只有使用异步客户端时才需要
+    aiohttp = None
+
+import bandwidth
+from md5_cache import file_md5
+from pan123 import (
+    make_header_logined, choose_part_size,
+    COMPLETE_POLL_DELAY, COMPLETE_POLL_MAX_DELAY, COMPLETE_POLL_TIMEOUT,
+)
+
+
+class AsyncPan123:
+    """
+    Pan123 的 asyncio 版本，基于 aiohttp
+
+    所有方法都显式传入目录/文件ID，不保存当前目录，一个实例可以同时发起大量请求。
+    返回值约定与 Pan123 相同：成功返回数据，接口出错返回错误码。
+
+    用法:
+        async with AsyncPan123(user_name="...", pass_word="...") as pan:
+            await pan.login()
+            code, items = await pan.list_dir(0)
+    """
+
+    def __init__(
+            self,
+            user_name="",
+            pass_word="",
+            authorization="",
+            page_size=100,
+            list_max_workers=4,
+            max_connections=100,
+            timeout=10,
+            presign_window=32,
+            part_retries=3,
+    ):
+        if aiohttp is None:
+            raise Exception("异步客户端需要安装aiohttp：pip install aiohttp")
+        self.user_name = user_name
+        self.password = pass_word
+        self.authorization = authorization
+        self.page_size = page_size  # 列目录时每页的条目数
+        self.list_max_workers = list_max_workers  # 列目录时同时请求的分页数
+        self.max_connections = max_connections  # 连接池上限
+        self.timeout = timeout
+        self.presign_window = presign_window  # 每次批量获取上传链接的分块数
+        self.part_retries = part_retries  # 每个分块失败后的重试次数
+        self.header_logined = make_header_logined(authorization)
+        self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                # 与同步版一致：不保存cookie，认证只靠请求头
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post_json(self, url, data, timeout=None):
+        session = await self.open()
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with session.post(url, headers=self.header_logined, data=json.dumps(data), **kwargs) as res:
+            return await res.json(content_type=None)
+
+    async def login(self):
+        data = {"type": 1, "passport": self.user_name, "password": self.password}
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json"
+        }
+        session = await self.open()
+        try:
+            async with session.post("https://www.123pan.com/b/api/user/sign_in", headers=headers, data=data) as res:
+                res_sign = await res.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"登录失败: {e}")
+            return -1
+        res_code_login = res_sign["code"]
+        if res_code_login != 200:
+            print(res_sign["message"])
+            return res_code_login
+        self.authorization = "Bearer " + res_sign["data"]["token"]
+        self.header_logined["authorization"] = self.authorization
+        return res_code_login
+
+    # 获取目录的某一页，返回 (code, 条目列表, Total)
+    async def get_dir_page(self, parent_file_id, page=1, limit=None):
+        params = {
+            "driveId": 0,
+            "limit": limit or self.page_size,
+            "next": 0,
+            "orderBy": "file_id",
+            "orderDirection": "desc",
+            "parentFileId": str(parent_file_id),
+            "trashed": "false",
+            "SearchData": "",
+            "Page": str(page),
+            "OnlyLookAbnormalFile": 0,
+        }
+        session = await self.open()
+        try:
+            async with session.get(
+                    "https://www.123pan.com/b/api/file/list/new", headers=self.header_logined, params=params
+            ) as res:
+                text = await res.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            print("连接失败")
+            return -1, [], 0
+        if text["code"] != 0:
+            print("code = 2 Error:" + str(text["code"]))
+            return text["code"], [], 0
+        return 0, text["data"]["InfoList"], text["data"]["Total"]
+
+    # 逐页获取目录，边获取边返回；调用方停止迭代时不再请求后续页
+    async def iter_dir(self, parent_file_id, pages=False):
+        page = 1
+        lenth_now = 0
+        total = -1
+        while lenth_now < total or total == -1:
+            code, lists_page, total = await self.get_dir_page(parent_file_id, page)
+            if code != 0:
+                raise Exception("code = 2 Error:" + str(code))
+            if not lists_page:
+                return
+            for i in lists_page:
+                i["FileNum"] = lenth_now
+                lenth_now += 1
+            if pages:
+                yield lists_page
+            else:
+                for i in lists_page:
+                    yield i
+            page += 1
+
+    # 获取整个目录：先取第一页拿到Total，其余页最多同时请求 list_max_workers 个，按页码顺序拼接
+    async def list_dir(self, parent_file_id):
+        code, lists, total = await self.get_dir_page(parent_file_id, 1)
+        if code != 0:
+            return code, []
+        per_page = len(lists)
+        if 0 < per_page < total:
+            semaphore = asyncio.Semaphore(max(1, self.list_max_workers))
+
+            async def fetch(page):
+                async with semaphore:
+                    return await self.get_dir_page(parent_file_id, page)
+
+            results = await asyncio.gather(*[fetch(p) for p in range(2, math.ceil(total / per_page) + 1)])
+            for code, lists_page, _ in results:
+                if code != 0:
+                    return code, []
+                lists = lists + lists_page
+        seen = set()
+        unique = []
+        for i in lists:
+            if i["FileId"] not in seen:
+                seen.add(i["FileId"])
+                i["FileNum"] = len(unique)
+                unique.append(i)
+        return 0, unique
+
+    # 获取下载链接，返回跳转后的真实地址，出错时返回错误码
+    async def link_file(self, file_detail):
+        if file_detail["Type"] == 1:
+            url = "https://www.123pan.com/a/api/file/batch_download_info"
+            data = {"fileIdList": [{"fileId": int(file_detail["FileId"])}]}
+        else:
+            url = "https://www.123pan.com/a/api/file/download_info"
+            data = {
+                "driveId": 0,
+                "etag": file_detail["Etag"],
+                "fileId": file_detail["FileId"],
+                "s3keyFlag": file_detail["S3KeyFlag"],
+                "type": file_detail["Type"],
+                "fileName": file_detail["FileName"],
+                "size": file_detail["Size"],
+            }
+        link_res = await self._post_json(url, data)
+        if link_res["code"] != 0:
+            print("code = 3 Error:" + str(link_res["code"]))
+            return link_res["code"]
+        session = await self.open()
+        async with session.get(link_res["data"]["DownloadUrl"], allow_redirects=False) as res:
+            next_to_get = await res.text()
+        return re.findall(r"href='(https?://[^']+)'", next_to_get)[0]
+
+    # 删除（放入回收站）或恢复，返回接口的json
+    async def trash_file(self, file_detail, operation=True):
+        return await self._post_json(
+            "https://www.123pan.com/a/api/file/trash",
+            {"driveId": 0, "fileTrashInfoList": file_detail, "operation": operation},
+        )
+
+    # 上传文件，成功返回FileId，失败返回None
+    # duplicate: 0 遇到同名文件时放弃，1 覆盖，2 保留两者
+    # 发送速度受 bandwidth 的全局和用户 user 的限速约束
+    async def up_load(self, file_path, file_name=None, parent_file_id=0, duplicate=0, block_size=None, user=None):
+        file_path = file_path.replace("\\", "/")
+        if file_name is None:
+            file_name = file_path.split("/")[-1]
+        if not os.path.isfile(file_path):
+            print("文件不存在，请检查路径是否正确")
+            return None
+        fsize = os.path.getsize(file_path)
+        readable_hash = await asyncio.to_thread(file_md5, file_path)
+
+        up_res_json = await self._post_json("https://www.123pan.com/b/api/file/upload_request", {
+            "driveId": 0,
+            "etag": readable_hash,
+            "fileName": file_name,
+            "parentFileId": parent_file_id,
+            "size": fsize,
+            "type": 0,
+            "duplicate": duplicate,
+        })
+        if up_res_json["code"] == 5060:
+            print("检测到同名文件，取消上传")
+            return None
+        if up_res_json["code"] != 0:
+            print(up_res_json)
+            print("上传请求失败")
+            return None
+        if up_res_json["data"]["Reuse"]:
+            print("上传成功，文件已MD5复用")
+            return up_res_json["data"].get("FileId")
+
+        session_data = {
+            "bucket": up_res_json["data"]["Bucket"],
+            "key": up_res_json["data"]["Key"],
+            "uploadId": up_res_json["data"]["UploadId"],
+            "storageNode": up_res_json["data"]["StorageNode"],
+        }
+        up_file_id = up_res_json["data"]["FileId"]
+
+        block_size = block_size or choose_part_size(fsize)
+        part_count = max(1, math.ceil(fsize / block_size))
+        urls = {}
+        for part_number in range(1, part_count + 1):
+            if part_number not in urls:
+                # 一次获取 presign_window 个分块的上传链接
+                urls = await self._presign(
+                    session_data, part_number, min(part_number + self.presign_window, part_count + 1)
+                )
+                if urls is None:
+                    return None
+            data = await asyncio.to_thread(_read_block, file_path, (part_number - 1) * block_size, block_size)
+            if not await self._put_part(session_data, urls, part_number, data, user):
+                print("上传失败")
+                return None
+
+        await self._post_json("https://www.123pan.com/b/api/file/s3_list_upload_parts", session_data)
+        await self._post_json("https://www.123pan.com/b/api/file/s3_complete_multipart_upload", session_data)
+        # 大文件合并较慢，未完成时按退避间隔再次确认
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + COMPLETE_POLL_TIMEOUT
+        delay = COMPLETE_POLL_DELAY
+        while True:
+            close_res_json = await self._post_json(
+                "https://www.123pan.com/b/api/file/upload_complete", {"fileId": up_file_id}
+            )
+            done = close_res_json["code"] == 0 and (close_res_json.get("data") or {}).get("completed", True)
+            if done or loop.time() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, COMPLETE_POLL_MAX_DELAY)
+        if not done:
+            print("上传失败")
+            print(close_res_json)
+            return None
+        print("上传成功")
+        return up_file_id
+
+    # 获取分块 [start, end) 的上传链接，返回 {分块号: 链接}，出错时返回None
+    async def _presign(self, session_data, start, end):
+        get_link_res_json = await self._post_json(
+            "https://www.123pan.com/b/api/file/s3_repare_upload_parts_batch",
+            {
+                "bucket": session_data["bucket"],
+                "key": session_data["key"],
+                "partNumberEnd": end,
+                "partNumberStart": start,
+                "uploadId": session_data["uploadId"],
+                "StorageNode": session_data["storageNode"],
+            },
+        )
+        if get_link_res_json["code"] != 0:
+            print(get_link_res_json)
+            return None
+        return {int(n): url for n, url in get_link_res_json["data"]["presignedUrls"].items()}
+
+    # 上传一个分块，失败时重新获取链接并重试 self.part_retries 次，成功返回True
+    async def _put_part(self, session_data, urls, part_number, data, user=None):
+        session = await self.open()
+        error = None
+        for attempt in range(self.part_retries + 1):
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 10))
+                # 链接可能已过期，重试时重新获取
+                urls.update(await self._presign(session_data, part_number, part_number + 1) or {})
+            upload_url = urls.pop(part_number, None)
+            if upload_url is None:
+                error = "获取上传链接失败"
+                continue
+            # 每次重试重新生成请求体，限速的请求体只能读一遍
+            body = bandwidth.shaped_async(data, user)
+            headers = None if body is data else {"Content-Length": str(len(data))}
+            try:
+                async with session.put(
+                        upload_url, data=body, headers=headers, timeout=aiohttp.ClientTimeout(total=None)
+                ) as res:
+                    await res.read()
+                    if res.status == 200:
+                        return True
+                    error = "HTTP " + str(res.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+        print(f"分块{part_number}上传失败: {error}")
+        return False
+
+
+def _read_block(file_path, offset, size):
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
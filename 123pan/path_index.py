@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+class PathIndex:
+    """
+    路径 -> 文件信息 的索引（带TTL）
+
+    每次列出目录时把子项写入索引，解析路径时优先命中索引，
+    自己发起的创建/上传/删除操作会直接更新索引而不是清空。
+    """
+
+    def __init__(self, ttl=300, max_size=10000):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = {}  # path -> (item, timestamp)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(path):
+        """规范化路径：以"/"开头，去掉多余的"/"和结尾的"/" """
+        parts = [p for p in str(path).replace("\\", "/").split("/") if p]
+        return "/" + "/".join(parts)
+
+    @staticmethod
+    def join(parent_path, name):
+        return PathIndex.normalize(parent_path + "/" + name)
+
+    def get(self, path):
+        path = self.normalize(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            item, timestamp = entry
+            if time.time() - timestamp >= self._ttl:
+                del self._entries[path]
+                return None
+            return item
+
+    def put(self, path, item):
+        path = self.normalize(path)
+        with self._lock:
+            self._evict_if_full()
+            self._entries[path] = (item, time.time())
+
+    def put_children(self, parent_path, items):
+        """
+        用某个目录的完整列表替换其子项，同名项以列表中的第一个为准，
+        列表中已不存在的子项（及其下级路径）会被移除
+        """
+        now = time.time()
+        parent_path = self.normalize(parent_path)
+        prefix = parent_path.rstrip("/") + "/"
+        children = {}
+        for item in items:
+            child_path = self.join(parent_path, item["FileName"])
+            children.setdefault(child_path, item)
+        with self._lock:
+            stale = [
+                k for k in self._entries
+                if k.startswith(prefix) and prefix + k[len(prefix):].split("/", 1)[0] not in children
+            ]
+            for key in stale:
+                del self._entries[key]
+            self._evict_if_full(len(children))
+            for child_path, item in children.items():
+                self._entries[child_path] = (item, now)
+
+    def remove(self, path):
+        """删除路径及其所有子路径，返回删除的条目数"""
+        path = self.normalize(path)
+        prefix = path.rstrip("/") + "/"
+        with self._lock:
+            keys = [k for k in self._entries if k == path or k.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_if_full(self, incoming=1):
+        # 调用方需持有锁；超出容量时先清理过期项，仍不足则丢弃最早写入的一半
+        if len(self._entries) + incoming <= self._max_size:
+            return
+        now = time.time()
+        expired = [k for k, (_, ts) in self._entries.items() if now - ts >= self._ttl]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) + incoming > self._max_size:
+            oldest = sorted(self._entries.items(), key=lambda kv: kv[1][1])
+            for key, _ in oldest[:len(oldest) // 2 + incoming]:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
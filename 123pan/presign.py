@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+class PresignedUrls:
+    """
+    分块上传链接（预签名URL）的批量缓存
+
+    某个分块没有可用链接时，一次请求从该分块开始的 window 个分块的链接，
+    后续分块直接使用缓存；超过 ttl 的链接或被 invalidate() 的链接会重新获取。
+    """
+
+    def __init__(self, fetch, part_count, window=32, ttl=600):
+        """
+        参数:
+            fetch: 函数 (start, end) -> {"分块号": 链接}，获取 [start, end) 的链接，出错时抛出异常
+            part_count: 分块总数
+            window: 每次获取的分块数
+            ttl: 链接的有效期（秒），应小于服务端签名的过期时间
+        """
+        self._fetch = fetch
+        self._part_count = part_count
+        self._window = max(1, window)
+        self._ttl = ttl
+        self._urls = {}  # 分块号 -> (链接, 获取时间)
+        self._lock = threading.Lock()
+        self.fetch_count = 0  # 实际请求链接的次数
+
+    def _valid(self, part_number):
+        entry = self._urls.get(part_number)
+        if entry is not None and time.time() - entry[1] < self._ttl:
+            return entry[0]
+        return None
+
+    def get(self, part_number):
+        url = self._valid(part_number)
+        if url is not None:
+            return url
+        with self._lock:
+            # 等锁期间可能已被其他线程获取
+            url = self._valid(part_number)
+            if url is not None:
+                return url
+            end = min(part_number + self._window, self._part_count + 1)
+            urls = self._fetch(part_number, end)
+            self.fetch_count += 1
+            now = time.time()
+            for n in range(part_number, end):
+                if str(n) in urls:
+                    self._urls[n] = (urls[str(n)], now)
+            # 本次没有返回这个分块时，缓存中过期的旧链接也不能用
+            url = self._valid(part_number)
+            if url is None:
+                raise Exception(f"未获取到分块{part_number}的上传链接")
+            return url
+
+    def invalidate(self, part_number):
+        """链接失效（如上传返回403）时调用，下次get会重新获取"""
+        with self._lock:
+            self._urls.pop(part_number, None)
@@ -0,0 +1,51 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from path_index import PathIndex
+
+
+class WalkLimitReached(Exception):
+    """遍历条目数达到max_entries"""
+
+
+def walk_tree(list_children, root_id, root_path="/", max_workers=4, max_depth=None, max_entries=None):
+    """
+    广度优先遍历整个目录树，每个文件夹列出后立即返回其中的条目
+
+    参数:
+        list_children: 函数 (folder_id, folder_path) -> 条目列表，出错时抛出异常
+        root_id: 起始文件夹ID
+        root_path: 起始文件夹路径，用于拼接返回的路径
+        max_workers: 同时列出的文件夹数
+        max_depth: 最大深度（root的直接子项为第1层），None为不限
+        max_entries: 最多返回的条目数，None为不限；达到后停止并抛出WalkLimitReached
+
+    返回:
+        生成器，依次产生 (路径, 条目, 深度)
+        调用方提前停止迭代时，未开始的列目录请求会被取消
+    """
+    waiting = deque([(root_id, PathIndex.normalize(root_path), 1)])
+    running = {}  # Future -> (folder_path, depth)
+    count = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        while waiting or running:
+            # 按发现顺序提交，保证同时进行的请求不超过max_workers
+            while waiting and len(running) < max_workers:
+                folder_id, folder_path, depth = waiting.popleft()
+                future = executor.submit(list_children, folder_id, folder_path)
+                running[future] = (folder_path, depth)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder_path, depth = running.pop(future)
+                for item in future.result():
+                    if max_entries is not None and count >= max_entries:
+                        raise WalkLimitReached(f"条目数超过上限{max_entries}")
+                    count += 1
+                    item_path = PathIndex.join(folder_path, item["FileName"])
+                    yield item_path, item, depth
+                    if item["Type"] == 1 and (max_depth is None or depth < max_depth):
+                        waiting.append((item["FileId"], item_path, depth + 1))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,167 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadJobs:
+    """
+    后台上传任务
+
+    submit() 在后台线程中执行上传并立即返回任务ID，调用方用 get() 查询进度。
+    上传函数返回结果字典时任务结束；返回 None 表示分块已合并、等待123pan完成，
+    此时上传函数应已调用 poll()：确认请求按退避间隔（first_delay 起每次翻倍，最多 max_delay）
+    由一个调度线程安排，等待期间不占用任何线程，超过 timeout 仍未完成则任务失败。
+    """
+
+    def __init__(self, max_workers=2, poll_workers=2, first_delay=1, max_delay=30, timeout=600, keep=1000):
+        """
+        参数:
+            max_workers: 同时进行的上传任务数
+            poll_workers: 同时进行的完成确认请求数
+            first_delay: 第一次确认前等待的秒数
+            max_delay: 两次确认之间最多等待的秒数
+            timeout: 从开始确认起最多等待的秒数
+            keep: 最多保留的已结束任务数，超过后删除最早结束的
+        """
+        self._max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._poll_executor = ThreadPoolExecutor(max_workers=max(1, poll_workers))
+        self._first_delay = first_delay
+        self._max_delay = max_delay
+        self._timeout = timeout
+        self._keep = keep
+        self._jobs = {}  # 任务ID -> 任务信息
+        self._finished = []  # 按结束顺序排列的任务ID
+        self._timers = []  # 堆 (到期时间, 序号, 轮询信息)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def set_max_workers(self, max_workers):
+        """修改同时进行的上传任务数；已提交的任务仍在原来的线程中执行完"""
+        max_workers = max(1, max_workers)
+        with self._cond:
+            if max_workers == self._max_workers:
+                return
+            old = self._executor
+            self._max_workers = max_workers
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        old.shutdown(wait=False)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        在后台执行 fn(任务ID, *args, **kwargs)，返回任务ID
+
+        fn 返回结果字典（含 "error" 表示失败）时任务结束；返回 None 时任务进入等待完成状态
+        """
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "uploading",
+                "result": None,
+                "attempts": 0,
+                "created": time.time(),
+                "updated": time.time(),
+            }
+            executor = self._executor
+        executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        try:
+            result = fn(job_id, *args, **kwargs)
+        except Exception as e:
+            result = {"error": str(e)}
+        if result is not None:
+            self._finish(job_id, result)
+
+    def poll(self, job_id, check, on_done=None):
+        """
+        开始确认上传完成
+
+        参数:
+            check: 函数 () -> (是否完成, 结果字典)，出错时抛出异常（视为未完成，稍后重试）
+            on_done: 任务结束时调用 on_done(结果字典)
+        """
+        now = time.time()
+        state = {
+            "job_id": job_id,
+            "check": check,
+            "on_done": on_done,
+            "delay": self._first_delay,
+            "deadline": now + self._timeout,
+            "last_error": None,
+        }
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["status"] = "completing"
+                job["updated"] = now
+            self._schedule(state, now + self._first_delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="upload-poller", daemon=True)
+                self._thread.start()
+
+    def _schedule(self, state, due):
+        heapq.heappush(self._timers, (due, next(self._seq), state))
+        self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._timers or self._timers[0][0] > time.time():
+                    self._cond.wait(self._timers[0][0] - time.time() if self._timers else None)
+                _, _, state = heapq.heappop(self._timers)
+            self._poll_executor.submit(self._check, state)
+
+    def _check(self, state):
+        job_id = state["job_id"]
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["attempts"] += 1
+        try:
+            done, result = state["check"]()
+        except Exception as e:
+            done, result = False, None
+            state["last_error"] = str(e)
+        if done:
+            self._finish(job_id, result, state["on_done"])
+            return
+        now = time.time()
+        if now >= state["deadline"]:
+            error = "等待上传完成超时"
+            if state["last_error"]:
+                error += f": {state['last_error']}"
+            self._finish(job_id, {"error": error}, state["on_done"])
+            return
+        state["delay"] = min(state["delay"] * 2, self._max_delay)
+        with self._cond:
+            self._schedule(state, min(now + state["delay"], state["deadline"]))
+
+    def _finish(self, job_id, result, on_done=None):
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception as e:
+                print(f"上传任务回调出错: {e}")
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = "failed" if "error" in result else "success"
+            job["result"] = result
+            job["updated"] = time.time()
+            self._finished.append(job_id)
+            while len(self._finished) > self._keep:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def get(self, job_id):
+        """返回任务信息 {"job_id", "status", "result", "attempts", "created", "updated"}，不存在时返回None"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
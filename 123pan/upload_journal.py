@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+
+
+class UploadJournal:
+    """
+    分块上传的本地记录，用于断点续传
+
+    每个未完成的上传保存一条记录：上传会话（bucket、key、uploadId、storageNode）、
+    FileId、分块大小和已上传的分块。同一文件再次上传时跳过已上传的分块。
+    每次修改都写回文件（先写临时文件再替换），进程退出后记录仍在。
+    """
+
+    def __init__(self, path="upload_journal.json", max_age=7 * 24 * 3600):
+        """
+        参数:
+            path: 记录文件路径
+            max_age: 记录的有效期（秒），超过后视为上传会话已失效
+        """
+        self._path = path
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    @staticmethod
+    def make_key(etag, size, parent_file_id, file_name):
+        """同一内容上传到同一目录的同名文件视为同一个上传"""
+        return f"{etag}:{size}:{parent_file_id}:{file_name}"
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取上传记录失败，忽略已有记录: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path)
+
+    def get(self, key):
+        """返回未过期的记录 {"session", "FileId", "block_size", "parts": {分块号: 字节数}}，没有时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["created"] >= self._max_age:
+                del self._entries[key]
+                self._save()
+                return None
+            return {
+                "session": dict(entry["session"]),
+                "FileId": entry["FileId"],
+                "block_size": entry["block_size"],
+                "parts": {int(n): size for n, size in entry["parts"].items()},
+            }
+
+    def start(self, key, session, file_id, block_size):
+        with self._lock:
+            self._entries[key] = {
+                "session": session,
+                "FileId": file_id,
+                "block_size": block_size,
+                "parts": {},
+                "created": time.time(),
+            }
+            self._save()
+
+    def add_part(self, key, part_number, size):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["parts"][str(part_number)] = size
+            self._save()
+
+    def set_parts(self, key, parts):
+        """用服务端确认过的分块替换记录中的分块"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["parts"] = {str(n): size for n, size in parts.items()}
+            self._save()
+
+    def remove(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
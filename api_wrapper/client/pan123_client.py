@@ -63,10 +63,7 @@ class Pan123Client:
         if not self.client:
             return {"error": "未登录"}
         try:
-            url = "https://www.123pan.com/b/api/user/info"
-            import requests
-            res = requests.get(url, headers=self.client.header_logined, timeout=10)
-            data = res.json()
+            data = self.client.user_info()
             if data.get("code") == 0:
                 return {
                     "success": True,
@@ -87,14 +84,15 @@ class Pan123Client:
                 folder_id = self._get_file_id_by_path(path)
                 if folder_id is None:
                     return {"error": "路径不存在"}
-                self.client.parent_file_id = folder_id
             else:
-                self.client.parent_file_id = 0
+                folder_id = 0
             
-            self.client.get_dir()
+            code, items = self.client.list_dir(folder_id)
+            if code != 0:
+                return {"error": f"获取目录失败: {code}"}
             results = {"folder": [], "file": []}
             
-            for item in self.client.list:
+            for item in items:
                 name = item.get("FileName", "")
                 if keyword.lower() in name.lower():
                     if item["Type"] == 1:
@@ -124,10 +122,9 @@ class Pan123Client:
         for part in parts:
             if not part:
                 continue
-            self.client.parent_file_id = current_id
-            self.client.get_dir()
+            code, items = self.client.list_dir(current_id)
             found = False
-            for item in self.client.list:
+            for item in items:
                 if item["FileName"] == part:
                     current_id = item["FileId"]
                     found = True
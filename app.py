@@ -5,10 +5,13 @@ import re
 import uuid
 import math
 import shutil
-import requests
+import tempfile
+import threading
 from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from flask import Flask, request, jsonify, render_template, send_from_directory, send_file, Response
+from flask import Flask, Request, request, jsonify, render_template, send_from_directory, send_file, Response
 from flask_cors import CORS  # 补充这行：导入CORS类（修复NameError的核心）
 import jwt  # 补充：之前代码用到jwt但未导入，也一起补上，避免后续报错
 # 新增：切片下载相关
@@ -20,6 +23,16 @@ BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static',
 SLICE_TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'temp', 'slice')
 DEFAULT_SLICE_SIZE = 52428800  # 50MB/切片，可按需调整
 SLICE_TIMEOUT = 60  # 切片下载超时时间（秒）
+SLICE_MAX_WORKERS = 4  # 服务端同时下载的切片数（所有任务共用）
+SLICE_RETRIES = 3  # 单个切片下载失败后的重试次数
+SLICE_RETRY_DELAY = 2  # 切片第一次重试前等待的秒数，之后每次翻倍，最多10秒
+SLICE_TASK_EXPIRE = 3600  # 切片任务超过此时间（秒）没有查询或下载进展则删除
+LIST_MAX_PAGE_SIZE = 100  # /api/list 单页最大条目数（123pan列目录接口的单页上限）
+STATS_MAX_ENTRIES = 100000  # 递归统计时最多遍历的条目数
+# 不放在static下，未完成的分块上传不能通过 /static 直接访问
+CHUNK_UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'upload')
+CHUNK_UPLOAD_EXPIRE = 24 * 3600  # 分块上传任务超过此时间（秒）未完成则清理
+chunk_upload_lock = threading.RLock()  # 提交后台上传与删除分块上传目录互斥
 os.makedirs(SLICE_TEMP_DIR, exist_ok=True)  # 确保切片临时目录存在
 
 def load_config():
@@ -116,45 +129,199 @@ def generate_unique_slice_url(download_base_url):
     join_char = '&' if '?' in download_base_url else '?'
     return f"{download_base_url}{join_char}{unique_params}"
 
-def download_single_slice(slice_url, save_path):
-    """下载单个切片，独立请求，确保被识别为不同下载"""
-    # 复用123pan的请求头（从pan_api中自动继承，无需额外配置）
-    resp = requests.get(
+def slice_ranges(file_size, slice_size):
+    """按切片大小把文件分成 [(起始字节, 结束字节)]，结束字节包含在内，与Range请求头一致"""
+    return [(start, min(start + slice_size, file_size) - 1) for start in range(0, file_size, slice_size)]
+
+def preallocate_file(path, size):
+    """创建 size 字节的目标文件：支持时预先分配磁盘空间，否则建成稀疏文件"""
+    with open(path, 'wb') as f:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass  # 文件系统不支持时退回稀疏文件
+        f.truncate(size)
+
+def write_at(f, data, offset):
+    """把 data 写到文件的 offset 处；有pwrite时不移动文件位置"""
+    if not hasattr(os, 'pwrite'):
+        f.seek(offset)
+        f.write(data)
+        return
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(f.fileno(), view, offset)
+        view = view[written:]
+        offset += written
+
+def download_single_slice(slice_url, target_path, start, end, user=None, cancelled=None):
+    """
+    用Range请求下载文件的 [start, end] 字节，直接写入预分配的 target_path 的相同位置；
+    速度受全局和用户 user 的限速约束
+    响应必须是206且Content-Range与请求一致，收到的字节数不对时抛出异常（这段内容需要重新下载）
+    cancelled() 返回True时停止下载并抛出异常
+    """
+    resp = get_session(CDN).get(
         slice_url,
         stream=True,
         timeout=SLICE_TIMEOUT,
         headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36',
+            'Range': f'bytes={start}-{end}'
         }
     )
-    resp.raise_for_status()
-    with open(save_path, 'wb') as f:
-        for chunk in resp.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-
-def merge_slices(task_id, file_name):
-    """自动合并所有切片，合并后清理临时切片文件"""
-    task_dir = os.path.join(SLICE_TEMP_DIR, task_id)
-    if not os.path.exists(task_dir):
-        return None, f"切片任务目录{task_id}不存在"
-    # 按切片索引排序，保证合并顺序正确
-    slice_files = sorted(
-        [f for f in os.listdir(task_dir) if f.startswith('slice_') and f.endswith('.part')],
-        key=lambda x: int(x.split('_')[1].split('.')[0])
-    )
-    if not slice_files:
-        return None, f"任务{task_id}无可用切片文件"
-    # 合并切片到最终文件
-    merged_file_path = os.path.join(SLICE_TEMP_DIR, f"{task_id}_{file_name}")
-    with open(merged_file_path, 'wb') as merged_f:
-        for slice_file in slice_files:
-            slice_path = os.path.join(task_dir, slice_file)
-            with open(slice_path, 'rb') as slice_f:
-                merged_f.write(slice_f.read())
-            os.remove(slice_path)  # 合并后删除单个切片，节省空间
-    shutil.rmtree(task_dir)  # 清理切片任务目录
-    return merged_file_path, None
+    with resp:
+        resp.raise_for_status()
+        expected = end - start + 1
+        if resp.status_code != 206:
+            raise Exception(f'服务器不支持Range请求（HTTP {resp.status_code}）')
+        content_range = resp.headers.get('Content-Range', '')
+        match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range.strip())
+        if not match or (int(match.group(1)), int(match.group(2))) != (start, end):
+            raise Exception(f'Content-Range不一致：请求{start}-{end}，返回"{content_range}"')
+        content_length = resp.headers.get('Content-Length')
+        if content_length is not None and int(content_length) != expected:
+            raise Exception(f'Content-Length不一致：应为{expected}，返回{content_length}')
+        received = 0
+        # 每个切片单独打开，各写各的范围，多个线程同时写同一个文件互不影响
+        with open(target_path, 'r+b', buffering=0) as f:
+            for chunk in bandwidth.iter_shaped(resp.iter_content(chunk_size=65536), user):
+                if not chunk:
+                    continue
+                if cancelled is not None and cancelled():
+                    raise Exception('切片任务已取消')
+                if received + len(chunk) > expected:
+                    received += len(chunk)
+                    break
+                write_at(f, chunk, start + received)
+                received += len(chunk)
+    if received != expected:
+        raise Exception(f'切片大小不一致：应为{expected}字节，收到{received}字节')
+
+# 切片下载任务：创建时预分配目标文件，服务端线程池并发下载各切片并直接写入各自的位置，
+# 客户端轮询进度，最后一个切片完成时文件即已完整，不需要合并
+slice_executor = ThreadPoolExecutor(max_workers=SLICE_MAX_WORKERS)
+slice_tasks = {}  # 任务ID -> 任务信息
+slice_pending = {}  # 任务ID -> 待下载的切片序号，按轮到的顺序排列
+slice_tasks_lock = threading.Lock()
+
+def queue_slices(task_id, indices):
+    """把任务的切片加入下载队列；线程池每次从下一个任务取一个切片，大任务不会让后来的任务一直等待"""
+    with slice_tasks_lock:
+        slice_pending.setdefault(task_id, deque()).extend(indices)
+    for _ in indices:
+        slice_executor.submit(run_next_slice)
+
+def run_next_slice():
+    with slice_tasks_lock:
+        if not slice_pending:
+            return  # 对应的任务已取消
+        task_id, queue = next(iter(slice_pending.items()))
+        index = queue.popleft()
+        # 取过切片的任务排到最后，轮到下一个任务
+        del slice_pending[task_id]
+        if queue:
+            slice_pending[task_id] = queue
+        task = slice_tasks.get(task_id)
+    if task is not None:
+        run_slice(task, index)
+
+def refresh_slice_url(task, stale_url):
+    """
+    下载链接可能已过期：重新获取，返回新链接
+    其他切片已经换过链接时直接使用，同一个任务不会因多个切片同时重试而重复获取
+    """
+    with task['url_lock']:
+        if task['url'] == stale_url:
+            pan_result = pan_api.parsing(task['remote_path'])
+            if 'error' in pan_result or not pan_result.get('url'):
+                raise Exception(f"重新获取下载链接失败：{pan_result.get('error', '没有返回链接')}")
+            if int(pan_result.get('size') or 0) != task['file_size']:
+                raise Exception('文件大小已变化，请重新创建切片任务')
+            task['url'] = pan_result['url']
+        return task['url']
+
+def run_slice(task, index):
+    """下载任务中的一个切片，失败时按退避间隔重试，每次重试前重新获取下载链接，结果记入任务信息"""
+    start, end = task['ranges'][index]
+    error = None
+    url = task['url']
+    for attempt in range(SLICE_RETRIES + 1):
+        if task['cancelled']:
+            return
+        if attempt:
+            threading.Event().wait(min(SLICE_RETRY_DELAY * 2 ** (attempt - 1), 10))
+            try:
+                url = refresh_slice_url(task, url)
+            except Exception as e:
+                error = str(e)
+                continue
+        try:
+            download_single_slice(
+                generate_unique_slice_url(url), task['path'], start, end, task['username'],
+                cancelled=lambda: task['cancelled']
+            )
+            with slice_tasks_lock:
+                task['done'].add(index)
+                task['failed'].pop(index, None)
+                task['updated'] = datetime.now().timestamp()
+            return
+        except Exception as e:
+            error = str(e)
+    with slice_tasks_lock:
+        task['failed'][index] = error
+
+def remove_slice_task(task_id):
+    """停止下载并删除任务和临时文件，返回被删除的任务"""
+    with slice_tasks_lock:
+        task = slice_tasks.pop(task_id, None)
+        slice_pending.pop(task_id, None)
+        if task is not None:
+            task['cancelled'] = True
+    if task is not None:
+        shutil.rmtree(task['dir'], ignore_errors=True)
+    return task
+
+def cleanup_slice_tasks():
+    """删除超过 SLICE_TASK_EXPIRE 秒没有动静的任务，以及不属于任何任务的临时目录（如重启前留下的）"""
+    now = datetime.now().timestamp()
+    with slice_tasks_lock:
+        expired = [task_id for task_id, task in slice_tasks.items() if now - task['updated'] > SLICE_TASK_EXPIRE]
+        known = set(slice_tasks)
+    for task_id in expired:
+        remove_slice_task(task_id)
+    if not os.path.isdir(SLICE_TEMP_DIR):
+        return
+    for name in os.listdir(SLICE_TEMP_DIR):
+        task_dir = os.path.join(SLICE_TEMP_DIR, name)
+        if name not in known and os.path.isdir(task_dir) and now - os.path.getmtime(task_dir) > SLICE_TASK_EXPIRE:
+            shutil.rmtree(task_dir, ignore_errors=True)
+
+def get_slice_task(task_id):
+    """返回当前用户的切片任务，不存在时返回None"""
+    with slice_tasks_lock:
+        task = slice_tasks.get(task_id)
+    if task is None or task['username'] != request.current_user.get('username'):
+        return None
+    task['updated'] = datetime.now().timestamp()
+    return task
+
+def slice_task_status(task_id, task):
+    with slice_tasks_lock:
+        done = len(task['done'])
+        failed = dict(task['failed'])
+    return {
+        'task_id': task_id,
+        'file_name': task['file_name'],
+        'file_size': task['file_size'],
+        'slice_size': task['slice_size'],
+        'total_slices': len(task['ranges']),
+        'done_slices': done,
+        'failed': {str(i): err for i, err in sorted(failed.items())},
+        'complete': done == len(task['ranges'])
+    }
 
 @app.route('/')
 def index():
@@ -383,6 +550,8 @@ def check_auth():
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '123pan'))
 import api as pan_api
+import bandwidth
+from http_session import get_session, CDN
 
 @app.route('/api/files', methods=['GET'])
 def list_files():
@@ -405,37 +574,28 @@ def list_files_paginated():
         page_size = int(request.args.get('page_size', 20))
         keyword = request.args.get('keyword', '')
         file_type = request.args.get('file_type', '')
+        cursor = request.args.get('cursor', '')
         
-        result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+        if page < 1 or page_size < 1:
+            return jsonify({'code': 400, 'message': 'page和page_size必须为正整数', 'data': None}), 400
+        # 每页直接对应123pan接口的一页，不超过接口单页上限
+        page_size = min(page_size, LIST_MAX_PAGE_SIZE)
+        
+        result = pan_api.list_page(path, page, page_size, keyword, file_type, cursor or None)
         
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
         
-        folders = result.get('folder', [])
-        files = result.get('file', [])
-        
-        if keyword:
-            folders = [f for f in folders if keyword.lower() in f.get('name', '').lower()]
-            files = [f for f in files if keyword.lower() in f.get('name', '').lower()]
-        
-        if file_type:
-            files = [f for f in files if f.get('name', '').lower().endswith(f'.{file_type.lower()}')]
-        
-        all_items = folders + files
-        total = len(all_items)
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated = all_items[start:end]
-        
         return jsonify({
             'code': 200,
             'message': 'success',
             'data': {
-                'total': total,
-                'page': page,
-                'page_size': page_size,
-                'folders': folders,
-                'files': files
+                'total': result['total'],
+                'page': result['page'],
+                'page_size': result['page_size'],
+                'folders': result['folder'],
+                'files': result['file'],
+                'next_cursor': result['next_cursor']
             }
         })
     except Exception as e:
@@ -457,46 +617,56 @@ def download_file():
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
-# 新增：切片下载3个核心接口（仅添加，与原有/api/download接口互不影响）
+# 切片下载接口：create 创建任务并开始在服务端并发下载，GET 查询进度，merge 返回下载好的文件（保留原接口名，已不需要合并）
 @app.route('/api/download/slice/create', methods=['POST'])
 @require_auth
 def create_slice_task():
-    """创建切片下载任务：获取唯一切片URL列表，生成任务ID"""
+    """创建切片下载任务：按文件大小和切片大小计算字节范围，交给服务端线程池用Range请求并发下载"""
     try:
         data = request.get_json()
         path = data.get('path', '')
         slice_size = int(data.get('slice_size', DEFAULT_SLICE_SIZE))  # 前端可自定义切片大小
         if not path:
             return jsonify({'code': 400, 'message': '文件路径不能为空', 'data': None}), 400
-        # 调用原版pan_api获取基础下载信息
+        if slice_size <= 0:
+            return jsonify({'code': 400, 'message': 'slice_size必须为正整数', 'data': None}), 400
         pan_result = pan_api.parsing(path)
         if 'error' in pan_result:
             return jsonify({'code': 400, 'message': pan_result['error'], 'data': None}), 400
-        file_name = pan_result.get('fileName', 'unknown_file')
-        file_size = int(pan_result.get('fileSize', 0))
-        download_base_url = pan_result.get('downloadUrl', '')
+        file_name = pan_result.get('name', 'unknown_file')
+        file_size = int(pan_result.get('size') or 0)
+        download_base_url = pan_result.get('url', '')
         if not download_base_url or file_size <= 0:
             return jsonify({'code': 400, 'message': '获取基础下载链接失败', 'data': None}), 400
-        # 计算切片数量
-        total_slices = math.ceil(file_size / slice_size)
-        # 生成唯一任务ID
+        cleanup_slice_tasks()
         task_id = str(uuid.uuid4())
-        # 创建当前任务的切片存储目录
         task_dir = os.path.join(SLICE_TEMP_DIR, task_id)
         os.makedirs(task_dir, exist_ok=True)
-        # 为每个切片生成唯一下载URL
-        slice_urls = [generate_unique_slice_url(download_base_url) for _ in range(total_slices)]
+        target_path = os.path.join(task_dir, 'data')
+        preallocate_file(target_path, file_size)
+        task = {
+            'username': request.current_user.get('username'),
+            'remote_path': path,
+            'url': download_base_url,
+            'url_lock': threading.Lock(),
+            'dir': task_dir,
+            'path': target_path,
+            'file_name': file_name,
+            'file_size': file_size,
+            'slice_size': slice_size,
+            'ranges': slice_ranges(file_size, slice_size),
+            'done': set(),
+            'failed': {},
+            'cancelled': False,
+            'updated': datetime.now().timestamp()
+        }
+        with slice_tasks_lock:
+            slice_tasks[task_id] = task
+        queue_slices(task_id, range(len(task['ranges'])))
         return jsonify({
             'code': 200,
             'message': '切片任务创建成功',
-            'data': {
-                'task_id': task_id,
-                'file_name': file_name,
-                'file_size': file_size,
-                'slice_size': slice_size,
-                'total_slices': total_slices,
-                'slice_urls': slice_urls
-            }
+            'data': slice_task_status(task_id, task)
         })
     except Exception as e:
         return jsonify({'code': 500, 'message': f'创建切片任务失败：{str(e)}', 'data': None}), 500
@@ -504,67 +674,123 @@ def create_slice_task():
 @app.route('/api/download/slice', methods=['GET'])
 @require_auth
 def download_slice():
-    """下载单个切片：独立请求，不同URL=不同下载识别"""
+    """查询切片任务进度；带 retry=1 时重新下载失败的切片"""
     try:
         task_id = request.args.get('task_id', '')
-        slice_idx = request.args.get('slice_idx', '')
-        slice_url = request.args.get('slice_url', '')
-        if not task_id or not slice_idx or not slice_url:
-            return jsonify({'code': 400, 'message': 'task_id/slice_idx/slice_url不能为空', 'data': None}), 400
-        try:
-            slice_idx = int(slice_idx)
-            if slice_idx < 0:
-                raise ValueError
-        except ValueError:
-            return jsonify({'code': 400, 'message': 'slice_idx必须为非负整数', 'data': None}), 400
-        # 切片保存路径
-        task_dir = os.path.join(SLICE_TEMP_DIR, task_id)
-        os.makedirs(task_dir, exist_ok=True)
-        slice_save_path = os.path.join(task_dir, f'slice_{slice_idx}.part')
-        # 下载单个切片（独立请求，确保123pan识别为不同下载）
-        download_single_slice(slice_url, slice_save_path)
-        return jsonify({
-            'code': 200,
-            'message': f'切片{slice_idx}下载成功',
-            'data': {'task_id': task_id, 'slice_idx': slice_idx}
-        })
+        if not task_id:
+            return jsonify({'code': 400, 'message': 'task_id不能为空', 'data': None}), 400
+        task = get_slice_task(task_id)
+        if task is None:
+            return jsonify({'code': 404, 'message': '切片任务不存在', 'data': None}), 404
+        if request.args.get('retry') == '1':
+            with slice_tasks_lock:
+                failed = sorted(task['failed'])
+                task['failed'].clear()
+            queue_slices(task_id, failed)
+        return jsonify({'code': 200, 'message': 'success', 'data': slice_task_status(task_id, task)})
     except Exception as e:
-        return jsonify({'code': 500, 'message': f'下载切片失败：{str(e)}', 'data': None}), 500
+        return jsonify({'code': 500, 'message': f'查询切片任务失败：{str(e)}', 'data': None}), 500
 
 @app.route('/api/download/slice/merge', methods=['POST'])
 @require_auth
 def merge_slice_download():
-    """合并所有切片并返回下载文件，自动清理临时文件"""
+    """所有切片下载完成后返回下载好的文件（切片已直接写入目标文件，无需合并），发送完后清理临时文件"""
     try:
         data = request.get_json()
         task_id = data.get('task_id', '')
-        file_name = data.get('file_name', '')
-        if not task_id or not file_name:
-            return jsonify({'code': 400, 'message': 'task_id/file_name不能为空', 'data': None}), 400
-        # 合并切片
-        merged_file, err = merge_slices(task_id, file_name)
-        if err:
-            return jsonify({'code': 400, 'message': err, 'data': None}), 400
-        if not os.path.exists(merged_file):
-            return jsonify({'code': 400, 'message': '合并后文件不存在', 'data': None}), 400
-        # 返回合并后的文件供下载，下载完成后自动删除
+        if not task_id:
+            return jsonify({'code': 400, 'message': 'task_id不能为空', 'data': None}), 400
+        task = get_slice_task(task_id)
+        if task is None:
+            return jsonify({'code': 404, 'message': '切片任务不存在', 'data': None}), 404
+        status = slice_task_status(task_id, task)
+        if not status['complete']:
+            return jsonify({'code': 409, 'message': '切片尚未全部下载完成', 'data': status}), 409
+        with slice_tasks_lock:
+            slice_tasks.pop(task_id, None)
+            slice_pending.pop(task_id, None)
         response = send_file(
-            merged_file,
+            task['path'],
             as_attachment=True,
-            download_name=file_name,
+            download_name=os.path.basename(task['file_name']),
             mimetype='application/octet-stream'
         )
+        # send_file的响应默认直接交给服务器发送，不会调用close，关掉后发送完才会触发清理
+        response.direct_passthrough = False
         @response.call_on_close
-        def cleanup_merged_file():
-            if os.path.exists(merged_file):
-                os.remove(merged_file)
+        def cleanup_slice_task():
+            shutil.rmtree(task['dir'], ignore_errors=True)
         return response
     except Exception as e:
-        return jsonify({'code': 500, 'message': f'合并切片失败：{str(e)}', 'data': None}), 500
+        return jsonify({'code': 500, 'message': f'获取下载文件失败：{str(e)}', 'data': None}), 500
+
+@app.route('/api/download/slice/cancel', methods=['POST'])
+@require_auth
+def cancel_slice_task():
+    """取消切片任务：停止下载未完成的切片，删除任务和临时文件"""
+    try:
+        data = request.get_json() or {}
+        task_id = data.get('task_id', '')
+        if not task_id:
+            return jsonify({'code': 400, 'message': 'task_id不能为空', 'data': None}), 400
+        if get_slice_task(task_id) is None:
+            return jsonify({'code': 404, 'message': '切片任务不存在', 'data': None}), 404
+        remove_slice_task(task_id)
+        return jsonify({'code': 200, 'message': '切片任务已取消', 'data': None})
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'取消切片任务失败：{str(e)}', 'data': None}), 500
+
+class UploadSpool:
+    """
+    /api/upload 的文件内容：Werkzeug解析表单时直接写入具名临时文件，同时计算MD5（123pan的etag），
+    解析完后从这个文件上传，不需要再复制一遍
+    """
+    
+    def __init__(self, suffix=''):
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self.name = self._file.name
+        self._md5 = hashlib.md5()
+    
+    def write(self, data):
+        self._md5.update(data)
+        return self._file.write(data)
+    
+    def md5(self):
+        return self._md5.hexdigest()
+    
+    def discard(self):
+        self._file.close()
+        try:
+            os.unlink(self.name)
+        except OSError:
+            pass
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class SpoolingRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'upload_file':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spool = UploadSpool(os.path.splitext(filename or '')[1])
+        # 记下所有临时文件，没有交给后台上传的在请求结束前删除
+        self.__dict__.setdefault('upload_spools', []).append(spool)
+        return spool
+
+app.request_class = SpoolingRequest
+
+def get_upload_workers():
+    # 每个文件同时上传的分块数，取 config.json 中的 upload.max_concurrent
+    upload_config = load_config().get('upload') or {}
+    try:
+        return max(1, int(upload_config.get('max_concurrent', 3)))
+    except (TypeError, ValueError):
+        return 3
 
 @app.route('/api/upload', methods=['POST'])
 @require_auth
 def upload_file():
+    submitted = None
     try:
         if 'file' not in request.files:
             return jsonify({'code': 400, 'message': '没有上传文件', 'data': None}), 400
@@ -575,16 +801,56 @@ def upload_file():
         if file.filename == '':
             return jsonify({'code': 400, 'message': '文件名为空', 'data': None}), 400
         
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
+        # 文件内容和MD5在解析表单时已经得到；上传到网盘在后台进行，立即返回任务ID，结束后删除临时文件
+        spool = file.stream
+        spool.close()
+        result = pan_api.upload_async(
+            spool.name, remote_path, file.filename,
+            upload_workers=get_upload_workers(), etag=spool.md5(),
+            on_done=lambda _: spool.discard(), user=request.current_user.get('username')
+        )
+        submitted = spool
         
-        try:
-            result = pan_api.upload(tmp_path, remote_path, file.filename)
-        finally:
-            os.unlink(tmp_path)
+        return jsonify({'code': 202, 'message': '上传任务已提交', 'data': result}), 202
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+    finally:
+        for leftover in request.__dict__.get('upload_spools', []):
+            if leftover is not submitted:
+                leftover.discard()
+
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_upload_job(job_id):
+    # status 为 uploading（上传分块）、completing（等待123pan完成）、success 或 failed
+    result = pan_api.upload_job(job_id)
+    if 'error' in result:
+        return jsonify({'code': 404, 'message': result['error'], 'data': None}), 404
+    return jsonify({'code': 200, 'message': 'success', 'data': result})
+
+@app.route('/api/upload/stream', methods=['PUT'])
+@require_auth
+def upload_file_stream():
+    # 请求体就是文件内容，边接收边上传到123pan，不落盘
+    # 123pan需要事先知道MD5和大小：X-File-Md5 请求头 + Content-Length，文件名放在 X-File-Name（URL编码）
+    try:
+        from urllib.parse import unquote
+        file_name = unquote(request.headers.get('X-File-Name', ''))
+        etag = request.headers.get('X-File-Md5', '').lower()
+        size = request.content_length
+        remote_path = request.args.get('path', '/')
+        
+        if not file_name:
+            return jsonify({'code': 400, 'message': '文件名为空', 'data': None}), 400
+        if not re.fullmatch(r'[0-9a-f]{32}', etag):
+            return jsonify({'code': 400, 'message': 'X-File-Md5 格式不正确', 'data': None}), 400
+        if size is None:
+            return jsonify({'code': 411, 'message': '需要 Content-Length', 'data': None}), 411
         
+        result = pan_api.upload_stream(
+            request.stream, remote_path, file_name, size, etag,
+            upload_workers=get_upload_workers(), user=request.current_user.get('username')
+        )
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
         
@@ -592,6 +858,186 @@ def upload_file():
     except Exception as e:
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
+# 分块上传：浏览器把文件切成 upload.chunk_size 大小的分块并发上传，服务端写入预分配的临时文件，
+# 每收到一块写一个标记文件；刷新页面后用同一指纹重新init即可拿到已收到的分块，只补传缺少的
+def chunk_upload_id(username, path, name, size, fingerprint):
+    raw = '\n'.join([username or '', path, name, str(size), fingerprint])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def chunk_upload_dir(upload_id):
+    if not re.fullmatch(r'[0-9a-f]{40}', upload_id or ''):
+        return None
+    return os.path.join(CHUNK_UPLOAD_DIR, upload_id)
+
+def load_chunk_upload(upload_id):
+    # 返回 (任务目录, 任务信息)，任务不存在或不属于当前用户时返回 (None, None)
+    task_dir = chunk_upload_dir(upload_id)
+    if task_dir is None:
+        return None, None
+    try:
+        with open(os.path.join(task_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if meta.get('username') != request.current_user.get('username'):
+        return None, None
+    return task_dir, meta
+
+def received_chunks(task_dir, total_chunks):
+    return [i for i in range(total_chunks) if os.path.exists(os.path.join(task_dir, f'chunk_{i}.done'))]
+
+def cleanup_chunk_uploads():
+    if not os.path.isdir(CHUNK_UPLOAD_DIR):
+        return
+    now = datetime.now().timestamp()
+    for name in os.listdir(CHUNK_UPLOAD_DIR):
+        task_dir = os.path.join(CHUNK_UPLOAD_DIR, name)
+        if os.path.isdir(task_dir) and now - os.path.getmtime(task_dir) > CHUNK_UPLOAD_EXPIRE:
+            shutil.rmtree(task_dir, ignore_errors=True)
+
+def chunk_upload_status(upload_id, task_dir, meta):
+    return {
+        'upload_id': upload_id,
+        'name': meta['name'],
+        'size': meta['size'],
+        'path': meta['path'],
+        'chunk_size': meta['chunk_size'],
+        'total_chunks': meta['total_chunks'],
+        'received': received_chunks(task_dir, meta['total_chunks'])
+    }
+
+@app.route('/api/upload/chunked/init', methods=['POST'])
+@require_auth
+def init_chunked_upload():
+    try:
+        data = request.get_json() or {}
+        name = data.get('name', '')
+        path = data.get('path', '/')
+        fingerprint = str(data.get('fingerprint', ''))
+        try:
+            size = int(data.get('size', -1))
+        except (TypeError, ValueError):
+            size = -1
+        if not name:
+            return jsonify({'code': 400, 'message': '文件名为空', 'data': None}), 400
+        if size < 0:
+            return jsonify({'code': 400, 'message': '文件大小不正确', 'data': None}), 400
+        upload_config = load_config().get('upload') or {}
+        if size > upload_config.get('max_file_size', size):
+            return jsonify({'code': 400, 'message': '文件超过大小限制', 'data': None}), 400
+        
+        upload_id = chunk_upload_id(request.current_user.get('username'), path, name, size, fingerprint)
+        task_dir = chunk_upload_dir(upload_id)
+        meta_path = os.path.join(task_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            cleanup_chunk_uploads()
+            chunk_size = max(1, int(upload_config.get('chunk_size', 1048576)))
+            os.makedirs(task_dir, exist_ok=True)
+            # 预分配临时文件，各分块按偏移写入，完成时无需合并
+            with open(os.path.join(task_dir, 'data'), 'wb') as f:
+                f.truncate(size)
+            meta = {
+                'username': request.current_user.get('username'),
+                'name': name,
+                'size': size,
+                'path': path,
+                'chunk_size': chunk_size,
+                'total_chunks': max(1, math.ceil(size / chunk_size))
+            }
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        
+        task_dir, meta = load_chunk_upload(upload_id)
+        if meta is None:
+            return jsonify({'code': 404, 'message': '上传任务不存在', 'data': None}), 404
+        return jsonify({'code': 200, 'message': 'success', 'data': chunk_upload_status(upload_id, task_dir, meta)})
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/upload/chunked/<upload_id>', methods=['GET'])
+@require_auth
+def get_chunked_upload(upload_id):
+    task_dir, meta = load_chunk_upload(upload_id)
+    if meta is None:
+        return jsonify({'code': 404, 'message': '上传任务不存在', 'data': None}), 404
+    return jsonify({'code': 200, 'message': 'success', 'data': chunk_upload_status(upload_id, task_dir, meta)})
+
+@app.route('/api/upload/chunked/<upload_id>/<int:index>', methods=['PUT'])
+@require_auth
+def upload_chunk(upload_id, index):
+    # 请求体为分块内容；可带 X-Chunk-Md5 校验，不一致时返回400，由浏览器重传这一块
+    try:
+        task_dir, meta = load_chunk_upload(upload_id)
+        if meta is None:
+            return jsonify({'code': 404, 'message': '上传任务不存在', 'data': None}), 404
+        if index >= meta['total_chunks']:
+            return jsonify({'code': 400, 'message': '分块序号超出范围', 'data': None}), 400
+        # 已提交上传后临时文件正在被读取，不能再改动
+        if meta.get('job_id'):
+            return jsonify({'code': 409, 'message': '上传任务已提交，不能再上传分块', 'data': {'job_id': meta['job_id']}}), 409
+        offset = index * meta['chunk_size']
+        expected = min(meta['chunk_size'], meta['size'] - offset)
+        # 先按Content-Length检查，大小不对的请求体不读入内存
+        if request.content_length != expected:
+            return jsonify({'code': 400, 'message': f'分块大小应为{expected}字节', 'data': None}), 400
+        data = request.get_data(cache=False)
+        if len(data) != expected:
+            return jsonify({'code': 400, 'message': f'分块大小应为{expected}字节', 'data': None}), 400
+        chunk_md5 = request.headers.get('X-Chunk-Md5', '').lower()
+        if chunk_md5 and hashlib.md5(data).hexdigest() != chunk_md5:
+            return jsonify({'code': 400, 'message': '分块MD5校验失败', 'data': None}), 400
+        with open(os.path.join(task_dir, 'data'), 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+        # 写完内容后再写标记，标记存在即表示这一块已完整收到
+        open(os.path.join(task_dir, f'chunk_{index}.done'), 'w').close()
+        return jsonify({'code': 200, 'message': 'success', 'data': {'index': index}})
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/upload/chunked/<upload_id>/complete', methods=['POST'])
+@require_auth
+def complete_chunked_upload(upload_id):
+    try:
+        task_dir, meta = load_chunk_upload(upload_id)
+        if meta is None:
+            return jsonify({'code': 404, 'message': '上传任务不存在', 'data': None}), 404
+        received = received_chunks(task_dir, meta['total_chunks'])
+        if len(received) != meta['total_chunks']:
+            missing = sorted(set(range(meta['total_chunks'])) - set(received))
+            return jsonify({'code': 400, 'message': '还有分块未上传', 'data': {'missing': missing}}), 400
+        
+        # 计算MD5和上传到网盘都在后台进行，成功后删除临时文件，失败时保留以便重新提交
+        def on_done(result):
+            if 'error' not in result:
+                with chunk_upload_lock:
+                    shutil.rmtree(task_dir, ignore_errors=True)
+        
+        # 检查任务ID、提交上传、记下任务ID都在锁内进行：同时到达的complete请求只有一个会提交，
+        # 记下任务ID后才允许删除任务目录
+        with chunk_upload_lock:
+            task_dir, meta = load_chunk_upload(upload_id)
+            if meta is None:
+                return jsonify({'code': 404, 'message': '上传任务不存在', 'data': None}), 404
+            # 已提交且未结束的任务直接返回，避免重复上传
+            job_id = meta.get('job_id')
+            if job_id:
+                job = pan_api.upload_job(job_id)
+                if 'error' not in job and job['status'] in ('uploading', 'completing'):
+                    return jsonify({'code': 202, 'message': '上传任务已提交', 'data': {'status': job['status'], 'job_id': job_id}}), 202
+            result = pan_api.upload_async(
+                os.path.join(task_dir, 'data'), meta['path'], meta['name'],
+                upload_workers=get_upload_workers(), on_done=on_done,
+                user=request.current_user.get('username')
+            )
+            if os.path.isdir(task_dir):
+                meta['job_id'] = result['job_id']
+                with open(os.path.join(task_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False)
+        return jsonify({'code': 202, 'message': '上传任务已提交', 'data': result}), 202
+    except Exception as e:
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
 @app.route('/api/folder', methods=['POST'])
 @require_auth
 def create_folder():
@@ -653,17 +1099,19 @@ def search_files():
     try:
         keyword = request.args.get('keyword', '')
         path = request.args.get('path', '/')
+        limit = request.args.get('limit', '')
         
         if not keyword:
             return jsonify({'code': 400, 'message': '搜索关键词不能为空', 'data': None}), 400
         
-        result = pan_api.list_folder(path) if path != '/' else pan_api.list()
+        # 指定limit时逐页搜索，找够结果即返回，不再列出整个目录
+        result = pan_api.search(keyword, path, int(limit) if limit else None)
         
         if 'error' in result:
             return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
         
-        folders = [f for f in result.get('folder', []) if keyword.lower() in f.get('name', '').lower()]
-        files = [f for f in result.get('file', []) if keyword.lower() in f.get('name', '').lower()]
+        folders = result.get('folder', [])
+        files = result.get('file', [])
         
         return jsonify({
             'code': 200,
@@ -671,7 +1119,8 @@ def search_files():
             'data': {
                 'folders': folders,
                 'files': files,
-                'total': len(folders) + len(files)
+                'total': len(folders) + len(files),
+                'complete': result.get('complete', True)
             }
         })
     except Exception as e:
@@ -736,6 +1185,19 @@ def get_logs():
 @require_auth
 def get_stats():
     try:
+        # recursive=1 时统计整个目录树（包括总大小），否则只统计主目录这一层
+        if request.args.get('recursive', '') in ('1', 'true'):
+            path = request.args.get('path', '/')
+            max_depth = request.args.get('max_depth', '')
+            result = pan_api.tree_stats(
+                path,
+                max_depth=int(max_depth) if max_depth else None,
+                max_entries=STATS_MAX_ENTRIES
+            )
+            if 'error' in result:
+                return jsonify({'code': 400, 'message': result['error'], 'data': None}), 400
+            return jsonify({'code': 200, 'message': 'success', 'data': result})
+        
         result = pan_api.list()
         
         if 'error' in result:
@@ -756,5 +1218,5 @@ def get_stats():
         return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8000)
+    app.run(debug=True, host='0.0.0.0', port=8000, threaded=True)
     
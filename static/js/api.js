@@ -123,9 +123,11 @@ const API = {
         return this.get('/auth/check');
     },
     
-    async listFiles(path = '/') {
-        const params = new URLSearchParams({ path });
-        return this.get(`/files?${params}`);
+    async listFilesPage(path = '/', page = 1, pageSize = 20, cursor = null) {
+        const params = cursor
+            ? new URLSearchParams({ cursor })
+            : new URLSearchParams({ path, page, page_size: pageSize });
+        return this.get(`/list?${params}`);
     },
     
     async uploadFile(formData, onProgress) {
@@ -143,11 +145,14 @@ const API = {
             };
             
             xhr.onload = () => {
+                let result;
                 try {
-                    resolve(JSON.parse(xhr.responseText));
+                    result = JSON.parse(xhr.responseText);
                 } catch {
                     resolve({ code: 500, message: '上传失败' });
+                    return;
                 }
+                resolve(result.code === 202 ? this.waitUploadJob(result.data.job_id) : result);
             };
             
             xhr.onerror = () => reject(new Error('上传失败'));
@@ -155,6 +160,114 @@ const API = {
         });
     },
     
+    async initChunkedUpload(file, path) {
+        return this.post('/upload/chunked/init', {
+            name: file.name,
+            size: file.size,
+            path,
+            // 同一文件刷新页面后指纹不变，服务端据此找回已收到的分块
+            fingerprint: `${file.name}:${file.size}:${file.lastModified}`
+        });
+    },
+    
+    async getChunkedUploadStatus(uploadId) {
+        return this.get(`/upload/chunked/${uploadId}`);
+    },
+    
+    async uploadChunk(uploadId, index, blob) {
+        const headers = { 'Content-Type': 'application/octet-stream' };
+        if (this.token) {
+            headers['Authorization'] = `Bearer ${this.token}`;
+        }
+        try {
+            const response = await fetch(`${this.baseUrl}/upload/chunked/${uploadId}/${index}`, {
+                method: 'PUT',
+                headers,
+                body: blob
+            });
+            return await response.json();
+        } catch (error) {
+            return { code: 500, message: '网络错误', data: null };
+        }
+    },
+    
+    async completeChunkedUpload(uploadId) {
+        return this.post(`/upload/chunked/${uploadId}/complete`);
+    },
+    
+    async getUploadJob(jobId) {
+        return this.get(`/upload/jobs/${jobId}`);
+    },
+    
+    // 上传到网盘在服务端后台进行，按退避间隔查询任务直到结束，返回与同步上传相同格式的结果
+    async waitUploadJob(jobId, { maxDelay = 10000 } = {}) {
+        let delay = 1000;
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, delay));
+            const job = await this.getUploadJob(jobId);
+            if (job.code !== 200) {
+                return job;
+            }
+            const { status, result } = job.data;
+            if (status === 'success') {
+                return { code: 200, message: '上传成功', data: result };
+            }
+            if (status === 'failed') {
+                return { code: 400, message: result?.error || '上传失败', data: null };
+            }
+            delay = Math.min(delay * 2, maxDelay);
+        }
+    },
+    
+    // 分块上传：并发上传缺少的分块，单块失败重试，全部收到后通知服务端上传到网盘
+    async uploadFileChunked(file, path, { concurrency = 3, retries = 3, onProgress } = {}) {
+        const init = await this.initChunkedUpload(file, path);
+        if (init.code !== 200) {
+            return init;
+        }
+        const { upload_id: uploadId, chunk_size: chunkSize, total_chunks: totalChunks, received } = init.data;
+        const done = new Set(received);
+        const pending = [];
+        for (let i = 0; i < totalChunks; i++) {
+            if (!done.has(i)) {
+                pending.push(i);
+            }
+        }
+        const report = () => onProgress && onProgress(Math.round((done.size / totalChunks) * 100));
+        report();
+        
+        let failed = null;
+        const worker = async () => {
+            while (pending.length && !failed) {
+                const index = pending.shift();
+                const blob = file.slice(index * chunkSize, Math.min((index + 1) * chunkSize, file.size));
+                let result = null;
+                for (let attempt = 0; attempt <= retries; attempt++) {
+                    result = await this.uploadChunk(uploadId, index, blob);
+                    if (result.code === 200) {
+                        break;
+                    }
+                    await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+                }
+                if (result.code !== 200) {
+                    failed = result;
+                    return;
+                }
+                done.add(index);
+                report();
+            }
+        };
+        await Promise.all(Array.from({ length: Math.max(1, concurrency) }, worker));
+        if (failed) {
+            return failed;
+        }
+        const result = await this.completeChunkedUpload(uploadId);
+        if (result.code === 202) {
+            return this.waitUploadJob(result.data.job_id);
+        }
+        return result;
+    },
+    
     async downloadFile(path) {
         return this.get(`/download?path=${encodeURIComponent(path)}`);
     },
@@ -171,8 +284,9 @@ const API = {
         return this.post('/share', { path });
     },
     
-    async searchFiles(keyword, path = '/') {
-        return this.get(`/search?keyword=${encodeURIComponent(keyword)}&path=${encodeURIComponent(path)}`);
+    async searchFiles(keyword, path = '/', limit = null) {
+        const limitParam = limit ? `&limit=${limit}` : '';
+        return this.get(`/search?keyword=${encodeURIComponent(keyword)}&path=${encodeURIComponent(path)}${limitParam}`);
     },
     
     async getLogs(page = 1, pageSize = 20) {
@@ -50,6 +50,8 @@ async function checkAuth() {
     }
 }
 
+const FILE_PAGE_SIZE = 100;
+
 async function loadFiles(path) {
     const fileManager = document.getElementById('fileManager');
     const loading = document.getElementById('loading');
@@ -57,21 +59,25 @@ async function loadFiles(path) {
     
     loading.style.display = 'flex';
     fileGrid.innerHTML = '';
+    document.getElementById('loadMoreBtn')?.remove();
     
     const cached = State.getCachedFiles(path);
     if (cached) {
         renderFiles(cached);
+        updateLoadMore(path, cached);
         loading.style.display = 'none';
         return;
     }
     
-    const result = await API.listFiles(path);
+    // 只取第一页，大文件夹不用等整个目录列完；后续页点击“加载更多”按游标获取
+    const result = await API.listFilesPage(path, 1, FILE_PAGE_SIZE);
     
     loading.style.display = 'none';
     
     if (result.code === 200 && result.data) {
         State.cacheFiles(path, result.data);
         renderFiles(result.data);
+        updateLoadMore(path, result.data);
         updateBreadcrumb(path);
     } else {
         showEmptyState();
@@ -79,9 +85,50 @@ async function loadFiles(path) {
     }
 }
 
+async function loadMoreFiles(path, data) {
+    const result = await API.listFilesPage(path, 1, FILE_PAGE_SIZE, data.next_cursor);
+    if (path !== State.currentPath) return;
+    
+    if (result.code === 200 && result.data) {
+        const merged = {
+            ...result.data,
+            folders: data.folders.concat(result.data.folders),
+            files: data.files.concat(result.data.files)
+        };
+        State.cacheFiles(path, merged);
+        appendFiles(result.data);
+        updateLoadMore(path, merged);
+    } else {
+        updateLoadMore(path, data);
+        Utils.showToast(result.message || '加载失败', 'error');
+    }
+}
+
+function updateLoadMore(path, data) {
+    let button = document.getElementById('loadMoreBtn');
+    if (!data.next_cursor) {
+        button?.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadMoreBtn';
+        button.className = 'btn btn-secondary load-more';
+        document.getElementById('fileManager').appendChild(button);
+    }
+    button.textContent = '加载更多';
+    button.disabled = false;
+    button.onclick = () => {
+        button.disabled = true;
+        button.textContent = '加载中...';
+        loadMoreFiles(path, data);
+    };
+}
+
 function renderFiles(data) {
     const fileGrid = document.getElementById('fileGrid');
     fileGrid.innerHTML = '';
+    document.getElementById('loadMoreBtn')?.remove();
     
     const folders = data.folders || data.folder || [];
     const files = data.files || data.file || [];
@@ -91,6 +138,14 @@ function renderFiles(data) {
         return;
     }
     
+    appendFiles(data);
+}
+
+function appendFiles(data) {
+    const fileGrid = document.getElementById('fileGrid');
+    const folders = data.folders || data.folder || [];
+    const files = data.files || data.file || [];
+    
     folders.forEach(folder => {
         const item = createFileItem(folder, true);
         fileGrid.appendChild(item);
@@ -411,6 +466,8 @@ function setupEventListeners() {
 
 async function handleFileUpload(files) {
     const uploadList = document.getElementById('uploadList');
+    const uploadConfig = await API.getConfigSection('upload');
+    const concurrency = (uploadConfig.code === 200 && uploadConfig.data?.max_concurrent) || 3;
     
     for (const file of files) {
         const item = document.createElement('div');
@@ -424,13 +481,12 @@ async function handleFileUpload(files) {
         `;
         uploadList.appendChild(item);
         
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('path', State.currentPath);
-        
         try {
-            const result = await API.uploadFile(formData, (progress) => {
-                item.querySelector('.progress-bar').style.width = `${progress}%`;
+            const result = await API.uploadFileChunked(file, State.currentPath, {
+                concurrency,
+                onProgress: (progress) => {
+                    item.querySelector('.progress-bar').style.width = `${progress}%`;
+                }
             });
             
             if (result.code === 200 || result.success) {
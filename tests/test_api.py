@@ -91,5 +91,432 @@ class TestFileAPI(unittest.TestCase):
         response = self.client.get('/api/search')
         self.assertEqual(response.status_code, 400)
 
+class TestUploadAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.app_module = app_module
+        cls.client = app_module.app.test_client()
+        cls.headers = {'Authorization': f"Bearer {app_module.generate_token('tester')}"}
+    
+    def _post(self, data, fake_upload_async):
+        from unittest import mock
+        with mock.patch.object(self.app_module.pan_api, 'upload_async', fake_upload_async):
+            return self.client.post('/api/upload', headers=self.headers, data=data,
+                                    content_type='multipart/form-data')
+    
+    def test_md5_computed_while_form_parsed(self):
+        import hashlib
+        import io
+        content = os.urandom(3 * 1024 * 1024 + 123)
+        calls = []
+        
+        def fake_upload_async(local_path, remote_path='/', file_name=None, upload_workers=None, etag=None,
+                              on_done=None, user=None):
+            with open(local_path, 'rb') as f:
+                calls.append((local_path, f.read(), remote_path, file_name, etag))
+            self.on_done = on_done
+            return {'status': 'uploading', 'job_id': '1'}
+        
+        response = self._post({'file': (io.BytesIO(content), 'a.bin'), 'path': '/docs'}, fake_upload_async)
+        self.assertEqual(response.status_code, 202)
+        local_path, uploaded, remote_path, file_name, etag = calls[0]
+        self.assertEqual((uploaded, remote_path, file_name), (content, '/docs', 'a.bin'))
+        self.assertEqual(etag, hashlib.md5(content).hexdigest())
+        self.assertTrue(local_path.endswith('.bin'))
+        self.assertTrue(os.path.exists(local_path))
+        self.on_done({'status': 'success'})
+        self.assertFalse(os.path.exists(local_path))
+    
+    def test_spooled_file_removed_when_not_uploaded(self):
+        import io
+        spools = []
+        
+        def failing_upload_async(local_path, *args, **kwargs):
+            spools.append(local_path)
+            raise Exception('boom')
+        
+        response = self._post({'file': (io.BytesIO(b'data'), 'a.bin')}, failing_upload_async)
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(os.path.exists(spools[0]))
+        
+        from unittest import mock
+        created = []
+        real = self.app_module.UploadSpool
+        with mock.patch.object(self.app_module, 'UploadSpool', lambda *a: created.append(real(*a)) or created[-1]):
+            response = self._post({'other': (io.BytesIO(b'data'), 'a.bin')}, failing_upload_async)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(created), 1)
+        self.assertFalse(os.path.exists(created[0].name))
+
+class TestChunkedUploadAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.app_module = app_module
+        cls.upload_dir = app_module.CHUNK_UPLOAD_DIR
+        cls.client = app_module.app.test_client()
+        token = app_module.generate_token('tester')
+        cls.headers = {'Authorization': f'Bearer {token}'}
+    
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        self.dir = tempfile.mkdtemp()
+        self.config = self.app_module.load_config()
+        self.patches = [
+            mock.patch.object(self.app_module, 'CHUNK_UPLOAD_DIR', self.dir),
+            mock.patch.object(self.app_module, 'load_config', lambda: dict(
+                self.config, upload={'chunk_size': 4, 'max_concurrent': 2, 'max_file_size': 1024}
+            )),
+            mock.patch.object(self.app_module.pan_api, 'upload_async', self._fake_upload_async),
+            mock.patch.object(self.app_module.pan_api, 'upload_job', self._fake_upload_job),
+        ]
+        for p in self.patches:
+            p.start()
+        self.uploaded = []
+        self.jobs = {}
+        self.finish_jobs = True
+    
+    def tearDown(self):
+        import shutil
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+    
+    def _fake_upload_async(self, local_path, remote_path='/', file_name=None, upload_workers=None, etag=None,
+                           on_done=None, user=None):
+        with open(local_path, 'rb') as f:
+            self.uploaded.append((f.read(), remote_path, file_name, user))
+        job_id = str(len(self.jobs) + 1)
+        if self.finish_jobs:
+            result = {'status': 'success', 'file_id': '1'}
+            on_done(result)
+            self.jobs[job_id] = {'job_id': job_id, 'status': 'success', 'result': result, 'attempts': 1}
+        else:
+            self.jobs[job_id] = {'job_id': job_id, 'status': 'completing', 'result': None, 'attempts': 0}
+        return {'status': 'uploading', 'job_id': job_id}
+    
+    def _fake_upload_job(self, job_id):
+        return self.jobs.get(job_id, {'error': '上传任务不存在'})
+    
+    def _init(self, content=b'hello world', fingerprint='fp'):
+        response = self.client.post('/api/upload/chunked/init', headers=self.headers, json={
+            'name': 'a.txt', 'size': len(content), 'path': '/docs', 'fingerprint': fingerprint
+        })
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['data']
+    
+    def _put(self, upload_id, index, data):
+        return self.client.put(f'/api/upload/chunked/{upload_id}/{index}', headers=self.headers, data=data)
+    
+    def test_chunks_out_of_order_then_complete(self):
+        content = b'hello world'
+        info = self._init(content)
+        self.assertEqual(info['total_chunks'], 3)
+        self.assertEqual(info['received'], [])
+        for index in (2, 0, 1):
+            self.assertEqual(self._put(info['upload_id'], index, content[index * 4:index * 4 + 4]).status_code, 200)
+        response = self.client.post(f"/api/upload/chunked/{info['upload_id']}/complete", headers=self.headers)
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.data)['data']['job_id']
+        self.assertEqual(self.uploaded, [(content, '/docs', 'a.txt', 'tester')])
+        self.assertFalse(os.path.exists(os.path.join(self.dir, info['upload_id'])))
+        response = self.client.get(f'/api/upload/jobs/{job_id}', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['data']['status'], 'success')
+        self.assertEqual(self.client.get('/api/upload/jobs/404', headers=self.headers).status_code, 404)
+    
+    def test_complete_while_job_running_reuses_job(self):
+        content = b'hello world'
+        info = self._init(content)
+        for index in range(3):
+            self._put(info['upload_id'], index, content[index * 4:index * 4 + 4])
+        self.finish_jobs = False
+        url = f"/api/upload/chunked/{info['upload_id']}/complete"
+        first = json.loads(self.client.post(url, headers=self.headers).data)['data']['job_id']
+        second = json.loads(self.client.post(url, headers=self.headers).data)['data']['job_id']
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.uploaded), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, info['upload_id'])))
+    
+    def test_chunk_rejected_after_complete(self):
+        content = b'hello world'
+        info = self._init(content)
+        for index in range(3):
+            self._put(info['upload_id'], index, content[index * 4:index * 4 + 4])
+        self.finish_jobs = False
+        response = self.client.post(f"/api/upload/chunked/{info['upload_id']}/complete", headers=self.headers)
+        job_id = json.loads(response.data)['data']['job_id']
+        response = self._put(info['upload_id'], 1, b'XXXX')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['data']['job_id'], job_id)
+        with open(os.path.join(self.dir, info['upload_id'], 'data'), 'rb') as f:
+            self.assertEqual(f.read(), content)
+    
+    def test_concurrent_completes_submit_once(self):
+        import threading
+        import time
+        content = b'hello world'
+        info = self._init(content)
+        for index in range(3):
+            self._put(info['upload_id'], index, content[index * 4:index * 4 + 4])
+        self.finish_jobs = False
+        fake = self._fake_upload_async
+        
+        def slow_upload_async(*args, **kwargs):
+            time.sleep(0.2)
+            return fake(*args, **kwargs)
+        
+        url = f"/api/upload/chunked/{info['upload_id']}/complete"
+        job_ids = []
+        
+        def complete():
+            client = self.app_module.app.test_client()
+            job_ids.append(json.loads(client.post(url, headers=self.headers).data)['data']['job_id'])
+        
+        from unittest import mock
+        with mock.patch.object(self.app_module.pan_api, 'upload_async', slow_upload_async):
+            threads = [threading.Thread(target=complete) for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(self.uploaded), 1)
+        self.assertEqual(job_ids[0], job_ids[1])
+    
+    def test_upload_dir_not_under_static(self):
+        static = os.path.join(os.path.abspath(self.app_module.app.static_folder), '')
+        self.assertFalse(os.path.abspath(self.upload_dir).startswith(static))
+    
+    def test_resume_reports_received_chunks(self):
+        info = self._init()
+        self._put(info['upload_id'], 1, b'o wo')
+        again = self._init()
+        self.assertEqual(again['upload_id'], info['upload_id'])
+        self.assertEqual(again['received'], [1])
+        response = self.client.post(f"/api/upload/chunked/{info['upload_id']}/complete", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['data']['missing'], [0, 2])
+    
+    def test_bad_chunk_rejected(self):
+        info = self._init()
+        self.assertEqual(self._put(info['upload_id'], 0, b'hel').status_code, 400)
+        response = self.client.put(
+            f"/api/upload/chunked/{info['upload_id']}/0", headers=dict(self.headers, **{'X-Chunk-Md5': '0' * 32}),
+            data=b'hell'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._put(info['upload_id'], 9, b'hell').status_code, 400)
+        self.assertEqual(self._put('../etc', 0, b'hell').status_code, 404)
+    
+    def test_other_user_cannot_see_upload(self):
+        info = self._init()
+        other = {'Authorization': f"Bearer {self.app_module.generate_token('someone-else')}"}
+        response = self.client.get(f"/api/upload/chunked/{info['upload_id']}", headers=other)
+        self.assertEqual(response.status_code, 404)
+
+class TestSliceDownloadAPI(unittest.TestCase):
+    CONTENT = bytes(range(256)) * 40  # 10240字节
+
+    @classmethod
+    def setUpClass(cls):
+        import http.server
+        import re
+        import threading
+        os.environ['FLASK_ENV'] = 'testing'
+        import app as app_module
+        cls.app_module = app_module
+        cls.client = app_module.app.test_client()
+        cls.headers = {'Authorization': f"Bearer {app_module.generate_token('tester')}"}
+        cls.requests = []
+        content = cls.CONTENT
+        owner = cls
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                header = self.headers.get('Range', '')
+                owner.requests.append(header)
+                match = re.fullmatch(r'bytes=(\d+)-(\d+)', header)
+                if self.path.startswith('/expired'):
+                    self.send_response(403)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path.startswith('/norange') or not match:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+                start, end = int(match.group(1)), int(match.group(2))
+                body = content[start:end + 1]
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(content)}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        self.dir = tempfile.mkdtemp()
+        self.requests.clear()
+        self.patches = [
+            mock.patch.object(self.app_module, 'SLICE_TEMP_DIR', self.dir),
+            mock.patch.object(self.app_module.pan_api, 'parsing', lambda path: {
+                'url': self.base_url + '/file', 'name': 'a.bin', 'size': len(self.CONTENT)
+            }),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        import shutil
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _wait_complete(self, task_id):
+        import time
+        deadline = time.time() + 5
+        while True:
+            response = self.client.get(f'/api/download/slice?task_id={task_id}', headers=self.headers)
+            status = json.loads(response.data)['data']
+            if status['complete'] or status['failed']:
+                return status
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_slices_downloaded_by_range_and_merged(self):
+        response = self.client.post('/api/download/slice/create', headers=self.headers,
+                                    json={'path': '/a.bin', 'slice_size': 4000})
+        self.assertEqual(response.status_code, 200)
+        info = json.loads(response.data)['data']
+        self.assertEqual(info['total_slices'], 3)
+        status = self._wait_complete(info['task_id'])
+        self.assertTrue(status['complete'])
+        self.assertEqual(sorted(self.requests), ['bytes=0-3999', 'bytes=4000-7999', 'bytes=8000-10239'])
+        response = self.client.post('/api/download/slice/merge', headers=self.headers,
+                                    json={'task_id': info['task_id']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.CONTENT)
+        response.close()
+
+    def test_merge_refused_until_complete_and_for_other_users(self):
+        response = self.client.post('/api/download/slice/merge', headers=self.headers, json={'task_id': 'missing'})
+        self.assertEqual(response.status_code, 404)
+        info = json.loads(self.client.post('/api/download/slice/create', headers=self.headers,
+                                           json={'path': '/a.bin', 'slice_size': 4000}).data)['data']
+        other = {'Authorization': f"Bearer {self.app_module.generate_token('someone-else')}"}
+        response = self.client.get(f"/api/download/slice?task_id={info['task_id']}", headers=other)
+        self.assertEqual(response.status_code, 404)
+        self._wait_complete(info['task_id'])
+
+    def test_slices_written_in_place(self):
+        info = json.loads(self.client.post('/api/download/slice/create', headers=self.headers,
+                                           json={'path': '/a.bin', 'slice_size': 4000}).data)['data']
+        self.assertTrue(self._wait_complete(info['task_id'])['complete'])
+        task_dir = os.path.join(self.dir, info['task_id'])
+        self.assertEqual(os.listdir(task_dir), ['data'])
+        with open(os.path.join(task_dir, 'data'), 'rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+        response = self.client.post('/api/download/slice/merge', headers=self.headers,
+                                    json={'task_id': info['task_id']})
+        self.assertEqual(response.data, self.CONTENT)
+        response.close()
+        self.assertFalse(os.path.exists(task_dir))
+
+    def test_cancel_removes_task(self):
+        info = json.loads(self.client.post('/api/download/slice/create', headers=self.headers,
+                                           json={'path': '/a.bin', 'slice_size': 1000}).data)['data']
+        other = {'Authorization': f"Bearer {self.app_module.generate_token('someone-else')}"}
+        response = self.client.post('/api/download/slice/cancel', headers=other, json={'task_id': info['task_id']})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/download/slice/cancel', headers=self.headers,
+                                    json={'task_id': info['task_id']})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, info['task_id'])))
+        response = self.client.get(f"/api/download/slice?task_id={info['task_id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_expired_tasks_cleaned_up(self):
+        info = json.loads(self.client.post('/api/download/slice/create', headers=self.headers,
+                                           json={'path': '/a.bin', 'slice_size': 4000}).data)['data']
+        self.assertTrue(self._wait_complete(info['task_id'])['complete'])
+        orphan = os.path.join(self.dir, 'orphan')
+        os.makedirs(orphan)
+        old = os.path.getmtime(orphan) - self.app_module.SLICE_TASK_EXPIRE - 1
+        os.utime(orphan, (old, old))
+        with self.app_module.slice_tasks_lock:
+            self.app_module.slice_tasks[info['task_id']]['updated'] -= self.app_module.SLICE_TASK_EXPIRE + 1
+        again = json.loads(self.client.post('/api/download/slice/create', headers=self.headers,
+                                            json={'path': '/a.bin', 'slice_size': 4000}).data)['data']
+        self.assertNotIn(info['task_id'], self.app_module.slice_tasks)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, info['task_id'])))
+        self.assertFalse(os.path.exists(orphan))
+        self._wait_complete(again['task_id'])
+
+    def test_slices_interleaved_across_tasks(self):
+        from unittest import mock
+        app_module = self.app_module
+        order = []
+        with mock.patch.object(app_module, 'slice_executor', mock.Mock()), \
+                mock.patch.object(app_module, 'run_slice', lambda task, index: order.append((task['id'], index))), \
+                mock.patch.dict(app_module.slice_tasks, {'a': {'id': 'a'}, 'b': {'id': 'b'}}):
+            app_module.queue_slices('a', range(3))
+            app_module.queue_slices('b', range(2))
+            for _ in range(5):
+                app_module.run_next_slice()
+            app_module.run_next_slice()
+        self.assertEqual(order, [('a', 0), ('b', 0), ('a', 1), ('b', 1), ('a', 2)])
+        self.assertEqual(app_module.slice_pending, {})
+
+    def test_retry_refreshes_expired_link(self):
+        from unittest import mock
+        links = iter([self.base_url + '/expired', self.base_url + '/file'])
+        parsed = []
+        
+        def parsing(path):
+            parsed.append(path)
+            return {'url': next(links), 'name': 'a.bin', 'size': len(self.CONTENT)}
+        
+        with mock.patch.object(self.app_module.pan_api, 'parsing', parsing), \
+                mock.patch.object(self.app_module, 'SLICE_RETRY_DELAY', 0):
+            info = json.loads(self.client.post('/api/download/slice/create', headers=self.headers,
+                                               json={'path': '/a.bin', 'slice_size': 4000}).data)['data']
+            status = self._wait_complete(info['task_id'])
+        self.assertTrue(status['complete'])
+        # 创建时获取一次，三个切片都失败后只重新获取一次
+        self.assertEqual(parsed, ['/a.bin', '/a.bin'])
+        response = self.client.post('/api/download/slice/merge', headers=self.headers,
+                                    json={'task_id': info['task_id']})
+        self.assertEqual(response.data, self.CONTENT)
+        response.close()
+
+    def test_range_ignored_by_server_rejected(self):
+        path = os.path.join(self.dir, 'data')
+        self.app_module.preallocate_file(path, len(self.CONTENT))
+        with self.assertRaises(Exception):
+            self.app_module.download_single_slice(self.base_url + '/norange', path, 0, 3999)
+        self.app_module.download_single_slice(self.base_url + '/file', path, 4000, 7999)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(len(data), len(self.CONTENT))
+        self.assertEqual(data[:4000], bytes(4000))
+        self.assertEqual(data[4000:8000], self.CONTENT[4000:8000])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,1353 @@
+import unittest
+import asyncio
+import itertools
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '123pan'))
+
+import api as pan_api
+import http_session
+import pan123
+from pan123 import Pan123
+from pan123_async import AsyncPan123, aiohttp
+from listing_cache import ListingCache
+from path_index import PathIndex
+from presign import PresignedUrls
+from singleflight import SingleFlight
+from upload_journal import UploadJournal
+from md5_cache import Md5Cache
+from tree_walker import walk_tree, WalkLimitReached
+from upload_jobs import UploadJobs
+import bandwidth
+
+def _item(file_id, name, file_type=0, size=0):
+    return {
+        "FileId": file_id,
+        "FileName": name,
+        "Type": file_type,
+        "Size": size,
+        "Etag": "",
+        "S3KeyFlag": "flag",
+    }
+
+class FakePan:
+    """按parentFileId返回固定目录内容，并记录列目录次数"""
+    def __init__(self, tree):
+        self.tree = tree
+        self.parent_file_id = 0
+        self.list = []
+        self.get_dir_calls = 0
+        self.page_calls = []
+
+    def get_dir(self):
+        code, self.list = self.list_dir(self.parent_file_id)
+        return code
+
+    def list_dir(self, parent_file_id):
+        self.get_dir_calls += 1
+        return 0, list(self.tree.get(parent_file_id, []))
+
+    md5_cache = None
+
+    def up_load(self, file_path, file_name=None, parent_file_id=None, upload_workers=None, etag=None,
+                duplicate=None, defer_complete=None, user=None):
+        import hashlib
+        new_id = 1000 + len(self.tree.setdefault(parent_file_id, []))
+        item = _item(new_id, file_name)
+        with open(file_path, 'rb') as f:
+            item["Etag"] = hashlib.md5(f.read()).hexdigest()
+        self.tree[parent_file_id].append(item)
+        self.uploads = getattr(self, 'uploads', []) + [(parent_file_id, file_name)]
+        if defer_complete is not None:
+            defer_complete(new_id)
+        return new_id
+
+    complete_checks = 0
+
+    def check_upload_complete(self, up_file_id):
+        # 第二次确认时才完成，模拟合并较慢的大文件
+        self.complete_checks += 1
+        return self.complete_checks >= 2, {"code": 0}
+
+    def create_dir(self, parent_file_id, dirname, duplicate=0):
+        new_id = 5000 + sum(len(v) for v in self.tree.values())
+        item = _item(new_id, dirname, 1)
+        self.tree.setdefault(parent_file_id, []).append(item)
+        self.tree[new_id] = []
+        self.created = getattr(self, 'created', []) + [dirname]
+        return {"code": 0, "data": {"FileId": new_id, "Info": item}}
+
+    page_size = 2
+
+    def get_dir_page(self, parent_file_id, page=1, limit=None):
+        limit = limit or self.page_size
+        self.page_calls.append((parent_file_id, page, limit))
+        items = self.tree.get(parent_file_id, [])
+        return 0, items[(page - 1) * limit:page * limit], len(items)
+
+    def iter_dir(self, parent_file_id=None, pages=False, start_page=1):
+        page = start_page
+        while True:
+            code, items, total = self.get_dir_page(parent_file_id, page)
+            if not items:
+                return
+            if pages:
+                yield items
+            else:
+                yield from items
+            page += 1
+
+class TestPathIndex(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(PathIndex.normalize(''), '/')
+        self.assertEqual(PathIndex.normalize('a//b/'), '/a/b')
+        self.assertEqual(PathIndex.join('/', 'a'), '/a')
+
+    def test_put_children_replaces_stale_entries(self):
+        index = PathIndex(ttl=60)
+        index.put_children('/', [_item(1, 'a', 1), _item(2, 'b', 1)])
+        index.put_children('/a', [_item(3, 'c')])
+        index.put_children('/', [_item(1, 'a', 1)])
+        self.assertIsNotNone(index.get('/a/c'))
+        self.assertIsNone(index.get('/b'))
+
+    def test_remove_subtree(self):
+        index = PathIndex(ttl=60)
+        index.put('/a', _item(1, 'a', 1))
+        index.put('/a/b', _item(2, 'b'))
+        index.put('/ab', _item(3, 'ab'))
+        self.assertEqual(index.remove('/a'), 2)
+        self.assertIsNotNone(index.get('/ab'))
+
+    def test_ttl_expired(self):
+        index = PathIndex(ttl=0)
+        index.put('/a', _item(1, 'a'))
+        self.assertIsNone(index.get('/a'))
+
+class TestHttpSession(unittest.TestCase):
+    def tearDown(self):
+        http_session.configure(pool_sizes={'api': 16, 'storage': 32, 'cdn': 32})
+
+    def test_sessions_shared_per_kind(self):
+        self.assertIs(http_session.get_session(http_session.API), http_session.get_session(http_session.API))
+        self.assertIsNot(http_session.get_session(http_session.API), http_session.get_session(http_session.CDN))
+
+    def test_configure_rebuilds_pool(self):
+        old = http_session.get_session(http_session.STORAGE)
+        http_session.configure(pool_sizes={'storage': 4})
+        session = http_session.get_session(http_session.STORAGE)
+        self.assertIsNot(session, old)
+        self.assertEqual(session.get_adapter('https://s3.example.com')._pool_maxsize, 4)
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(2)
+            return 'result'
+
+        waiting = []
+
+        class CountingEvent(threading.Event):
+            def wait(self, timeout=None):
+                waiting.append(self)
+                return super().wait(timeout)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', fetch))) for _ in range(5)]
+        with mock.patch("singleflight.threading.Event", CountingEvent):
+            for t in threads:
+                t.start()
+            deadline = time.time() + 2
+            while flight._calls.get('k') is None or waiting.count(flight._calls['k'].event) < 4:
+                if time.time() > deadline:
+                    break
+                time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_error_shared_and_not_cached(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flight.do('k', fail)
+        self.assertEqual(flight.do('k', lambda: 1), 1)
+
+class TestListingCache(unittest.TestCase):
+    def _wait_for(self, predicate):
+        deadline = time.time() + 2
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_fresh_hit(self):
+        cache = ListingCache(soft_ttl=60, hard_ttl=120)
+        calls = []
+        loader = lambda: calls.append(1) or ['a']
+        self.assertEqual(cache.get(1, loader), ['a'])
+        self.assertEqual(cache.get(1, loader), ['a'])
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_served_while_refreshing(self):
+        cache = ListingCache(soft_ttl=0, hard_ttl=120)
+        cache.get(1, lambda: ['old'])
+        release = threading.Event()
+
+        def slow_loader():
+            release.wait(2)
+            return ['new']
+
+        self.assertEqual(cache.get(1, slow_loader), ['old'])
+        self.assertEqual(cache.get(1, slow_loader), ['old'])
+        release.set()
+        self._wait_for(lambda: cache.peek(1) == ['new'])
+        self.assertEqual(cache.peek(1), ['new'])
+
+    def test_invalidate_drops_inflight_refresh(self):
+        cache = ListingCache(soft_ttl=0, hard_ttl=120)
+        cache.get(1, lambda: ['old'])
+        release = threading.Event()
+
+        def slow_loader():
+            release.wait(2)
+            return ['stale']
+
+        cache.get(1, slow_loader)
+        cache.invalidate(1)
+        release.set()
+        self._wait_for(lambda: not cache._refreshing)
+        self.assertIsNone(cache.peek(1))
+        self.assertEqual(cache.get(1, lambda: ['fresh']), ['fresh'])
+
+class TestResolvePath(unittest.TestCase):
+    def setUp(self):
+        self.pan = FakePan({
+            0: [_item(1, 'docs', 1)],
+            1: [_item(2, 'sub', 1), _item(3, 'a.txt', size=10)],
+            2: [_item(4, 'b.txt', size=20)],
+        })
+        self._saved = pan_api._pan_instance
+        pan_api._pan_instance = self.pan
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+
+    def tearDown(self):
+        pan_api._pan_instance = self._saved
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+
+    def test_hot_path_costs_no_listing(self):
+        self.assertEqual(pan_api._get_file_by_path('/docs/sub/b.txt'), 4)
+        calls = self.pan.get_dir_calls
+        self.assertEqual(pan_api._get_file_by_path('/docs/sub/b.txt'), 4)
+        self.assertEqual(pan_api._get_file_by_path('/docs/a.txt'), 3)
+        self.assertEqual(self.pan.get_dir_calls, calls)
+
+    def test_missing_path(self):
+        self.assertIsNone(pan_api._get_file_by_path('/docs/missing'))
+        self.assertEqual(pan_api._get_file_by_path('/'), 0)
+
+    def test_partial_entry_refreshed_when_full_requested(self):
+        pan_api._get_file_by_path('/docs/a.txt')
+        pan_api._path_index.put('/docs/new.txt', {"FileId": 9, "FileName": "new.txt", "Type": 0})
+        self.pan.tree[1].append(_item(9, 'new.txt'))
+        self.assertEqual(pan_api._resolve_path('/docs/new.txt')["FileId"], 9)
+        calls = self.pan.get_dir_calls
+        self.assertIn("S3KeyFlag", pan_api._resolve_path('/docs/new.txt', full=True))
+        self.assertEqual(self.pan.get_dir_calls, calls + 1)
+
+    def test_listing_cached_and_invalidated_by_upload(self):
+        first = pan_api.list_folder('/docs/sub')
+        calls = self.pan.get_dir_calls
+        self.assertEqual(pan_api.list_folder('/docs/sub'), first)
+        self.assertEqual(self.pan.get_dir_calls, calls)
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(b'data')
+        try:
+            self.assertEqual(pan_api.upload(tmp.name, '/docs/sub', 'c.txt'), {"status": "success", "file_id": "1001"})
+        finally:
+            os.unlink(tmp.name)
+        names = [f['name'] for f in pan_api.list_folder('/docs/sub')['file']]
+        self.assertEqual(names, ['b.txt', 'c.txt'])
+        self.assertEqual(pan_api._get_file_by_path('/docs/sub/c.txt'), 1001)
+
+    def test_operations_do_not_touch_shared_state(self):
+        self.pan.parent_file_id = 'untouched'
+        self.pan.list = ['untouched']
+        results = {}
+
+        def worker(path):
+            results[path] = pan_api.list_folder(path)
+
+        threads = [threading.Thread(target=worker, args=(p,)) for p in ['/docs', '/docs/sub'] * 4]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([f['name'] for f in results['/docs/sub']['file']], ['b.txt'])
+        self.assertEqual([f['name'] for f in results['/docs']['folder']], ['sub'])
+        self.assertEqual(self.pan.parent_file_id, 'untouched')
+        self.assertEqual(self.pan.list, ['untouched'])
+
+    def test_search_limit(self):
+        result = pan_api.search('TXT', '/docs', limit=1)
+        self.assertEqual([f['name'] for f in result['file']], ['a.txt'])
+        self.assertFalse(result['complete'])
+        result = pan_api.search('sub', '/docs')
+        self.assertEqual(len(result['folder']), 1)
+        self.assertTrue(result['complete'])
+
+class TestListPage(unittest.TestCase):
+    def setUp(self):
+        self.pan = FakePan({
+            0: [_item(1, 'big', 1)],
+            1: [_item(100 + i, f'{i}.mp4' if i % 3 == 0 else f'{i}.txt') for i in range(50)],
+        })
+        self._saved = pan_api._pan_instance
+        pan_api._pan_instance = self.pan
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+
+    def tearDown(self):
+        pan_api._pan_instance = self._saved
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+
+    def test_fetches_only_requested_page(self):
+        result = pan_api.list_page('/big', page=3, page_size=5)
+        self.assertEqual([f['name'] for f in result['file']], [f'{i}.mp4' if i % 3 == 0 else f'{i}.txt' for i in range(10, 15)])
+        self.assertEqual(result['total'], 50)
+        self.assertEqual(self.pan.page_calls, [(1, 3, 5)])
+        self.assertEqual(self.pan.get_dir_calls, 1)
+
+    def test_cursor_walks_all_pages(self):
+        names = []
+        result = pan_api.list_page('/big', page_size=20)
+        while True:
+            names += [f['name'] for f in result['file']]
+            if not result['next_cursor']:
+                break
+            result = pan_api.list_page(cursor=result['next_cursor'])
+        self.assertEqual(len(names), 50)
+
+    def test_filtered_cursor_resumes_without_rescan(self):
+        first = pan_api.list_page('/big', page_size=4, file_type='mp4')
+        self.assertEqual([f['name'] for f in first['file']], ['0.mp4', '3.mp4', '6.mp4', '9.mp4'])
+        self.assertIsNone(first['total'])
+        self.pan.page_calls.clear()
+        second = pan_api.list_page(cursor=first['next_cursor'])
+        self.assertEqual([f['name'] for f in second['file']], ['12.mp4', '15.mp4', '18.mp4', '21.mp4'])
+        self.assertEqual(second['page'], 2)
+        self.assertEqual(self.pan.page_calls[0][1], 5)
+        self.assertEqual(pan_api.list_page('/big', page=2, page_size=4, file_type='mp4')['file'], second['file'])
+
+    def test_filtered_total_when_complete(self):
+        result = pan_api.list_page('/big', page_size=100, keyword='TXT')
+        self.assertEqual(result['total'], 33)
+        self.assertIsNone(result['next_cursor'])
+
+    def test_invalid_cursor(self):
+        self.assertIn('error', pan_api.list_page(cursor='not-a-cursor'))
+
+    def test_tampered_cursor_rejected(self):
+        import base64
+        import json
+        cursor = pan_api.list_page('/big', page_size=20)['next_cursor']
+        payload, signature = cursor.split('.')
+        state = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        state.update(id=999, path='/public')
+        forged = base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip('=')
+        self.pan.page_calls.clear()
+        self.assertIn('error', pan_api.list_page(cursor=forged + '.' + signature))
+        self.assertIn('error', pan_api.list_page(cursor=forged))
+        self.assertEqual(self.pan.page_calls, [])
+        self.assertIsNone(pan_api._path_index.get('/public/0.mp4'))
+
+def _paged_pan(total, per_page, page_size=100, workers=4):
+    """不登录的Pan123实例，分页接口返回 total 个条目，每页最多 per_page 个"""
+    pan = Pan123.__new__(Pan123)
+    pan.page_size = page_size
+    pan.list_max_workers = workers
+    pan._flight = SingleFlight()
+    pan.requested_pages = []
+    items = [_item(total - i, f'f{i}') for i in range(total)]
+
+    def get_page(parent_file_id, page, limit):
+        pan.requested_pages.append(page)
+        start = (page - 1) * min(limit, per_page)
+        page_items = items[start:start + min(limit, per_page)]
+        return {"code": 0, "data": {"InfoList": [dict(i) for i in page_items], "Total": total}}
+
+    pan._get_dir_page = get_page
+    return pan, items
+
+class TestWalk(unittest.TestCase):
+    TREE = {
+        0: [_item(1, 'a', 1), _item(2, 'b', 1), _item(3, 'top.txt', size=5)],
+        1: [_item(4, 'a1', 1), _item(5, 'x.txt', size=7)],
+        2: [_item(6, 'y.txt', size=11)],
+        4: [_item(7, 'deep.txt', size=13)],
+    }
+
+    def setUp(self):
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+        self.pan = FakePan(self.TREE)
+        self._saved = pan_api._pan_instance
+        pan_api._pan_instance = self.pan
+
+    def tearDown(self):
+        pan_api._pan_instance = self._saved
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+
+    def _list(self, folder_id, folder_path):
+        return self.TREE.get(folder_id, [])
+
+    def test_breadth_first_paths(self):
+        result = [(p, d) for p, _, d in walk_tree(self._list, 0, "/", max_workers=1)]
+        self.assertEqual(result, [
+            ('/a', 1), ('/b', 1), ('/top.txt', 1),
+            ('/a/a1', 2), ('/a/x.txt', 2), ('/b/y.txt', 2),
+            ('/a/a1/deep.txt', 3),
+        ])
+
+    def test_concurrent_walk_finds_everything(self):
+        paths = {p for p, _, _ in walk_tree(self._list, 0, "/", max_workers=4)}
+        self.assertEqual(len(paths), 7)
+        self.assertIn('/a/a1/deep.txt', paths)
+
+    def test_max_depth(self):
+        paths = [p for p, _, _ in walk_tree(self._list, 0, "/", max_depth=1)]
+        self.assertEqual(sorted(paths), ['/a', '/b', '/top.txt'])
+
+    def test_max_entries(self):
+        seen = []
+        with self.assertRaises(WalkLimitReached):
+            for p, _, _ in walk_tree(self._list, 0, "/", max_workers=1, max_entries=4):
+                seen.append(p)
+        self.assertEqual(len(seen), 4)
+
+    def test_error_propagates(self):
+        def broken(folder_id, folder_path):
+            if folder_id == 2:
+                raise Exception("获取目录失败: 2")
+            return self.TREE.get(folder_id, [])
+
+        with self.assertRaises(Exception):
+            list(walk_tree(broken, 0, "/"))
+
+    def test_walk_path_populates_index(self):
+        paths = [p for p, _, _ in pan_api.walk('/a')]
+        self.assertEqual(sorted(paths), ['/a/a1', '/a/a1/deep.txt', '/a/x.txt'])
+        self.assertEqual(pan_api._path_index.get('/a/a1/deep.txt')['FileId'], 7)
+
+    def test_tree_stats(self):
+        self.assertEqual(pan_api.tree_stats('/'), {
+            "total_files": 4, "total_folders": 3, "total_size": 36, "complete": True
+        })
+        self.assertFalse(pan_api.tree_stats('/', max_entries=2)["complete"])
+
+class TestUploadFolder(unittest.TestCase):
+    def setUp(self):
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+        self.pan = FakePan({0: [_item(1, 'backup', 1)], 1: []})
+        self._saved = pan_api._pan_instance
+        pan_api._pan_instance = self.pan
+        self.dir = tempfile.mkdtemp()
+        self.local = os.path.join(self.dir, 'project')
+        os.makedirs(os.path.join(self.local, 'src', 'deep'))
+        os.makedirs(os.path.join(self.local, 'docs'))
+        for rel, content in [('readme.md', b'r'), ('src/main.py', b'm'), ('src/deep/x.py', b'x'), ('docs/a.txt', b'a')]:
+            with open(os.path.join(self.local, *rel.split('/')), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        import shutil
+        pan_api._pan_instance = self._saved
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+        shutil.rmtree(self.dir)
+
+    def test_mirrors_tree_and_skips_on_rerun(self):
+        result = pan_api.upload_folder(self.local, '/backup')
+        self.assertEqual(result["status"], "success")
+        self.assertEqual((result["uploaded"], result["skipped"], result["failed"]), (4, 0, 0))
+        self.assertEqual(sorted(self.pan.created), ['deep', 'docs', 'project', 'src'])
+        self.assertEqual(pan_api._resolve_path('/backup/project/src/deep/x.py')["FileName"], 'x.py')
+
+        pan_api._listing_cache.clear()
+        again = pan_api.upload_folder(self.local, '/backup')
+        self.assertEqual((again["uploaded"], again["skipped"], again["failed"]), (0, 4, 0))
+        self.assertEqual(len(self.pan.created), 4)
+        self.assertEqual(len(self.pan.uploads), 4)
+
+    def test_changed_file_reported_unless_overwrite(self):
+        pan_api.upload_folder(self.local, '/backup')
+        with open(os.path.join(self.local, 'readme.md'), 'wb') as f:
+            f.write(b'changed')
+        pan_api._listing_cache.clear()
+        result = pan_api.upload_folder(self.local, '/backup')
+        self.assertEqual(result["status"], "partial")
+        failed = [r for r in result["files"] if r["status"] == "failed"]
+        self.assertEqual([r["path"] for r in failed], ['readme.md'])
+        pan_api._listing_cache.clear()
+        result = pan_api.upload_folder(self.local, '/backup', overwrite=True)
+        self.assertEqual((result["uploaded"], result["skipped"]), (1, 3))
+
+    def test_missing_local_dir(self):
+        self.assertIn("error", pan_api.upload_folder(os.path.join(self.dir, 'nope'), '/'))
+
+class TestGetDir(unittest.TestCase):
+    def test_pages_fetched_and_ordered(self):
+        pan, items = _paged_pan(total=1050, per_page=100)
+        code, lists = pan.list_dir(0)
+        self.assertEqual(code, 0)
+        self.assertEqual([i["FileId"] for i in lists], [i["FileId"] for i in items])
+        self.assertEqual(sorted(pan.requested_pages), list(range(1, 12)))
+        self.assertEqual(lists[-1]["FileNum"], 1049)
+
+    def test_server_capped_page_size(self):
+        pan, items = _paged_pan(total=250, per_page=100, page_size=500)
+        code, lists = pan.list_dir(0)
+        self.assertEqual(len(lists), 250)
+
+    def test_iter_dir_stops_early(self):
+        pan, items = _paged_pan(total=1050, per_page=100)
+        first = [i["FileId"] for i in itertools.islice(pan.iter_dir(0), 150)]
+        self.assertEqual(first, [i["FileId"] for i in items[:150]])
+        self.assertEqual(pan.requested_pages, [1, 2])
+
+    def test_iter_dir_pages(self):
+        pan, items = _paged_pan(total=250, per_page=100)
+        self.assertEqual([len(p) for p in pan.iter_dir(0, pages=True)], [100, 100, 50])
+
+    def test_error_code_keeps_list(self):
+        pan = Pan123.__new__(Pan123)
+        pan.page_size = 100
+        pan.list_max_workers = 4
+        pan._flight = SingleFlight()
+        pan.parent_file_id = 0
+        pan.list = ['old']
+        pan._get_dir_page = lambda parent_file_id, page, limit: {"code": 2, "data": None}
+        self.assertEqual(pan.get_dir(), 2)
+        self.assertEqual(pan.list, ['old'])
+
+class TestPresignedUrls(unittest.TestCase):
+    def _urls(self, part_count=10, window=4, ttl=600):
+        calls = []
+
+        def fetch(start, end):
+            calls.append((start, end))
+            return {str(n): f"url/{n}/{len(calls)}" for n in range(start, end)}
+
+        return PresignedUrls(fetch, part_count, window=window, ttl=ttl), calls
+
+    def test_window_fetched_once(self):
+        urls, calls = self._urls()
+        self.assertEqual([urls.get(n) for n in range(1, 5)], [f"url/{n}/1" for n in range(1, 5)])
+        self.assertEqual(calls, [(1, 5)])
+        urls.get(5)
+        self.assertEqual(calls, [(1, 5), (5, 9)])
+
+    def test_last_window_clipped(self):
+        urls, calls = self._urls(part_count=6)
+        urls.get(5)
+        self.assertEqual(calls, [(5, 7)])
+
+    def test_expired_and_invalidated_refetched(self):
+        clock = [1000.0]
+        urls, calls = self._urls(ttl=600)
+        with mock.patch("presign.time.time", lambda: clock[0]):
+            urls.get(1)
+            clock[0] += 601
+            urls.get(1)
+        self.assertEqual(len(calls), 2)
+        urls, calls = self._urls()
+        urls.get(1)
+        urls.invalidate(2)
+        self.assertEqual(urls.get(2), "url/2/2")
+        self.assertEqual(calls, [(1, 5), (2, 6)])
+
+    def test_missing_url_raises(self):
+        urls = PresignedUrls(lambda start, end: {}, 3)
+        with self.assertRaises(Exception):
+            urls.get(1)
+
+    def test_expired_url_not_reused_when_refetch_misses_it(self):
+        clock = [1000.0]
+        responses = iter([{"1": "old"}, {}])
+        urls = PresignedUrls(lambda start, end: next(responses), 3, ttl=600)
+        with mock.patch("presign.time.time", lambda: clock[0]):
+            self.assertEqual(urls.get(1), "old")
+            clock[0] += 601
+            with self.assertRaises(Exception):
+                urls.get(1)
+
+class TestPartSize(unittest.TestCase):
+    MB = 1024 * 1024
+
+    def test_small_and_medium_files_use_minimum(self):
+        self.assertEqual(pan123.choose_part_size(10), 5 * self.MB)
+        self.assertEqual(pan123.choose_part_size(2 * 1024 * self.MB), 5 * self.MB)
+
+    def test_large_file_uses_fewer_parts(self):
+        size = pan123.choose_part_size(50 * 1024 * self.MB)
+        self.assertEqual(size, 52 * self.MB)
+        self.assertLessEqual(math.ceil(50 * 1024 * self.MB / size), pan123.TARGET_PART_COUNT)
+
+    def test_slow_link_keeps_parts_short(self):
+        # 1MB/s时每块约10秒
+        self.assertEqual(pan123.choose_part_size(50 * 1024 * self.MB, throughput=self.MB), 10 * self.MB)
+        self.assertEqual(pan123.choose_part_size(50 * 1024 * self.MB, throughput=100 * 1024), 6 * self.MB)
+
+    def test_part_count_limit_wins(self):
+        fsize = 1024 * 1024 * self.MB  # 1TB
+        size = pan123.choose_part_size(fsize, throughput=self.MB)
+        self.assertLessEqual(math.ceil(fsize / size), pan123.MAX_PART_COUNT)
+
+    def test_throughput_averaged(self):
+        pan = Pan123.__new__(Pan123)
+        pan.part_throughput = None
+        pan._throughput_lock = threading.Lock()
+        pan._record_throughput(10 * self.MB, 1.0)
+        self.assertEqual(pan.part_throughput, 10 * self.MB)
+        pan._record_throughput(10 * self.MB, 10.0)
+        self.assertAlmostEqual(pan.part_throughput, 7.3 * self.MB)
+        pan._record_throughput(10, 0.001)
+        self.assertAlmostEqual(pan.part_throughput, 7.3 * self.MB)
+
+class _FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class TestUploadParts(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        self.content = os.urandom(1000)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.content)
+        self.pan = Pan123.__new__(Pan123)
+        self.pan.part_retries = 2
+        self.pan.part_throughput = None
+        self.pan._throughput_lock = threading.Lock()
+        self.pan.presign_window = 4
+        self.presign_calls = []
+
+        def presign_parts(session_data, start, end):
+            self.presign_calls.append((start, end))
+            return {str(n): f"url/{n}" for n in range(start, end)}
+
+        self.pan._presign_parts = presign_parts
+        self.received = {}
+        self.buffers = []
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _put(self, fail_parts=(), always_fail=()):
+        def put(url, data=None, timeout=None):
+            part = int(url.split("/")[-1])
+            with self.lock:
+                self.attempts[part] = self.attempts.get(part, 0) + 1
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            threading.Event().wait(0.01)  # time.sleep在测试中被替换，用Event等待
+            with self.lock:
+                self.active -= 1
+                if part in always_fail or (part in fail_parts and self.attempts[part] == 1):
+                    return _FakeResponse(500)
+                self.received[part] = bytes(data)
+                self.buffers.append(data.obj)
+            return _FakeResponse(200)
+        session = mock.Mock()
+        session.put = put
+        return mock.patch.object(pan123, "get_session", lambda kind=None: session)
+
+    def test_parts_uploaded_concurrently_and_complete(self):
+        with self._put(), mock.patch.object(pan123.time, "sleep", lambda s: None):
+            uploaded = self.pan._upload_parts(self.path, 1000, {}, 100, 4)
+        self.assertEqual(list(uploaded), list(range(1, 11)))
+        self.assertEqual(b"".join(self.received[n] for n in range(1, 11)), self.content)
+        self.assertGreater(self.max_active, 1)
+        self.assertLessEqual(self.max_active, 4)
+        # 10个分块按4个一批获取链接，而不是每块一次
+        self.assertLessEqual(len(self.presign_calls), 5)
+        self.assertTrue(all(end - start <= 4 for start, end in self.presign_calls))
+
+    def test_parts_are_views_of_mapped_file(self):
+        with self._put(), mock.patch.object(pan123.time, "sleep", lambda s: None):
+            self.pan._upload_parts(self.path, 1000, {}, 100, 4)
+        self.assertTrue(all(isinstance(buf, pan123.mmap.mmap) for buf in self.buffers))
+        self.assertEqual(len({id(buf) for buf in self.buffers}), 1)
+
+    def test_unmapped_file_reuses_thread_buffer(self):
+        with self._put(), mock.patch.object(pan123.time, "sleep", lambda s: None), \
+                mock.patch.object(pan123, "_map_file", lambda f, size: None):
+            uploaded = self.pan._upload_parts(self.path, 1000, {}, 300, 1)
+        self.assertEqual(uploaded, {1: 300, 2: 300, 3: 300, 4: 100})
+        self.assertEqual(b"".join(self.received[n] for n in range(1, 5)), self.content)
+        self.assertEqual(len({id(buf) for buf in self.buffers}), 1)
+
+    def test_failed_part_is_retried(self):
+        with self._put(fail_parts={3}), mock.patch.object(pan123.time, "sleep", lambda s: None):
+            uploaded = self.pan._upload_parts(self.path, 1000, {}, 300, 2)
+        self.assertEqual(uploaded, {1: 300, 2: 300, 3: 300, 4: 100})
+        self.assertEqual(self.attempts[3], 2)
+        # 失败后重新获取了链接
+        self.assertTrue(any(start == 3 for start, _ in self.presign_calls[1:]))
+
+    def test_part_failing_after_retries_aborts(self):
+        with self._put(always_fail={2}), mock.patch.object(pan123.time, "sleep", lambda s: None):
+            self.assertIsNone(self.pan._upload_parts(self.path, 1000, {}, 300, 2))
+        self.assertEqual(self.attempts[2], 3)
+
+class TestUploadJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal.json')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_parts_persist_across_instances(self):
+        journal = UploadJournal(self.path)
+        key = UploadJournal.make_key('md5', 1000, 0, 'a.bin')
+        journal.start(key, {"uploadId": "u"}, 42, 300)
+        journal.add_part(key, 1, 300)
+        journal.add_part(key, 3, 300)
+        entry = UploadJournal(self.path).get(key)
+        self.assertEqual(entry["FileId"], 42)
+        self.assertEqual(entry["session"], {"uploadId": "u"})
+        self.assertEqual(entry["parts"], {1: 300, 3: 300})
+
+    def test_remove_and_expiry(self):
+        journal = UploadJournal(self.path)
+        journal.start('k', {}, 1, 300)
+        journal.remove('k')
+        self.assertIsNone(UploadJournal(self.path).get('k'))
+        journal = UploadJournal(self.path, max_age=0)
+        journal.start('k', {}, 1, 300)
+        self.assertIsNone(journal.get('k'))
+
+class TestMd5Cache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, 'a.bin')
+        self.cache_path = os.path.join(self.dir, 'md5.json')
+        with open(self.file, 'wb') as f:
+            f.write(b'hello')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_hit_skips_read_and_persists(self):
+        import hashlib
+        cache = Md5Cache(self.cache_path)
+        self.assertEqual(cache.hash_file(self.file), hashlib.md5(b'hello').hexdigest())
+        with mock.patch('builtins.open', side_effect=AssertionError('不应重新读取文件')):
+            self.assertEqual(cache.get(self.file), hashlib.md5(b'hello').hexdigest())
+        cache.flush()
+        self.assertEqual(Md5Cache(self.cache_path).get(self.file), hashlib.md5(b'hello').hexdigest())
+
+    def test_puts_batched_until_flush(self):
+        cache = Md5Cache(self.cache_path, flush_interval=3600)
+        for i in range(50):
+            path = os.path.join(self.dir, f'{i}.bin')
+            with open(path, 'wb') as f:
+                f.write(bytes([i]))
+            cache.hash_file(path)
+        self.assertFalse(os.path.exists(self.cache_path))
+        cache.flush()
+        self.assertEqual(len(Md5Cache(self.cache_path)._entries), 50)
+        with mock.patch('builtins.open', side_effect=AssertionError('没有新条目时不应写文件')):
+            cache.flush()
+
+    def test_flush_interval_saves_automatically(self):
+        cache = Md5Cache(self.cache_path, flush_interval=0)
+        cache.hash_file(self.file)
+        self.assertIsNotNone(Md5Cache(self.cache_path).get(self.file))
+
+    def test_modified_file_rehashed(self):
+        import hashlib
+        cache = Md5Cache(self.cache_path)
+        cache.hash_file(self.file)
+        with open(self.file, 'wb') as f:
+            f.write(b'changed!')
+        os.utime(self.file, ns=(0, 123456789))
+        self.assertIsNone(cache.get(self.file))
+        self.assertEqual(cache.hash_file(self.file), hashlib.md5(b'changed!').hexdigest())
+
+    def test_max_size_evicts_oldest(self):
+        cache = Md5Cache(self.cache_path, max_size=1)
+        other = os.path.join(self.dir, 'b.bin')
+        with open(other, 'wb') as f:
+            f.write(b'x')
+        cache.hash_file(self.file)
+        cache.hash_file(other)
+        self.assertIsNone(cache.get(self.file))
+        self.assertIsNotNone(cache.get(other))
+
+class _FakeJsonResponse:
+    def __init__(self, data):
+        self._data = data
+        self.status_code = 200
+
+    def json(self):
+        return self._data
+
+class TestPanOptions(unittest.TestCase):
+    def test_default_files_in_package_dir(self):
+        package_dir = os.path.dirname(os.path.abspath(pan123.__file__))
+        options = pan_api._pan_options({})
+        self.assertEqual(options["upload_journal"], os.path.join(package_dir, "upload_journal.json"))
+        self.assertEqual(options["md5_cache"], os.path.join(package_dir, "md5_cache.json"))
+        self.assertIsNone(pan_api._pan_options({"upload-journal": None})["upload_journal"])
+
+class TestResumeUpload(unittest.TestCase):
+    # 大于一个5MB分块才会写断点记录；记录中的分块大小为BLOCK，共4块
+    SIZE = 5242880 + 1000
+    BLOCK = 1311000
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, 'a.bin')
+        with open(self.file, 'wb') as f:
+            f.write(os.urandom(self.SIZE))
+        self.pan = Pan123.__new__(Pan123)
+        self.pan.header_logined = {}
+        self.pan.parent_file_id = 0
+        self.pan.upload_workers = 2
+        self.pan.part_retries = 0
+        self.pan.part_throughput = None
+        self.pan._throughput_lock = threading.Lock()
+        self.pan.presign_window = 32
+        self.pan.upload_journal = UploadJournal(os.path.join(self.dir, 'journal.json'))
+        self.pan.md5_cache = Md5Cache(os.path.join(self.dir, 'md5.json'))
+        self.pan._presign_parts = lambda session_data, start, end: {str(n): f"url/{n}" for n in range(start, end)}
+        self.posts = []
+        self.puts = []
+
+    def tearDown(self):
+        import shutil
+        self.pan.md5_cache.flush()
+        shutil.rmtree(self.dir)
+
+    def _session(self, server_parts):
+        session = mock.Mock()
+
+        def post(url, headers=None, data=None, timeout=None):
+            name = url.rsplit("/", 1)[-1]
+            self.posts.append(name)
+            if name == "s3_list_upload_parts":
+                return _FakeJsonResponse({"code": 0, "data": {"Parts": [
+                    {"PartNumber": n, "Size": self.BLOCK} for n in server_parts
+                ]}})
+            return _FakeJsonResponse({"code": 0, "data": {}})
+
+        def put(url, data=None, timeout=None):
+            self.puts.append(int(url.split("/")[-1]))
+            return _FakeResponse(200)
+
+        session.post = post
+        session.put = put
+        return mock.patch.object(pan123, "get_session", lambda kind=None: session)
+
+    def test_resume_skips_uploaded_parts(self):
+        import hashlib
+        with open(self.file, 'rb') as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        key = UploadJournal.make_key(etag, self.SIZE, 0, 'a.bin')
+        journal = self.pan.upload_journal
+        journal.start(key, {"bucket": "b", "key": "k", "uploadId": "u", "storageNode": "s"}, 7, self.BLOCK)
+        journal.add_part(key, 1, self.BLOCK)
+        journal.add_part(key, 2, self.BLOCK)
+        journal.add_part(key, 3, self.BLOCK)
+        # 服务端只确认了1、2块，第3块需要重传
+        with self._session(server_parts=[1, 2]):
+            self.assertEqual(self.pan.up_load(self.file, parent_file_id=0), 7)
+        self.assertNotIn("upload_request", self.posts)
+        self.assertEqual(sorted(self.puts), [3, 4])
+        self.assertIn("s3_complete_multipart_upload", self.posts)
+        self.assertIsNone(journal.get(key))
+
+class TestStreamUpload(unittest.TestCase):
+    BLOCK = 5242880
+
+    def setUp(self):
+        self.pan = Pan123.__new__(Pan123)
+        self.pan.header_logined = {}
+        self.pan.parent_file_id = 0
+        self.pan.upload_workers = 2
+        self.pan.part_retries = 0
+        self.pan.part_throughput = None
+        self.pan._throughput_lock = threading.Lock()
+        self.pan.presign_window = 32
+        self.pan._presign_parts = lambda session_data, start, end: {str(n): f"url/{n}" for n in range(start, end)}
+        self.posts = []
+        self.puts = {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.pending_completes = []
+        self.buffers = set()
+
+    def _session(self):
+        session = mock.Mock()
+
+        def post(url, headers=None, data=None, timeout=None):
+            name = url.rsplit("/", 1)[-1]
+            self.posts.append(name)
+            if name == "upload_request":
+                return _FakeJsonResponse({"code": 0, "data": {
+                    "Reuse": False, "Bucket": "b", "Key": "k", "UploadId": "u",
+                    "StorageNode": "s", "FileId": 9,
+                }})
+            if name == "upload_complete" and self.pending_completes:
+                return _FakeJsonResponse(self.pending_completes.pop(0))
+            return _FakeJsonResponse({"code": 0, "data": {}})
+
+        def put(url, data=None, timeout=None):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            threading.Event().wait(0.01)
+            with self.lock:
+                self.in_flight -= 1
+                self.puts[int(url.split("/")[-1])] = bytes(data)
+                self.buffers.add(id(data.obj))
+            return _FakeResponse(200)
+
+        session.post = post
+        session.put = put
+        return mock.patch.object(pan123, "get_session", lambda kind=None: session)
+
+    class _TrickleStream:
+        """每次最多返回1MB，模拟逐步到达的请求体"""
+        def __init__(self, content):
+            self.content = content
+            self.pos = 0
+
+        def read(self, n):
+            n = min(n, 1024 * 1024)
+            chunk = self.content[self.pos:self.pos + n]
+            self.pos += len(chunk)
+            return chunk
+
+    def test_stream_split_into_parts(self):
+        import hashlib
+        content = os.urandom(self.BLOCK * 3 + 17)
+        stream = self._TrickleStream(content)
+        with self._session():
+            file_id = self.pan.up_load_stream(stream, 'a.bin', len(content), hashlib.md5(content).hexdigest())
+        self.assertEqual(file_id, 9)
+        self.assertEqual(sorted(self.puts), [1, 2, 3, 4])
+        self.assertEqual(b"".join(self.puts[n] for n in range(1, 5)), content)
+        self.assertLessEqual(self.max_in_flight, 2)
+        self.assertIn("upload_complete", self.posts)
+
+    def test_stream_buffers_reused(self):
+        import hashlib
+        content = os.urandom(self.BLOCK * 4 + 1)
+        with self._session():
+            file_id = self.pan.up_load_stream(
+                self._TrickleStream(content), 'a.bin', len(content), hashlib.md5(content).hexdigest(), window=2
+            )
+        self.assertEqual(file_id, 9)
+        self.assertEqual(b"".join(self.puts[n] for n in range(1, 6)), content)
+        self.assertLessEqual(len(self.buffers), 2)
+
+    def test_single_part_file_skips_part_listing(self):
+        self.pan.upload_journal = None
+        self.pan.md5_cache = None
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'small file')
+        try:
+            with self._session():
+                self.assertEqual(self.pan.up_load(path, 'a.txt', parent_file_id=0, duplicate=0), 9)
+        finally:
+            os.unlink(path)
+        self.assertEqual(self.posts, ["upload_request", "s3_complete_multipart_upload", "upload_complete"])
+        self.assertEqual(list(self.puts), [1])
+
+    def _small_file(self):
+        self.pan.upload_journal = None
+        self.pan.md5_cache = None
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'small file')
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def test_completion_polled_with_backoff(self):
+        path = self._small_file()
+        self.pending_completes = [{"code": 1, "message": "合并中"}, {"code": 0, "data": {"completed": False}}]
+        delays = []
+        with self._session(), mock.patch.object(pan123.time, "sleep", delays.append):
+            self.assertEqual(self.pan.up_load(path, 'a.txt', parent_file_id=0, duplicate=0), 9)
+        self.assertEqual(self.posts.count("upload_complete"), 3)
+        self.assertEqual(delays, [1, 2])
+
+    def test_completion_gives_up_after_timeout(self):
+        path = self._small_file()
+        self.pending_completes = [{"code": 1}] * 100
+        delays = []
+        with self._session(), mock.patch.object(pan123.time, "sleep", delays.append), \
+                mock.patch.object(pan123, "COMPLETE_POLL_TIMEOUT", 10):
+            self.assertIsNone(self.pan.up_load(path, 'a.txt', parent_file_id=0, duplicate=0))
+        self.assertEqual(delays, [1, 2, 4, 8])
+
+    def test_defer_complete_returns_after_merge(self):
+        path = self._small_file()
+        deferred = []
+        with self._session():
+            self.assertEqual(self.pan.up_load(
+                path, 'a.txt', parent_file_id=0, duplicate=0, defer_complete=deferred.append
+            ), 9)
+        self.assertEqual(deferred, [9])
+        self.assertEqual(self.posts, ["upload_request", "s3_complete_multipart_upload"])
+
+    def test_up_load_many_runs_files_concurrently(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def up_load(file_path, file_name=None, parent_file_id=None, upload_workers=None, duplicate=None):
+            with lock:
+                active.append(file_path)
+                peak.append(len(active))
+            threading.Event().wait(0.02)
+            with lock:
+                active.remove(file_path)
+            return None if file_path == 'bad' else 100 + len(file_path)
+
+        self.pan.up_load = up_load
+        self.pan.md5_cache = None
+        files = [(f'f{i}', None) for i in range(8)] + [('bad', None)]
+        results, files_per_sec = self.pan.up_load_many(files, parent_file_id=0, workers=4)
+        self.assertEqual(results, [102] * 8 + [None])
+        self.assertEqual(max(peak), 4)
+        self.assertGreater(files_per_sec, 0)
+
+    def test_md5_mismatch_not_completed(self):
+        content = os.urandom(1000)
+        with self._session():
+            self.assertIsNone(self.pan.up_load_stream(self._TrickleStream(content), 'a.bin', 1000, '0' * 32))
+        self.assertNotIn("s3_complete_multipart_upload", self.posts)
+
+    def test_short_body_not_completed(self):
+        import hashlib
+        content = os.urandom(1000)
+        with self._session():
+            self.assertIsNone(self.pan.up_load_stream(
+                self._TrickleStream(content[:500]), 'a.bin', 1000, hashlib.md5(content).hexdigest()
+            ))
+        self.assertNotIn("upload_complete", self.posts)
+
+class TestUploadJobs(unittest.TestCase):
+    def _wait(self, jobs, job_id):
+        deadline = time.time() + 5
+        while jobs.get(job_id)["status"] in ("uploading", "completing"):
+            self.assertLess(time.time(), deadline)
+            threading.Event().wait(0.005)
+        return jobs.get(job_id)
+
+    def test_result_and_error(self):
+        jobs = UploadJobs()
+        ok = jobs.submit(lambda job_id, x: {"status": "success", "file_id": x}, "1")
+        bad = jobs.submit(lambda job_id: 1 / 0)
+        self.assertEqual(self._wait(jobs, ok)["result"], {"status": "success", "file_id": "1"})
+        self.assertEqual(self._wait(jobs, bad)["status"], "failed")
+        self.assertIsNone(jobs.get("missing"))
+
+    def test_set_max_workers(self):
+        jobs = UploadJobs(max_workers=1)
+        release = threading.Event()
+        running = []
+
+        def job(job_id):
+            running.append(job_id)
+            release.wait(5)
+            return {"status": "success"}
+
+        first = jobs.submit(job)
+        jobs.set_max_workers(3)
+        others = [jobs.submit(job) for _ in range(3)]
+        deadline = time.time() + 5
+        while len(running) < 4:
+            self.assertLess(time.time(), deadline)
+            threading.Event().wait(0.005)
+        release.set()
+        for job_id in [first] + others:
+            self.assertEqual(self._wait(jobs, job_id)["status"], "success")
+
+    def test_poll_retries_until_done(self):
+        jobs = UploadJobs(first_delay=0.01, max_delay=0.02)
+        answers = [Exception("timeout"), (False, None), (True, {"status": "success"})]
+        done = []
+
+        def check():
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        def fn(job_id):
+            jobs.poll(job_id, check, done.append)
+
+        job = self._wait(jobs, jobs.submit(fn))
+        self.assertEqual(job["status"], "success")
+        self.assertEqual(job["attempts"], 3)
+        self.assertEqual(done, [{"status": "success"}])
+
+    def test_poll_timeout(self):
+        jobs = UploadJobs(first_delay=0.01, max_delay=0.01, timeout=0.05)
+        job = self._wait(jobs, jobs.submit(lambda job_id: jobs.poll(job_id, lambda: (False, None))))
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("超时", job["result"]["error"])
+
+    def test_keep_limits_finished_jobs(self):
+        jobs = UploadJobs(keep=2)
+        ids = [jobs.submit(lambda job_id: {"status": "success"}) for _ in range(4)]
+        for job_id in ids[2:]:
+            self._wait(jobs, job_id)
+        deadline = time.time() + 5
+        while sum(jobs.get(job_id) is not None for job_id in ids) > 2:
+            self.assertLess(time.time(), deadline)
+            threading.Event().wait(0.005)
+
+    def test_upload_async_confirms_in_background(self):
+        pan = FakePan({0: [_item(1, 'docs', 1)], 1: []})
+        saved = (pan_api._pan_instance, pan_api._upload_jobs)
+        pan_api._pan_instance = pan
+        pan_api._upload_jobs = UploadJobs(first_delay=0.01)
+        pan_api._path_index.clear()
+        pan_api._listing_cache.clear()
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(b'data')
+        finished = []
+        try:
+            submitted = pan_api.upload_async(tmp.name, '/docs', 'c.txt', on_done=finished.append)
+            self.assertEqual(submitted["status"], "uploading")
+            self._wait(pan_api._upload_jobs, submitted["job_id"])
+            job = pan_api.upload_job(submitted["job_id"])
+        finally:
+            pan_api._pan_instance, pan_api._upload_jobs = saved
+            pan_api._path_index.clear()
+            pan_api._listing_cache.clear()
+            os.unlink(tmp.name)
+        self.assertEqual(job["status"], "success")
+        self.assertEqual(job["result"], {"status": "success", "file_id": "1000"})
+        self.assertEqual(pan.complete_checks, 2)
+        self.assertEqual(finished, [job["result"]])
+        self.assertEqual(pan_api.upload_job("missing"), {"error": "上传任务不存在"})
+
+class TestBandwidth(unittest.TestCase):
+    def tearDown(self):
+        bandwidth.configure()
+
+    def test_unlimited_passes_data_through(self):
+        data = memoryview(b'abc')
+        self.assertIs(bandwidth.shaped(data), data)
+        self.assertEqual(list(bandwidth.iter_shaped([b'a', b'b'])), [b'a', b'b'])
+
+    def test_shaped_reader_returns_all_data(self):
+        content = os.urandom(200000)
+        reader = bandwidth.ShapedReader(content, bandwidth.BandwidthShaper(rate=100 * 1024 * 1024))
+        self.assertEqual(len(reader), 200000)
+        chunks = []
+        while True:
+            chunk = reader.read(8192)
+            if not chunk:
+                break
+            chunks.append(bytes(chunk))
+        self.assertEqual(b"".join(chunks), content)
+
+    def test_user_rate_limits_one_user_only(self):
+        shaper = bandwidth.BandwidthShaper(user_rate=1024 * 1024)
+        start = time.time()
+        shaper.consume(300 * 1024, "bulk")
+        self.assertGreater(time.time() - start, 0.15)
+        start = time.time()
+        shaper.consume(64 * 1024, "other")
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_global_rate_shared_fairly_between_users(self):
+        shaper = bandwidth.BandwidthShaper(rate=4 * 1024 * 1024)
+        sent = {"bulk": 0, "interactive": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def transfer(user):
+            while not stop.is_set():
+                shaper.consume(bandwidth.QUANTUM, user)
+                with lock:
+                    sent[user] += bandwidth.QUANTUM
+
+        # 一个用户4个传输，另一个用户1个传输，全局带宽仍按用户平分
+        threads = [threading.Thread(target=transfer, args=("bulk",)) for _ in range(4)]
+        threads.append(threading.Thread(target=transfer, args=("interactive",)))
+        for t in threads:
+            t.start()
+        threading.Event().wait(0.6)
+        stop.set()
+        for t in threads:
+            t.join()
+        total = sent["bulk"] + sent["interactive"]
+        self.assertLess(total, 4 * 1024 * 1024 * 0.6 + 1024 * 1024)
+        self.assertGreater(sent["interactive"] / total, 0.35)
+
+class TestAsyncPan123(unittest.TestCase):
+    def _pan(self, total, per_page):
+        items = [{"FileId": i, "FileName": f"f{i}"} for i in range(total)]
+        pan = AsyncPan123(list_max_workers=3)
+        pan.requested_pages = []
+
+        async def get_dir_page(parent_file_id, page=1, limit=None):
+            pan.requested_pages.append(page)
+            await asyncio.sleep(0)
+            return 0, items[(page - 1) * per_page:page * per_page], total
+
+        pan.get_dir_page = get_dir_page
+        return pan, items
+
+    @unittest.skipIf(aiohttp is None, "aiohttp未安装")
+    def test_list_dir_gathers_pages(self):
+        pan, items = self._pan(total=450, per_page=100)
+        code, lists = asyncio.run(pan.list_dir(0))
+        self.assertEqual(code, 0)
+        self.assertEqual([i["FileId"] for i in lists], [i["FileId"] for i in items])
+        self.assertEqual(sorted(pan.requested_pages), [1, 2, 3, 4, 5])
+        self.assertEqual(lists[-1]["FileNum"], 449)
+
+    @unittest.skipIf(aiohttp is None, "aiohttp未安装")
+    def test_iter_dir_stops_early(self):
+        pan, items = self._pan(total=450, per_page=100)
+
+        async def first(n):
+            out = []
+            async for i in pan.iter_dir(0):
+                out.append(i["FileId"])
+                if len(out) == n:
+                    break
+            return out
+
+        self.assertEqual(asyncio.run(first(150)), list(range(150)))
+        self.assertEqual(pan.requested_pages, [1, 2])
+
+    def _upload_pan(self, statuses):
+        """返回 (pan, 请求记录)；第 n 次PUT的状态码取 statuses[n]，用完后为200"""
+        pan = AsyncPan123(presign_window=8, part_retries=2)
+        calls = {"presign": [], "put": [], "put_headers": [], "complete": 0}
+        statuses = iter(statuses)
+
+        async def post_json(url, data, timeout=None):
+            name = url.rsplit("/", 1)[-1]
+            if name == "upload_request":
+                return {"code": 0, "data": {"Reuse": False, "Bucket": "b", "Key": "k", "UploadId": "u",
+                                            "StorageNode": "s", "FileId": 42}}
+            if name == "s3_repare_upload_parts_batch":
+                start, end = data["partNumberStart"], data["partNumberEnd"]
+                calls["presign"].append((start, end))
+                gen = len(calls["presign"])
+                return {"code": 0, "data": {"presignedUrls": {
+                    str(n): f"https://s3/{n}?v={gen}" for n in range(start, end)}}}
+            if name == "upload_complete":
+                calls["complete"] += 1
+            return {"code": 0, "data": {}}
+
+        class Response:
+            def __init__(self, status, url, data, headers):
+                self.status = status
+                self._request = (url, data, headers)
+
+            async def __aenter__(self):
+                url, data, headers = self._request
+                if hasattr(data, "__aiter__"):
+                    data = b"".join([chunk async for chunk in data])
+                calls["put"].append((url, bytes(data)))
+                calls["put_headers"].append(headers)
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def read(self):
+                return b""
+
+        class Session:
+            def put(self, url, data=None, headers=None, timeout=None):
+                return Response(next(statuses, 200), url, data, headers)
+
+        pan._post_json = post_json
+        pan._session = Session()
+        return pan, calls
+
+    def _upload_file(self):
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp.write(b"a" * 10 + b"b" * 10 + b"c" * 5)
+        tmp.close()
+        self.addCleanup(os.unlink, tmp.name)
+        return tmp.name
+
+    @unittest.skipIf(aiohttp is None, "aiohttp未安装")
+    def test_up_load_retries_failed_put_with_fresh_link(self):
+        path = self._upload_file()
+        pan, calls = self._upload_pan([200, 403])
+        with mock.patch("pan123_async.asyncio.sleep", new=mock.AsyncMock()):
+            self.assertEqual(asyncio.run(pan.up_load(path, block_size=10)), 42)
+        self.assertEqual(calls["presign"], [(1, 4), (2, 3)])
+        self.assertEqual([url for url, _ in calls["put"]],
+                         ["https://s3/1?v=1", "https://s3/2?v=1", "https://s3/2?v=2", "https://s3/3?v=1"])
+        self.assertEqual(calls["put"][2][1], b"b" * 10)
+        self.assertEqual(calls["complete"], 1)
+
+    @unittest.skipIf(aiohttp is None, "aiohttp未安装")
+    def test_up_load_gives_up_after_retries(self):
+        path = self._upload_file()
+        pan, calls = self._upload_pan([500, 500, 500])
+        with mock.patch("pan123_async.asyncio.sleep", new=mock.AsyncMock()):
+            self.assertIsNone(asyncio.run(pan.up_load(path, block_size=10)))
+        self.assertEqual(len(calls["put"]), 3)
+        self.assertEqual(calls["complete"], 0)
+
+    @unittest.skipIf(aiohttp is None, "aiohttp未安装")
+    def test_up_load_parts_shaped(self):
+        path = self._upload_file()
+        pan, calls = self._upload_pan([])
+        consumed = []
+        bandwidth.configure(rate=10 ** 9)
+        self.addCleanup(bandwidth.configure)
+        with mock.patch.object(bandwidth.BandwidthShaper, "consume",
+                               lambda shaper, nbytes, user=None: consumed.append((nbytes, user))):
+            self.assertEqual(asyncio.run(pan.up_load(path, block_size=10, user="alice")), 42)
+        self.assertEqual(consumed, [(10, "alice"), (10, "alice"), (5, "alice")])
+        self.assertEqual([data for _, data in calls["put"]], [b"a" * 10, b"b" * 10, b"c" * 5])
+        self.assertEqual([h["Content-Length"] for h in calls["put_headers"]], ["10", "10", "5"])
+
+if __name__ == '__main__':
+    unittest.main()